@@ -364,8 +364,14 @@ def register():
     add_handler ( bpy.app.handlers.frame_change_pre, cellblender_mol_viz.frame_change_handler )
     add_handler ( bpy.app.handlers.frame_change_pre, cellblender_objects.frame_change_handler )
 
+    # Add the render handlers (molecules are rendered at full detail)
+    add_handler ( bpy.app.handlers.render_init, cellblender_mol_viz.lod_render_init )
+    add_handler ( bpy.app.handlers.render_complete, cellblender_mol_viz.lod_render_done )
+    add_handler ( bpy.app.handlers.render_cancel, cellblender_mol_viz.lod_render_done )
+
     # Add the load_pre handlers
     add_handler ( bpy.app.handlers.load_pre, cellblender_main.report_load_pre )
+    add_handler ( bpy.app.handlers.load_pre, cellblender_mol_viz.viz_frame_cache_load_pre )
 
     # Add the load_post handlers
     add_handler ( bpy.app.handlers.load_post, cellblender_simulation.disable_python )
@@ -406,7 +412,11 @@ def unregister():
 
     remove_handler ( bpy.app.handlers.frame_change_pre, cellblender_objects.frame_change_handler )
     remove_handler ( bpy.app.handlers.frame_change_pre, cellblender_mol_viz.frame_change_handler )
+    remove_handler ( bpy.app.handlers.render_init,      cellblender_mol_viz.lod_render_init )
+    remove_handler ( bpy.app.handlers.render_complete,  cellblender_mol_viz.lod_render_done )
+    remove_handler ( bpy.app.handlers.render_cancel,    cellblender_mol_viz.lod_render_done )
     remove_handler ( bpy.app.handlers.load_pre,         cellblender_main.report_load_pre )
+    remove_handler ( bpy.app.handlers.load_pre,         cellblender_mol_viz.viz_frame_cache_load_pre )
     remove_handler ( bpy.app.handlers.load_post, data_model.load_post )
     remove_handler ( bpy.app.handlers.load_post, cellblender_simulation.clear_run_list )
     remove_handler ( bpy.app.handlers.load_post, cellblender_objects.model_objects_update )
@@ -0,0 +1,297 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+"""
+This file contains the mesh analysis used by CellBlender's Meshalyzer.
+
+The analysis works on flat NumPy arrays exported from each mesh:
+  verts: (V,3) vertex coordinates
+  tris:  (F,3) vertex indices of each triangle (in polygon order)
+
+It doesn't depend on bpy so that batches of meshes can be analyzed in worker
+processes (or from the command line with .npz files holding verts, tris and
+matrix arrays). Results are cached by a hash of the mesh content so that only
+meshes that changed are analyzed again.
+"""
+
+import os
+import sys
+import site
+import json
+import hashlib
+import importlib.util
+import multiprocessing
+import concurrent.futures
+
+import numpy
+
+
+# Name used to import this file in worker processes (the cellblender package can't be imported without bpy)
+WORKER_MODULE = "cellblender_mesh_analysis"
+
+# Batches with fewer triangles than this are analyzed in this process (starting workers costs more)
+PARALLEL_MIN_FACES = 500000
+
+CACHE_VERSION = 1
+
+
+def transform_verts(verts, t_mat):
+    """ Apply t_mat the same way as "co @ t_mat" (a row vector times the matrix) """
+
+    m = numpy.array(t_mat, dtype=numpy.float64)
+    return verts @ m[0:3, 0:3] + m[3, 0:3]
+
+
+def mesh_area(tv, tris):
+    """ Compute the surface area of the triangles of the (transformed) vertices """
+
+    v0 = tv[tris[:, 0]]
+    cross = numpy.cross(tv[tris[:, 1]] - v0, tv[tris[:, 2]] - v0)
+    return float(0.5 * numpy.sqrt((cross * cross).sum(axis=1)).sum())
+
+
+def tri_vol(tv, tris):
+    """ Compute the signed volume enclosed by the triangles of the (transformed) vertices """
+
+    v0 = tv[tris[:, 0]]
+    det = (v0 * numpy.cross(tv[tris[:, 1]], tv[tris[:, 2]])).sum(axis=1)
+    return float(det.sum() / 6.0)
+
+
+def make_efdict(tris, num_verts):
+    """ Find the edges of the triangles and count the faces using each edge
+
+    Returns (edge_index, edge_face_count) where edge_index is the index of the
+    edge (into edge_face_count) of each triangle side (v0-v1, v1-v2, v2-v0).
+
+    """
+
+    v_from = tris.reshape(-1)
+    v_to = tris[:, [1, 2, 0]].reshape(-1)
+    edge_keys = numpy.minimum(v_from, v_to).astype(numpy.int64) * num_verts + numpy.maximum(v_from, v_to)
+    unique_keys, edge_index, edge_face_count = numpy.unique(edge_keys, return_inverse=True, return_counts=True)
+
+    return(edge_index.reshape((-1, 3)), edge_face_count)
+
+
+def check_manifold(edge_face_count):
+    """ Make sure the object is manifold """
+
+    if numpy.any(edge_face_count != 2):
+        return (0)
+
+    return(1)
+
+
+def check_closed(edge_face_count):
+    """ Make sure the object is closed (no leaks). """
+
+    if not numpy.all(edge_face_count == 2):
+        return (0)
+
+    return(1)
+
+
+def check_orientable(tris, edge_index, edge_face_count):
+    """ Make sure the two faces sharing each edge traverse it in opposite directions """
+
+    # Count the sides of each edge that run from its lower to its higher vertex
+    forward = (tris < tris[:, [1, 2, 0]]).reshape(-1)
+    num_forward = numpy.bincount(edge_index.reshape(-1), weights=forward, minlength=len(edge_face_count))
+    if numpy.any(num_forward[edge_face_count == 2] != 1):
+        return (0)
+
+    return (1)
+
+
+def analyze_mesh(verts, tris, t_mat):
+    """ Compute the area, volume and topology checks of a triangulated mesh
+
+    Returns a dictionary with 'area', 'volume', 'closed', 'manifold' and 'orientable'
+    (the volume is only computed for closed, manifold and orientable meshes).
+
+    """
+
+    tv = transform_verts(verts, t_mat)
+    (edge_index, edge_face_count) = make_efdict(tris, len(verts))
+    result = {
+        'area': mesh_area(tv, tris),
+        'closed': check_closed(edge_face_count),
+        'manifold': check_manifold(edge_face_count),
+        'orientable': check_orientable(tris, edge_index, edge_face_count),
+        'volume': 0 }
+    if result['orientable'] and result['manifold'] and result['closed']:
+        result['volume'] = tri_vol(tv, tris)
+    return result
+
+
+def mesh_hash(verts, tris, t_mat):
+    """ Return a hash of everything the analysis of a mesh depends on """
+
+    h = hashlib.sha1()
+    for a in (verts, tris, t_mat):
+        a = numpy.ascontiguousarray(a)
+        h.update(str((a.dtype.str, a.shape)).encode('utf-8'))
+        h.update(a.tobytes())
+    return h.hexdigest()
+
+
+class MeshAnalysisCache:
+    """ Analysis results keyed by mesh hash (saved as JSON when given a file name) """
+
+    def __init__(self, file_name=None):
+        self.file_name = file_name
+        self.results = {}
+        self.changed = False
+        if file_name is not None:
+            try:
+                with open(file_name, 'r') as f:
+                    cache = json.load(f)
+                if cache.get('version') == CACHE_VERSION:
+                    self.results = cache['results']
+            except (OSError, ValueError, KeyError):
+                pass
+
+    def get(self, key):
+        return self.results.get(key)
+
+    def put(self, key, result):
+        self.results[key] = result
+        self.changed = True
+
+    def save(self):
+        if (self.file_name is None) or not self.changed:
+            return
+        with open(self.file_name + ".tmp", 'w') as f:
+            json.dump({'version': CACHE_VERSION, 'results': self.results}, f)
+        os.replace(self.file_name + ".tmp", self.file_name)
+        self.changed = False
+
+
+def analyze_job(job):
+    """ Analyze one (key, verts, tris, t_mat) job and return (key, result) """
+
+    key, verts, tris, t_mat = job
+    return (key, analyze_mesh(verts, tris, t_mat))
+
+
+def worker_module():
+    """ Return this file imported under its top level name (which worker processes can import) """
+
+    if __name__ == WORKER_MODULE:
+        return sys.modules[__name__]
+    if not (WORKER_MODULE in sys.modules):
+        # Same as mol_viz_point_cache.worker_module (sibling imports resolve by their top level names too)
+        here = os.path.dirname(os.path.abspath(__file__))
+        sys.path.insert(0, here)
+        try:
+            spec = importlib.util.spec_from_file_location(WORKER_MODULE, os.path.abspath(__file__))
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[WORKER_MODULE] = module
+            spec.loader.exec_module(module)
+        finally:
+            sys.path.remove(here)
+    return sys.modules[WORKER_MODULE]
+
+
+def analyze_meshes(jobs, max_workers=None, python_path=None):
+    """ Analyze a list of (key, verts, tris, t_mat) jobs and return a {key: result} dictionary
+
+    Large batches are analyzed in a pool of processes running python_path (the
+    current interpreter by default) and small ones in this process. If the pool
+    can't be started, the jobs are analyzed here.
+
+    """
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    num_faces = sum([len(job[2]) for job in jobs])
+    results = {}
+    if (len(jobs) > 1) and (max_workers > 1) and (num_faces >= PARALLEL_MIN_FACES):
+        try:
+            ctx = multiprocessing.get_context('spawn')
+            if python_path is not None:
+                ctx.set_executable(python_path)
+            module = worker_module()
+            with concurrent.futures.ProcessPoolExecutor(max_workers=min(max_workers, len(jobs)), mp_context=ctx,
+                    initializer=site.addsitedir, initargs=(os.path.dirname(os.path.abspath(__file__)),)) as pool:
+                # Start the largest meshes first so one doesn't finish the batch alone
+                for key, result in pool.map(module.analyze_job, sorted(jobs, key=lambda job: -len(job[2]))):
+                    results[key] = result
+            return results
+        except (OSError, ImportError, concurrent.futures.process.BrokenProcessPool) as e:
+            print("Unable to analyze meshes in parallel (%s), analyzing them one at a time" % (str(e)))
+            results = {}
+    for job in jobs:
+        key, result = analyze_job(job)
+        results[key] = result
+    return results
+
+
+def analyze_with_cache(meshes, cache, max_workers=None, python_path=None):
+    """ Analyze a list of (name, verts, tris, t_mat), reusing cached results for unchanged meshes
+
+    Returns a list of (name, result, cached) in the order given.
+
+    """
+
+    keys = [mesh_hash(verts, tris, numpy.array(t_mat, dtype=numpy.float64)) for name, verts, tris, t_mat in meshes]
+    jobs = []
+    queued = set()
+    for key, (name, verts, tris, t_mat) in zip(keys, meshes):
+        if (cache.get(key) is None) and not (key in queued):
+            jobs.append((key, verts, tris, t_mat))
+            queued.add(key)
+    results = analyze_meshes(jobs, max_workers, python_path)
+    for key, result in results.items():
+        cache.put(key, result)
+    return [(name, cache.get(key), not (key in results)) for key, (name, verts, tris, t_mat) in zip(keys, meshes)]
+
+
+if __name__ == "__main__":
+
+    # Analyze meshes saved as .npz files with "verts", "tris" and (optionally) "matrix" arrays:
+    #   python cellblender_mesh_analysis.py [-j workers] [-c cache.json] mesh1.npz mesh2.npz ...
+
+    args = sys.argv[1:]
+    max_workers = None
+    cache_file = None
+    file_names = []
+    while len(args) > 0:
+        arg = args.pop(0)
+        if arg == "-j":
+            max_workers = int(args.pop(0))
+        elif arg == "-c":
+            cache_file = args.pop(0)
+        else:
+            file_names.append(arg)
+
+    meshes = []
+    for file_name in file_names:
+        data = numpy.load(file_name)
+        t_mat = data['matrix'] if 'matrix' in data else numpy.identity(4)
+        meshes.append((os.path.splitext(os.path.basename(file_name))[0], data['verts'], data['tris'], t_mat))
+
+    cache = MeshAnalysisCache(cache_file)
+    print("# Object  Surface Area  Volume  Closed  Manifold  Orientable")
+    for name, result, cached in analyze_with_cache(meshes, cache, max_workers):
+        print("%s %.9g %.9g %d %d %d" % (name, result['area'], result['volume'],
+              result['closed'], result['manifold'], result['orientable']))
+    cache.save()
@@ -35,14 +35,16 @@ from bpy.props import BoolProperty, CollectionProperty, EnumProperty, \
 #import mathutils
 
 # python imports
+import os
 import re
-import mathutils
+import numpy
 
 # CellBlender imports
 import cellblender
 from . import parameter_system
 from . import cellblender_release
 from . import cellblender_utils
+from . import cellblender_mesh_analysis
 
 
 
@@ -140,25 +142,20 @@ class MCELL_OT_meshalyzer(bpy.types.Operator):
         mcell.meshalyzer.genus_string = "Genus = %d" % (mcell.meshalyzer.genus)
 
 
-        area = 0
-        for f in mesh.polygons:
-            if not (len(f.vertices) == 3):
-                mcell.meshalyzer.status = "***** Mesh Not Triangulated *****"
-                mcell.meshalyzer.watertight = "Mesh Not Triangulated"
-                return {'FINISHED'}
+        (verts, tris) = mesh_arrays(mesh)
+        if tris is None:
+            mcell.meshalyzer.status = "***** Mesh Not Triangulated *****"
+            mcell.meshalyzer.watertight = "Mesh Not Triangulated"
+            return {'FINISHED'}
 
-            tv0 = mesh.vertices[f.vertices[0]].co @ t_mat
-            tv1 = mesh.vertices[f.vertices[1]].co @ t_mat
-            tv2 = mesh.vertices[f.vertices[2]].co @ t_mat
-            area = area + mathutils.geometry.area_tri(tv0, tv1, tv2)
+        result = cellblender_mesh_analysis.analyze_mesh(verts, tris, t_mat)
+        area = result["area"]
 
         mcell.meshalyzer.area = area
 
-        (edge_faces, edge_face_count) = make_efdict(mesh)
-
-        is_closed = check_closed(edge_face_count)
-        is_manifold = check_manifold(edge_face_count)
-        is_orientable = check_orientable(mesh, edge_faces, edge_face_count)
+        is_closed = result["closed"]
+        is_manifold = result["manifold"]
+        is_orientable = result["orientable"]
 
         if is_orientable:
             mcell.meshalyzer.normal_status = "Consistent Normals"
@@ -175,9 +172,8 @@ class MCELL_OT_meshalyzer(bpy.types.Operator):
         else:
             mcell.meshalyzer.manifold = "Non-manifold Mesh"
 
-        volume = 0
+        volume = result["volume"]
         if is_orientable and is_manifold and is_closed:
-            volume = mesh_vol(mesh, t_mat)
             if volume >= 0:
                 mcell.meshalyzer.normal_status = "Outward Facing Normals"
             else:
@@ -201,6 +197,9 @@ class MCELL_OT_gen_meshalyzer_report(bpy.types.Operator):
 
         mcell = context.scene.mcell
         objs = context.selected_objects
+        if (len(objs) == 0):
+            # Analyze all of the model objects when nothing is selected
+            objs = [ bpy.data.objects[o.name] for o in mcell.model_objects.object_list if o.name in bpy.data.objects ]
 
         mcell.meshalyzer.object_name = ''
         mcell.meshalyzer.vertices = 0
@@ -217,45 +216,54 @@ class MCELL_OT_gen_meshalyzer_report(bpy.types.Operator):
             mcell.meshalyzer.status = 'Please Select One or More Mesh Objects'
             return {'FINISHED'}
 
+        # Export the geometry of each object to arrays so they can be analyzed away from Blender
+        meshes = []
+        skipped = []
+        for obj in objs:
+            if not (obj.type == 'MESH'):
+                skipped.append ( (obj.name, 'Not a Mesh') )
+                continue
+            (verts, tris) = mesh_arrays(obj.data)
+            if tris is None:
+                skipped.append ( (obj.name, 'Mesh Not Triangulated') )
+                continue
+            meshes.append ( (obj.name, verts, tris, numpy.array(obj.matrix_world, dtype=numpy.float64)) )
+
+        # Only meshes that changed since they were last analyzed are analyzed again
+        cache = get_report_cache()
+        python_path = None
+        if sum([len(m[2]) for m in meshes]) >= cellblender_mesh_analysis.PARALLEL_MIN_FACES:
+            python_path = cellblender_utils.get_python_path(required_modules=['numpy'], mcell=mcell)
+        results = cellblender_mesh_analysis.analyze_with_cache(meshes, cache, python_path=python_path)
+        try:
+            cache.save()
+        except OSError as e:
+            print ( "Unable to save the meshalyzer cache: " + str(e) )
+        num_cached = len([r for r in results if r[2]])
+        print ( "Analyzed %d meshes (%d unchanged)" % (len(results), num_cached) )
+
         bpy.ops.text.new()
         report = bpy.data.texts['Text']
         report.name = 'mesh_analysis.txt'
         report.write("# Object  Surface Area  Volume\n")
 
-        for obj in objs:
+        for name, result, cached in results:
 
-            mcell.meshalyzer.object_name = obj.name
-
-            if not (obj.type == 'MESH'):
-                mcell.meshalyzer.status = 'Selected Object Not a Mesh'
-                return {'FINISHED'}
-
-            t_mat = obj.matrix_world
-            mesh=obj.data
+            obj = bpy.data.objects[name]
+            mesh = obj.data
+            mcell.meshalyzer.object_name = name
 
             mcell.meshalyzer.vertices = len(mesh.vertices)
             mcell.meshalyzer.edges = len(mesh.edges)
             mcell.meshalyzer.faces = len(mesh.polygons)
 
-            area = 0
-            for f in mesh.polygons:
-                if not (len(f.vertices) == 3):
-                    mcell.meshalyzer.status = '***** Mesh Not Triangulated *****'
-                    mcell.meshalyzer.watertight = 'Mesh Not Triangulated'
-                    return {'FINISHED'}
-
-                tv0 = mesh.vertices[f.vertices[0]].co @ t_mat
-                tv1 = mesh.vertices[f.vertices[1]].co @ t_mat
-                tv2 = mesh.vertices[f.vertices[2]].co @ t_mat
-                area = area + mathutils.geometry.area_tri(tv0,tv1,tv2)
+            area = result['area']
 
             mcell.meshalyzer.area = area
 
-            (edge_faces, edge_face_count) = make_efdict(mesh)
-
-            is_closed = check_closed(edge_face_count)
-            is_manifold = check_manifold(edge_face_count)
-            is_orientable = check_orientable(mesh,edge_faces,edge_face_count)
+            is_closed = result['closed']
+            is_manifold = result['manifold']
+            is_orientable = result['orientable']
 
             if is_orientable:
                 mcell.meshalyzer.normal_status = 'Consistent Normals'
@@ -272,114 +280,69 @@ class MCELL_OT_gen_meshalyzer_report(bpy.types.Operator):
             else:
                 mcell.meshalyzer.manifold = 'Non-manifold Mesh'
 
-            volume = 0
+            volume = result['volume']
             if is_orientable and is_manifold and is_closed:
-                volume = mesh_vol(mesh,t_mat)
                 if volume >= 0:
                     mcell.meshalyzer.normal_status = 'Outward Facing Normals'
                 else:
                     mcell.meshalyzer.normal_status = 'Inward Facing Normals'
 
             mcell.meshalyzer.volume = volume
+            mcell.meshalyzer.sav_ratio = 0
             if (not volume == 0.0):
                 mcell.meshalyzer.sav_ratio = area/volume
 
-            report.write("%s %.9g %.9g\n" % (obj.name, mcell.meshalyzer.area, mcell.meshalyzer.volume))
+            report.write("%s %.9g %.9g\n" % (name, mcell.meshalyzer.area, mcell.meshalyzer.volume))
+
+        for name, reason in skipped:
+            report.write("# %s: %s\n" % (name, reason))
 
         mcell.meshalyzer.status = ''
+        if len(skipped) > 0:
+            mcell.meshalyzer.status = '%d Objects Not Analyzed (see mesh_analysis.txt)' % (len(skipped))
         return {'FINISHED'}
 
 
-# Meshalyzer support functions
-
-
-def mesh_vol(mesh, t_mat):
-    """Compute volume of triangulated, orientable, watertight, manifold mesh
-
-    volume > 0 means outward facing normals
-    volume < 0 means inward facing normals
-
-    """
-
-    volume = 0.0
-    for f in mesh.polygons:
-        tv0 = mesh.vertices[f.vertices[0]].co @ t_mat
-        tv1 = mesh.vertices[f.vertices[1]].co @ t_mat
-        tv2 = mesh.vertices[f.vertices[2]].co @ t_mat
-        x0 = tv0.x
-        y0 = tv0.y
-        z0 = tv0.z
-        x1 = tv1.x
-        y1 = tv1.y
-        z1 = tv1.z
-        x2 = tv2.x
-        y2 = tv2.y
-        z2 = tv2.z
-        det = x0*(y1*z2-y2*z1)+x1*(y2*z0-y0*z2)+x2*(y0*z1-y1*z0)
-        volume = volume + det
+# Cache of analysis results (kept in the project files directory once the blend file is saved)
+report_cache = None
 
-    volume = volume/6.0
+def get_report_cache():
+    global report_cache
+    file_name = None
+    if len(bpy.data.filepath) > 0:
+        files_path = cellblender_utils.project_files_path()
+        if os.path.isdir(files_path):
+            file_name = os.path.join(files_path, 'meshalyzer_cache.json')
+    if (report_cache is None) or (report_cache.file_name != file_name):
+        report_cache = cellblender_mesh_analysis.MeshAnalysisCache(file_name)
+    return report_cache
 
-    return(volume)
-
-
-def make_efdict(mesh):
-
-    edge_faces = {}
-    edge_face_count = {}
-    for f in mesh.polygons:
-        for ek in f.edge_keys:
-            if ek in edge_faces:
-                edge_faces[ek] ^= f.index
-                edge_face_count[ek] = edge_face_count[ek] + 1
-            else:
-                edge_faces[ek] = f.index
-                edge_face_count[ek] = 1
 
-    return(edge_faces, edge_face_count)
-
-
-def check_manifold(edge_face_count):
-    """ Make sure the object is manifold """
-
-    for ek in edge_face_count.keys():
-        if edge_face_count[ek] != 2:
-            return (0)
-
-    return(1)
-
-
-def check_closed(edge_face_count):
-    """ Make sure the object is closed (no leaks). """
+# Meshalyzer support functions
 
-    for ek in edge_face_count.keys():
-        if not edge_face_count[ek] == 2:
-            return (0)
+# The analysis itself (in cellblender_mesh_analysis) works on flat NumPy arrays pulled from the mesh with foreach_get
 
-    return(1)
 
+def mesh_arrays(mesh):
+    """ Return (verts, tris) for a mesh (tris is None if the mesh isn't triangulated) """
 
-def check_orientable(mesh, edge_faces, edge_face_count):
+    # Matching the float32 storage of the coordinates keeps foreach_get on its fast path
+    verts = numpy.empty(3*len(mesh.vertices), dtype=numpy.float32)
+    mesh.vertices.foreach_get('co', verts)
+    verts = verts.reshape((-1, 3)).astype(numpy.float64)
 
-    ev_order = [[0, 1], [1, 2], [2, 0]]
-    edge_checked = {}
+    loop_totals = numpy.empty(len(mesh.polygons), dtype=numpy.int32)
+    mesh.polygons.foreach_get('loop_total', loop_totals)
+    if not numpy.all(loop_totals == 3):
+        return (verts, None)
 
-    for f in mesh.polygons:
-        for i in range(0, len(f.vertices)):
-            ek = f.edge_keys[i]
-            if not ek in edge_checked:
-                edge_checked[ek] = 1
-                if edge_face_count[ek] == 2:
-                    nfi = f.index ^ edge_faces[ek]
-                    nf = mesh.polygons[nfi]
-                    for j in range(0, len(nf.vertices)):
-                        if ek == nf.edge_keys[j]:
-                            if f.vertices[ev_order[i][0]] != nf.vertices[
-                                    ev_order[j][1]]:
-                                return (0)
-                            break
+    loop_starts = numpy.empty(len(mesh.polygons), dtype=numpy.int32)
+    mesh.polygons.foreach_get('loop_start', loop_starts)
+    loop_verts = numpy.empty(len(mesh.loops), dtype=numpy.int32)
+    mesh.loops.foreach_get('vertex_index', loop_verts)
+    tris = loop_verts[loop_starts[:, None] + numpy.arange(3)]
 
-    return (1)
+    return (verts, tris)
 
 
 # Meshalyzer Panel Classes
@@ -43,6 +43,9 @@ import os
 import random
 import re
 import json
+import zlib
+import functools
+import numpy
 
 # CellBlender imports
 import cellblender
@@ -50,6 +53,11 @@ import cellblender
 import cellblender.parameter_system as parameter_system 
 import cellblender.cellblender_release as cellblender_release 
 import cellblender.cellblender_utils as cellblender_utils 
+import cellblender.mol_viz_io as mol_viz_io
+import cellblender.mol_viz_cache as mol_viz_cache
+import cellblender.mol_viz_trajectory as mol_viz_trajectory
+import cellblender.mol_viz_lod as mol_viz_lod
+import cellblender.mol_viz_point_cache as mol_viz_point_cache
     
 from cellblender.cellblender_utils import timeline_view_all
 from cellblender.cellblender_utils import mcell_files_path
@@ -60,6 +68,29 @@ from cellblender.cellblender_utils import mcell_files_path
 
 global_mol_file_list = []
 
+# Names of the molecule viz objects left empty in the current frame because
+# they were hidden and an index allowed their data to be skipped
+skipped_viz_species = set()
+
+# Decoded frames (shared by all scenes) with background prefetching of nearby frames
+viz_frame_cache = mol_viz_cache.VizFrameCache()
+
+# Molecule viz object names for each species name in the viz files of a run (see viz_object_names)
+viz_species_objects = {}
+# Limit on the number of distinct species (MCell4 complexes) whose names are remembered
+SPECIES_NAME_CACHE_SIZE = 65536
+
+# Random orientations for volume molecules by viz object name (grown in chunks as needed)
+orientation_pools = {}
+ORIENTATION_CHUNK = 4096
+
+# Random orientations for volume molecules with ids (from version 2 viz files) indexed by a hash of the id
+id_orientation_table = None
+ID_ORIENTATION_BITS = 16
+
+# Set while rendering so every molecule is drawn (level of detail only applies to the viewport)
+lod_full_detail = False
+
 
 def create_color_list():
     """ Create a list of colors to be assigned to the glyphs. """
@@ -109,6 +140,12 @@ def read_viz_data_load_post(context):
     bpy.ops.mcell.read_viz_data()
 
 
+@persistent
+def viz_frame_cache_load_pre(context):
+    """ Drop the frames (and prefetch threads) of the file being closed. """
+    viz_frame_cache.shutdown()
+
+
 @persistent
 def viz_data_save_post(context):
     # context appears to be None
@@ -257,10 +294,11 @@ class MCELL_OT_read_viz_data(bpy.types.Operator):
 
         global_mol_file_list = []
         mol_file_list = []
+        viz_frame_cache.clear()
 
-        if mol_file_dir != '':
-          mol_file_list = [ f for f in glob.glob(os.path.join(mol_file_dir, "*.dat")) ]
-          mol_file_list.sort()
+        if (mol_file_dir != '') and os.path.isdir(mol_file_dir):
+          # The same frames (in the same order) that the point cache export indexes
+          mol_file_list = [ os.path.join(mol_file_dir, f) for f in mol_viz_point_cache.seed_frame_names(mol_file_dir) ]
 
         if mol_file_list:
           # Add all the viz_data files to global_mol_file_list (e.g.
@@ -288,6 +326,9 @@ class MCELL_OT_read_viz_data(bpy.types.Operator):
           else:
             mol_viz.mol_file_index = 0
 
+          # The species may be different in this run
+          viz_species_objects.clear()
+
           try:
               mol_viz_clear(mcell, force_clear=True)
               mol_viz_update(self, context)
@@ -298,6 +339,17 @@ class MCELL_OT_read_viz_data(bpy.types.Operator):
 
 
 
+def add_stored_frames ( mol_file_dir, mol_file_list ):
+    """ Add the frames stored in trajectory files or the point cache (by their original file names) to a list of frame files """
+    file_set = set ( mol_file_list )
+    for frame_name in mol_viz_point_cache.stored_frame_names ( mol_file_dir ):
+        frame_path = os.path.join ( mol_file_dir, frame_name )
+        if not (frame_path in file_set):
+            file_set.add ( frame_path )
+            mol_file_list.append ( frame_path )
+    return mol_file_list
+
+
 # Mol Viz callback functions
 
 
@@ -359,13 +411,15 @@ class MCELL_OT_select_viz_data(bpy.types.Operator):
 
         mcell.mol_viz.mol_file_dir = mol_file_dir
 
-        mol_file_list = [ f for f in glob.glob(os.path.join(mol_file_dir, "*")) if not f.endswith(os.sep + "viz_bngl") ]
+        mol_file_list = [ f for f in glob.glob(os.path.join(mol_file_dir, "*")) if not (f.endswith(os.sep + "viz_bngl") or f.endswith(os.sep + mol_viz_point_cache.POINT_CACHE_DIR) or f.endswith(mol_viz_io.VIZ_INDEX_SUFFIX) or f.endswith(mol_viz_trajectory.TRAJECTORY_SUFFIX)) ]
+        mol_file_list = add_stored_frames ( mol_file_dir, mol_file_list )
         print ( "Select found " + str(len(mol_file_list)) + " files" )
         mol_file_list.sort()
 
         # Reset mol_file_list and mol_viz_seed_list to empty
 #        mcell.mol_viz.mol_file_list.clear()
         global_mol_file_list = []
+        viz_frame_cache.clear()
 
         for mol_file_name in mol_file_list:
 #            new_item = mcell.mol_viz.mol_file_list.add()
@@ -386,6 +440,65 @@ class MCELL_OT_select_viz_data(bpy.types.Operator):
         context.window_manager.fileselect_add(self)
         return {'RUNNING_MODAL'}
 
+class MCELL_OT_build_viz_index(bpy.types.Operator):
+    bl_idname = "mcell.build_viz_index"
+    bl_label = "Index Viz Data"
+    bl_description = "Write an index beside each binary viz file so only visible molecules are read"
+    bl_options = {'REGISTER'}
+
+    def execute(self, context):
+        mol_file_dir = context.scene.mcell.mol_viz.mol_file_dir
+        if os.path.isdir(mol_file_dir):
+            num_indexed = mol_viz_io.index_viz_files ( [mol_file_dir] )
+            self.report({'INFO'}, "Indexed %d viz files in %s" % (num_indexed, mol_file_dir))
+        return {'FINISHED'}
+
+
+class MCELL_OT_mol_viz_lod_roi_from_selection(bpy.types.Operator):
+    bl_idname = "mcell.mol_viz_lod_roi_from_selection"
+    bl_label = "Region from Selection"
+    bl_description = "Show every molecule inside the bounding box of the selected objects"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    def execute(self, context):
+        corners = [ obj.matrix_world @ mathutils.Vector(corner)
+                    for obj in context.selected_objects for corner in obj.bound_box ]
+        if not corners:
+            self.report({'WARNING'}, "Select the objects enclosing the region of interest")
+            return {'CANCELLED'}
+        mv = context.scene.mcell.mol_viz
+        mv.lod_roi_min = [ min([c[i] for c in corners]) for i in range(3) ]
+        mv.lod_roi_max = [ max([c[i] for c in corners]) for i in range(3) ]
+        mv.lod_roi_enable = True
+        return {'FINISHED'}
+
+
+class MCELL_OT_export_point_cache(bpy.types.Operator):
+    bl_idname = "mcell.export_point_cache"
+    bl_label = "Export Point Cache"
+    bl_description = "Convert the viz data of this seed (from the start to the stop frame) to point cache files read directly by Mol Viz"
+    bl_options = {'REGISTER'}
+
+    def execute(self, context):
+        mcell = context.scene.mcell
+        mv = mcell.mol_viz
+        if not os.path.isdir(mv.mol_file_dir):
+            self.report({'ERROR'}, "No viz data to export")
+            return {'CANCELLED'}
+        python_path = cellblender_utils.get_python_path(required_modules=['numpy'], mcell=mcell)
+        num_written, num_current, errors = mol_viz_point_cache.export_point_cache (
+            mv.mol_file_dir, start=mv.mol_file_start_index, stop=mv.mol_file_stop_index,
+            step=mv.mol_file_step_index, python_path=python_path,
+            frame_names=global_mol_file_list )
+        for filepath, error in errors:
+            print ( "Unable to export %s to the point cache: %s" % (filepath, error) )
+        if errors:
+            self.report({'WARNING'}, "Unable to export %d frames (see the console)" % (len(errors)))
+        else:
+            self.report({'INFO'}, "Exported %d frames (%d already current)" % (num_written, num_current))
+        return {'FINISHED'}
+
+
 class MCELL_OT_mol_viz_set_index(bpy.types.Operator):
     bl_idname = "mcell.mol_viz_set_index"
     bl_label = "Set Molecule File Index"
@@ -429,6 +542,26 @@ def frame_change_handler(scn):
         #    bpy.ops.render.render(write_still=True)
 
 
+@persistent
+def lod_render_init(scn):
+    """ Draw every molecule while rendering. """
+    global lod_full_detail
+
+    lod_full_detail = True
+    if scn.mcell.mol_viz.lod_enable:
+        mol_viz_update(None, bpy.context)
+
+
+@persistent
+def lod_render_done(scn):
+    """ Go back to the level of detail display after rendering. """
+    global lod_full_detail
+
+    lod_full_detail = False
+    if scn.mcell.mol_viz.lod_enable:
+        mol_viz_update(None, bpy.context)
+
+
 def mol_viz_toggle_manual_select(self, context):
     """ Toggle the option to manually load viz data. """
     global global_mol_file_list
@@ -482,59 +615,73 @@ def mol_viz_update(self, context):
         global_undo = bpy.context.preferences.edit.use_global_undo
         bpy.context.preferences.edit.use_global_undo = False
 
-        mol_viz_clear(mcell)
+        # Species in the new frame are refilled in place, so only the others are cleared
+        old_mol_names = [item.name for item in mcell.mol_viz.mol_viz_list]
+        mcell.mol_viz.mol_viz_list.clear()
         if mcell.mol_viz.mol_viz_enable:
             mol_viz_file_read(mcell, filepath)
+            prefetch_viz_frames(mcell)
+        new_mol_names = set([item.name for item in mcell.mol_viz.mol_viz_list])
+        clear_mol_viz_meshes([name for name in old_mol_names if not (name in new_mol_names)])
 
         # Reset undo back to its original state
         bpy.context.preferences.edit.use_global_undo = global_undo
     return
 
 
-def mol_viz_clear(mcell_prop, force_clear=False):
-    """ Clear the viz data from the previous frame. """
+def prefetch_viz_frames(mcell):
+    """ Start decoding the frames around the current frame in the background. """
+    mv = mcell.mol_viz
+    if not (mv.frame_cache_enable and (mv.prefetch_frames > 0)):
+        return
+    index = mv.mol_file_index
+    num_files = len(global_mol_file_list)
+    # Frames ahead of the current frame are requested first since they're needed for playback
+    frame_indices = [ index + i for i in range(1, mv.prefetch_frames+1) if index + i < num_files ]
+    frame_indices += [ index - i for i in range(1, mv.prefetch_frames+1) if index - i >= 0 ]
+    frame_paths = [ os.path.join(mv.mol_file_dir, global_mol_file_list[i]) for i in frame_indices ]
+    if mv.point_cache_enable:
+        # Point cache frames are mapped when they're needed rather than decoded ahead of time
+        frame_paths = [ f for f in frame_paths if mol_viz_point_cache.find_point_cache_frame(f) is None ]
+    # Hidden species aren't decoded (in frames with an index)
+    viz_frame_cache.prefetch ( frame_paths, visible_species_selector(hidden_viz_object_names()) )
 
-    mcell = mcell_prop
-    scn = bpy.context.scene
-    scn_objs = bpy.context.scene.collection.children[0].objects
-    meshes = bpy.data.meshes
-    objs = bpy.data.objects
 
-    if force_clear:
-      mol_viz_list = [obj for obj in scn_objs if (obj.name[:4] == 'mol_') and (obj.name[-6:] != '_shape')]
-    else:
-      mol_viz_list = mcell.mol_viz.mol_viz_list
+def frame_cache_size_callback(self, context):
+    viz_frame_cache.set_max_bytes ( self.frame_cache_size_mb * 1024 * 1024 )
+
 
-    for mol_item in mol_viz_list:
-        mol_name = mol_item.name
+def frame_cache_enable_callback(self, context):
+    if not self.frame_cache_enable:
+        viz_frame_cache.clear()
+
+
+def clear_mol_viz_meshes(mol_names):
+    """ Remove the vertices of the named molecule objects (keeping the objects and their meshes) """
+
+    scn_objs = bpy.context.scene.collection.children[0].objects
+    for mol_name in mol_names:
         mol_obj = scn_objs.get(mol_name)
-        if mol_obj:
-            hide = mol_obj.hide_viewport
+        if mol_obj and (mol_obj.type == 'MESH') and (len(mol_obj.data.vertices) > 0):
+            mol_obj.data.clear_geometry()
 
-            mol_pos_mesh = mol_obj.data
-            mol_pos_mesh_name = mol_pos_mesh.name
-            mol_shape_obj_name = "%s_shape" % (mol_name)
-            mol_shape_obj = objs.get(mol_shape_obj_name)
-            if mol_shape_obj:
-                mol_shape_obj.parent = None
 
-            scn_objs.unlink(mol_obj)
-            objs.remove(mol_obj)
-            meshes.remove(mol_pos_mesh)
+def mol_viz_clear(mcell_prop, force_clear=False):
+    """ Clear the viz data from the previous frame.
 
-            mol_pos_mesh = meshes.new(mol_pos_mesh_name)
-            mol_obj = objs.new(mol_name, mol_pos_mesh)
-            scn_objs.link(mol_obj)
+    The molecule objects and their position meshes are kept (and refilled by
+    mol_viz_file_read) so only their vertices are removed here.
+    """
 
-            if mol_shape_obj:
-                mol_shape_obj.parent = mol_obj
+    mcell = mcell_prop
+    scn_objs = bpy.context.scene.collection.children[0].objects
 
-            mol_obj.instance_type = 'VERTS'
-            mol_obj.use_instance_vertices_rotation = True
-            mols_obj = objs.get("molecules")
-            mol_obj.parent = mols_obj
+    if force_clear:
+      mol_viz_list = [obj for obj in scn_objs if (obj.name[:4] == 'mol_') and (obj.name[-6:] != '_shape')]
+    else:
+      mol_viz_list = mcell.mol_viz.mol_viz_list
 
-            mol_obj.hide_viewport = hide
+    clear_mol_viz_meshes([mol_item.name for mol_item in mol_viz_list])
 
     # Reset mol_viz_list to empty
     for i in range(len(mcell.mol_viz.mol_viz_list)-1, -1, -1):
@@ -818,18 +965,210 @@ def remove_compartment_and_state(name):
     return em_no_components
             
         
+@functools.lru_cache(maxsize=SPECIES_NAME_CACHE_SIZE)
 def get_used_molecule_names(name):
     # example of input:
     # '@EC:scov2(s!1,s!2,s!3,s!4,s!5).spike(v!1,a)@CP.spike(v!1,a)@CP'
     # output:
-    # ['scov', 'spike']
+    # ('scov', 'spike')
+    # The same complexes appear in every frame, so the results are remembered
     res = set()
     split_by_dot = name.split('.')
     for em in split_by_dot:
         # remove compartment and states
         res.add(remove_compartment_and_state(em))
-    return sorted(list(res))            
-            
+    return tuple(sorted(res))
+
+
+def viz_object_names(name, split_complexes):
+    """ Return the names of the molecule viz objects ("mol_" names) for a species name in a viz file.
+
+    Complexes are split into their elementary molecules when split_complexes is
+    True (MCell4 binary files and all ASCII files). The mapping is kept until
+    viz data is read again (for a new run) or it holds too many species.
+    """
+    key = (name, split_complexes)
+    names = viz_species_objects.get(key)
+    if names is None:
+        if split_complexes:
+            names = tuple(["mol_%s" % (n) for n in get_used_molecule_names(name)])
+        else:
+            names = ("mol_%s" % (name),)
+        if len(viz_species_objects) >= SPECIES_NAME_CACHE_SIZE:
+            viz_species_objects.clear()
+        viz_species_objects[key] = names
+    return names
+
+
+def hidden_viz_object_names():
+    """ Return the names of the molecule viz objects hidden in the viewport """
+    scn_objs = bpy.context.scene.collection.children[0].objects
+    return set ( [ obj.name for obj in scn_objs if obj.name.startswith('mol_') and obj.hide_viewport ] )
+
+
+def is_hidden_species(name, hidden_names, split_complexes):
+    """ Return True if none of the viz objects of a species are visible """
+    return not [ n for n in viz_object_names(name, split_complexes) if not (n in hidden_names) ]
+
+
+def visible_species_selector(hidden_names):
+    """ Return a function giving the visible species of a binary frame file from its index (None to read all)
+
+    Only binary frames have indexes, so their complexes are split in MCell4 mode only.
+    """
+    if not hidden_names:
+        return None
+    split_complexes = bpy.context.scene.mcell.cellblender_preferences.mcell4_mode
+
+    def select(filepath):
+        index = mol_viz_io.read_viz_index(filepath)
+        if index is None:
+            return None
+        return frozenset ( [ entry['name'] for entry in index['species']
+                             if not is_hidden_species(entry['name'], hidden_names, split_complexes) ] )
+    return select
+
+
+def hide_viz_blocks(blocks, hidden_names, split_complexes):
+    """ Empty the blocks of hidden species and add their viz object names to skipped_viz_species """
+    if not hidden_names:
+        return blocks
+    visible_blocks = []
+    for block in blocks:
+        if is_hidden_species(block.name, hidden_names, split_complexes):
+            skipped_viz_species.update ( viz_object_names(block.name, split_complexes) )
+            if block.count > 0:
+                block = mol_viz_io.VizSpeciesBlock ( block.name, block.mol_type, numpy.zeros((0,3), dtype=numpy.float32) )
+        visible_blocks.append ( block )
+    return visible_blocks
+
+
+def read_visible_viz_blocks(mcell, filepath, index, hidden_names):
+    """ Use a frame's index to read only the blocks of visible species.
+
+    The index lists all species, so hidden species are still returned (with
+    no molecules).
+    """
+    split_complexes = mcell.cellblender_preferences.mcell4_mode
+    load_names = set()
+    blocks = []
+    for entry in index['species']:
+        if is_hidden_species(entry['name'], hidden_names, split_complexes):
+            blocks.append ( mol_viz_io.VizSpeciesBlock ( entry['name'], entry['mol_type'], numpy.zeros((0,3), dtype=numpy.float32) ) )
+        else:
+            load_names.add ( entry['name'] )
+    blocks.extend ( mol_viz_io.read_indexed_viz_blocks(filepath, index, load_names) )
+    return blocks
+
+
+def read_visible_point_cache(mcell, cache_path, hidden_names):
+    """ Read only the blocks of visible species from a point cache file (returns (blocks, viz_version)).
+
+    Hidden species are still returned (with no molecules).
+    """
+    names = None
+    if hidden_names:
+        header = mol_viz_point_cache.read_point_cache_header(cache_path)
+        split_complexes = (header['viz_version'] == 0) or mcell.cellblender_preferences.mcell4_mode
+        names = set ( [ entry['name'] for entry in header['species']
+                        if not is_hidden_species(entry['name'], hidden_names, split_complexes) ] )
+    return mol_viz_point_cache.read_point_cache(cache_path, names)
+
+
+def pooled_orientations(mol_name, count):
+    """ Return (count,3) random orientations for the volume molecules of a viz object.
+
+    The orientations come from a pool that is only extended when more are needed
+    (each chunk is seeded by the name and chunk number) so they're the same in
+    every frame.
+    """
+    pool = orientation_pools.get(mol_name)
+    num_old = 0 if pool is None else len(pool)
+    if count == 0:
+        return numpy.zeros((0, 3), dtype=numpy.float32)
+    if num_old < count:
+        seed = zlib.crc32(mol_name.encode('utf-8'))
+        chunks = [] if pool is None else [pool]
+        for chunk in range(num_old // ORIENTATION_CHUNK, (count + ORIENTATION_CHUNK - 1) // ORIENTATION_CHUNK):
+            rng = numpy.random.default_rng([seed, chunk])
+            chunks.append(rng.uniform(-1.0, 1.0, (ORIENTATION_CHUNK, 3)).astype(numpy.float32))
+        pool = numpy.concatenate(chunks)
+        orientation_pools[mol_name] = pool
+    return pool[:count]
+
+
+def id_orientations(ids):
+    """ Return (N,3) orientations looked up by molecule id (so each molecule keeps its own) """
+    global id_orientation_table
+    if id_orientation_table is None:
+        rng = numpy.random.default_rng(0)
+        id_orientation_table = rng.uniform(-1.0, 1.0, (1 << ID_ORIENTATION_BITS, 3)).astype(numpy.float32)
+    # Multiplicative hashing spreads consecutive ids over the table
+    index = (ids.astype(numpy.uint32) * numpy.uint32(2654435761)) >> numpy.uint32(32 - ID_ORIENTATION_BITS)
+    return id_orientation_table[index]
+
+
+def merge_viz_arrays(mol_name, pos_list, orient_list, id_list):
+    """ Merge per-block position and orientation arrays into single (N,3) float32 arrays.
+
+    Blocks without orientations (volume molecules) are oriented by their molecule
+    ids when the file has them and from the viz object's orientation pool otherwise,
+    so they don't change from frame to frame.
+    A single surface block is returned as is (without copying).
+    """
+    use_ids = [ (orient is None) and (ids is not None) and (len(ids) == len(pos))
+                for pos, orient, ids in zip(pos_list, orient_list, id_list) ]
+    mol_pos = pos_list[0] if len(pos_list) == 1 else numpy.concatenate(pos_list)
+    # Volume molecules of many complexes (MCell4) are oriented all at once rather than block by block
+    if all(use_ids):
+        ids = id_list[0] if len(id_list) == 1 else numpy.concatenate(id_list)
+        return mol_pos, id_orientations(ids)
+    if not [ 1 for orient, by_id in zip(orient_list, use_ids) if (orient is not None) or by_id ]:
+        return mol_pos, pooled_orientations(mol_name, len(mol_pos))
+    num_pooled = sum([ len(pos) for pos, orient, by_id in zip(pos_list, orient_list, use_ids) if (orient is None) and not by_id ])
+    pool = pooled_orientations(mol_name, num_pooled)
+    pool_start = 0
+    orients = []
+    for pos, orient, ids, by_id in zip(pos_list, orient_list, id_list, use_ids):
+        if by_id:
+            orient = id_orientations(ids)
+        elif orient is None:
+            orient = pool[pool_start:pool_start+len(pos)]
+            pool_start += len(pos)
+        orients.append(orient)
+    if len(pos_list) == 1:
+        return mol_pos, orients[0]
+    return mol_pos, numpy.concatenate(orients)
+
+
+def reduce_viz_arrays(mv, mol_pos, mol_orient, id_list):
+    """ Reduce the molecules of a species to the level of detail budget.
+
+    Returns (positions, orientations).
+    """
+    if lod_full_detail or not mv.lod_enable or (len(mol_pos) <= mv.lod_budget):
+        return mol_pos, mol_orient
+    ids = None
+    if not [ 1 for block_ids in id_list if block_ids is None ]:
+        ids = id_list[0] if len(id_list) == 1 else numpy.concatenate(id_list)
+    roi = None
+    if mv.lod_roi_enable:
+        roi = (tuple(mv.lod_roi_min), tuple(mv.lod_roi_max))
+    return mol_viz_lod.reduce_molecules(mol_pos, mol_orient, mv.lod_budget, ids, roi)
+
+
+def set_mol_pos_mesh_vertices(mol_pos_mesh, mol_pos, mol_orient):
+    """ Fill a molecule position mesh in place with (N,3) position and orientation arrays """
+    num_mols = len(mol_pos)
+    if len(mol_pos_mesh.vertices) != num_mols:
+        # Meshes can only grow, so clear the old vertices before adding the new count
+        if len(mol_pos_mesh.vertices) > 0:
+            mol_pos_mesh.clear_geometry()
+        mol_pos_mesh.vertices.add(num_mols)
+    mol_pos_mesh.vertices.foreach_set("co", mol_pos.ravel())
+    mol_pos_mesh.vertices.foreach_set("normal", mol_orient.ravel())
+    mol_pos_mesh.update()
+
 
 def mol_viz_file_read(mcell, filepath):
     """ Read and Draw the molecule viz data for the current frame. """
@@ -861,137 +1200,88 @@ def mol_viz_file_read(mcell, filepath):
         if mv.viz_code == 'custom':
             return
 
+    # Molecules of species that were skipped (hidden) while reading this frame
+    skipped_viz_species.clear()
+
+    # Frames exported to the point cache are read from it (whether or not the frame file is still there)
+    cache_path = None
+    if mv.point_cache_enable:
+        cache_path = mol_viz_point_cache.find_point_cache_frame(filepath)
+
+    # Frames that aren't on the disk may be stored in a trajectory file
+    traj_frame = None
+    if cache_path is not None:
+        pass
+    elif not os.path.exists(filepath):
+        traj_frame = mol_viz_trajectory.find_trajectory_frame(filepath)
+        if traj_frame is None:
+            print(("\n***** Viz file not found: %s\n") % (filepath))
+            return
     # check whether the viz file is not empty (may happen for ASCII files)
-    if os.path.getsize(filepath) == 0:
+    elif os.path.getsize(filepath) == 0:
         return
 
-    dup_check = False
     try:
 
 #        begin = resource.getrusage(resource.RUSAGE_SELF)[0]
 #        print ("Processing molecules from file:    %s" % (filepath))
 
-        # Quick check for Binary or ASCII format of molecule file:
-        mol_file = open(filepath, "rb")
-        b = array.array("I")
-        b.fromfile(mol_file, 1)
-
+        # Each mol_dict entry is [mol_type, list of position arrays, list of orientation arrays, list of id arrays]
         mol_dict = {}
+        mol_viz_names = set ( [ item.name for item in mcell.mol_viz.mol_viz_list ] )
+        hidden_names = hidden_viz_object_names()
+
+        # Quick check for Binary or ASCII format of molecule file (trajectories are treated as binary):
+        bin_data = 1
+        if (traj_frame is None) and (cache_path is None):
+            bin_data = 1 if mol_viz_io.viz_file_version(filepath) > 0 else 0
+
+        if cache_path is not None:
+            # The arrays are views into the memory mapped cache file (so they're not kept in the frame cache)
+            blocks, viz_version = read_visible_point_cache(mcell, cache_path, hidden_names)
+            bin_data = 1 if viz_version > 0 else 0
+        elif mv.frame_cache_enable:
+            # The frame from the cache (decoded in the background or decoded now)
+            # Frames with an index are decoded without their hidden species
+            select = visible_species_selector(hidden_names)
+            blocks = viz_frame_cache.get(filepath, None if select is None else select(filepath))
+        elif traj_frame is not None:
+            traj, frame = traj_frame
+            blocks = traj.read_frame(frame)
+        elif bin_data:
+            # Read MCell/CellBlender Binary Format molecule file (version 1 or 2)
+            # The position and orientation arrays are views into the memory mapped file
+            index = mol_viz_io.read_viz_index(filepath)
+            if index is None:
+                blocks = mol_viz_io.read_binary_viz_frame(filepath)
+            else:
+                blocks = read_visible_viz_blocks(mcell, filepath, index, hidden_names)
+        else:
+            # Read ASCII format molecule file in chunks grouped by species name
+            blocks = mol_viz_io.read_ascii_viz_frame(filepath)
 
-        if b[0] == 1 or b[0] == 2:
-            ver = b[0] 
-            # Read MCell/CellBlender Binary Format molecule file, version 1:
-            # print ("Reading binary file " + filepath )
-            bin_data = 1
-            while True:
-                try:
-                    # ni = Initially, byte array of molecule name length.
-                    # Later, array of number of molecule positions in xyz
-                    # (essentially, the number of molecules multiplied by 3).
-                    # ns = Array of ascii character codes for molecule name.
-                    # s = String of molecule name.
-                    # mt = Surface molecule flag.
-                    if ver == 1:
-                        ni = array.array("B")          # Create a binary byte ("B") array to read one byte
-                    else:
-                        ni = array.array("I")          # Create a binary integer ("I") array to read 4 bytes
-                    ni.fromfile(mol_file, 1)       # Read one or four bytes which is the number of characters in the molecule name
-                    
-                    ns = array.array("B")          # Create another byte array to hold the molecule name
-                    ns.fromfile(mol_file, ni[0])   # Read ni bytes from the file
-                    mol_name_from_file = ns.tobytes().decode()     # Decode bytes as ASCII into a string (s)
-                    
-                    mt = array.array("B")          # Create a byte array for the molecule type
-                    mt.fromfile(mol_file, 1)       # Read one byte for the molecule type
-                    ni = array.array("I")          # Re-use ni as an integer array to hold the number of molecules of this name in this frame
-                    ni.fromfile(mol_file, 1)       # Read the 4 byte integer value which is the number of molecules (v2) or 3 times the number of molecules (v1)
-                    
-                    if ver > 1:
-                        num_mols = ni[0]
-                        num_floats = 3*ni[0]
-                        mol_ids = array.array("I")  # Molecule ids are gnored in cellblender         
-                        mol_ids.fromfile(mol_file, num_mols)
-                    else:
-                        num_floats = ni[0]
-                        mol_ids = None 
-                        
-                    mol_pos = array.array("f")     # Create a floating point array to hold the positions
-                    mol_orient = array.array("f")  # Create a floating point array to hold the orientations
-                    mol_pos.fromfile(mol_file, num_floats)  # Read all the positions which should be 3 floats per molecule
-                    if mt[0] == 1:                                        # If mt==1, it's a surface molecule
-                        mol_orient.fromfile(mol_file, num_floats)              # Read all the surface molecule orientations
-                    
-                    if mcell.cellblender_preferences.mcell4_mode:
-                        elem_mol_names = get_used_molecule_names(mol_name_from_file)
-                    else:
-                        # MCell3(R) in binary viz mode already splits the complexes into individual molecules
-                        elem_mol_names = [mol_name_from_file]
-                
-                    for elem_mol_name in elem_mol_names:                                    
-                        mol_name = "mol_%s" % (elem_mol_name)      # Construct name of blender molecule viz object
-                        
-                        # we must append positions and orientations if this mol type already exists
-                        if mol_name not in mol_dict: 
-                            mol_dict[mol_name] = [mt[0], mol_pos, mol_orient]     # Create a dictionary entry for this molecule containing a list of relevant data
-                        else:
-                            mol_dict[mol_name][1].extend(mol_pos)
-                            mol_dict[mol_name][2].extend(mol_orient)
-                        
-                        if len(mcell.mol_viz.mol_viz_list) > 0:
-                          for i in range(len(mcell.mol_viz.mol_viz_list)):
-                            if mcell.mol_viz.mol_viz_list[i].name[4:] == mol_name:
-                              dup_check = True
-                        if dup_check == False:
-                          new_item = mcell.mol_viz.mol_viz_list.add()           # Create a new collection item to hold the name for this molecule
-                          new_item.name = mol_name                              # Assign the name to the new item
-                        
+        # MCell3(R) in binary viz mode already splits the complexes into individual molecules. Otherwise,
+        # generate one molecule for each used elementary molecule because we do not have shapes/glyphs for all complexes
+        split_complexes = (not bin_data) or mcell.cellblender_preferences.mcell4_mode
 
-                except EOFError:
-#                    print("Molecules read: %d" % (int(tot)))
-                    mol_file.close()
-                    break
+        # Hidden species are drawn without molecules whatever the frame was read from
+        blocks = hide_viz_blocks(blocks, hidden_names, split_complexes)
 
-                except:
-                    print( "Unexpected Exception: " + str(sys.exc_info()) )
-#                    print("Molecules read: %d" % (int(tot)))
-                    mol_file.close()
-                    break
+        for block in blocks:
+            for mol_name in viz_object_names(block.name, split_complexes):      # Names of blender molecule viz objects
 
-        else:
-            # Read ASCII format molecule file:
-            # print ("Reading ASCII file " + filepath )
-            bin_data = 0
-            mol_file.close()
-            # Create a list of molecule names, positions, and orientations
-            # Each entry in the list is ordered like this (afaik):
-            # [molec_name, [x_pos, y_pos, z_pos, x_orient, y_orient, z_orient]]
-            # Orientations are zero in the case of volume molecules.
-            mol_data = [[s.split()[0], [
-                float(x) for x in s.split()[2:]]] for s in open(
-                    filepath, "r").read().split("\n") if s != ""]
+                # we must append positions and orientations if this mol type already exists
+                if mol_name not in mol_dict:
+                    mol_dict[mol_name] = [block.mol_type, [block.positions], [block.orientations], [block.ids]]
+                else:
+                    mol_dict[mol_name][1].append(block.positions)
+                    mol_dict[mol_name][2].append(block.orientations)
+                    mol_dict[mol_name][3].append(block.ids)
 
-            for mol in mol_data:
-                
-                # generate one molecule for each used elementary molecule because 
-                # we do not have shapes/glyphs for all complexes
-                elem_mol_names = get_used_molecule_names(mol[0])
-
-                for elem_mol_name in elem_mol_names:
-                    mol_name = "mol_%s" % elem_mol_name
-                    if not mol_name in mol_dict:
-                        mol_orient = mol[1][3:]
-                        mt = 0
-                        # Check to see if it's a surface molecule
-                        if ((mol_orient[0] != 0.0) | (mol_orient[1] != 0.0) |
-                                (mol_orient[2] != 0.0)):
-                            mt = 1
-                        mol_dict[mol_name] = [mt, array.array("f"), array.array("f")]
-                        new_item = mcell.mol_viz.mol_viz_list.add()
-                        new_item.name = mol_name
-                    mt = mol_dict[mol_name][0]
-                    mol_dict[mol_name][1].extend(mol[1][:3])
-                    if mt == 1:
-                        mol_dict[mol_name][2].extend(mol[1][3:])
+                if mol_name not in mol_viz_names:
+                    mol_viz_names.add(mol_name)
+                    new_item = mcell.mol_viz.mol_viz_list.add()           # Create a new collection item to hold the name for this molecule
+                    new_item.name = mol_name                              # Assign the name to the new item
 
         # Get the parent object to all the molecule positions if it exists.
         # Otherwise, create it.
@@ -1017,15 +1307,14 @@ def mol_viz_file_read(mcell, filepath):
             for mol_name in mol_dict.keys():
                 mol_mat_name = "%s_mat" % (mol_name)
                 mol_type = mol_dict[mol_name][0]
-                mol_pos = mol_dict[mol_name][1]
-                mol_orient = mol_dict[mol_name][2]
 
                 # print ( "in mol_viz_file_read with mol_name = " + mol_name + ", mol_mat_name = " + mol_mat_name + ", file = " + filepath[filepath.rfind(os.sep)+1:] )
 
-                # Randomly orient volume molecules
-                if mol_type == 0:
-                    mol_orient.extend([random.uniform(
-                        -1.0, 1.0) for i in range(len(mol_pos))])
+                # Merge the blocks of this molecule (volume molecules get cached random orientations)
+                mol_pos, mol_orient = merge_viz_arrays ( mol_name, mol_dict[mol_name][1], mol_dict[mol_name][2], mol_dict[mol_name][3] )
+
+                # Draw at most the level of detail budget of molecules (outside the region of interest)
+                mol_pos, mol_orient = reduce_viz_arrays ( mv, mol_pos, mol_orient, mol_dict[mol_name][3] )
 
                 # Look up the glyph, color, size, and other attributes from the molecules list
 
@@ -1102,33 +1391,33 @@ def mol_viz_file_read(mcell, filepath):
                 if not mol_pos_mesh:
                     mol_pos_mesh = meshes.new(mol_pos_mesh_name)
 
-                # Add and set values of vertices at positions of molecules
-                # This uses vertices.add(), but where are the old vertices removed?
-                mol_pos_mesh.vertices.add(len(mol_pos)//3)
-                mol_pos_mesh.vertices.foreach_set("co", mol_pos)
-                mol_pos_mesh.vertices.foreach_set("normal", mol_orient)
+                # Set the vertices at the positions of the molecules (reusing the mesh's vertices when the count is unchanged)
+                set_mol_pos_mesh_vertices(mol_pos_mesh, mol_pos, mol_orient)
 
                 if mcell.cellblender_preferences.debug_level > 100:
 
                   __import__('code').interact(local={k: v for ns in (globals(), locals()) for k, v in ns.items()})
 
-                # Save the molecule's visibility state, so it can be restored later
+                # Look-up object to contain the mol_pos_mesh data, create if needed
+                # (the object is kept from frame to frame along with its visibility state)
                 mol_obj = objs.get(mol_name)
-                if mol_obj:
-                    hide = mol_obj.hide_viewport
-                    scn_objs.unlink(mol_obj)
+                if mol_obj and (mol_obj.type != 'MESH'):
                     objs.remove(mol_obj)
-                else:
-                    hide = False
-
-                # Create object to contain the mol_pos_mesh data
-                mol_obj = objs.new(mol_name, mol_pos_mesh)
-                scn_objs.link(mol_obj)
-                mol_shape_obj.parent = mol_obj
-                mol_obj.instance_type = 'VERTS'
-                mol_obj.use_instance_vertices_rotation = True
-                mol_obj.parent = mols_obj
-                mol_obj.hide_select = True
+                    mol_obj = None
+                if not mol_obj:
+                    mol_obj = objs.new(mol_name, mol_pos_mesh)
+                    mol_obj.instance_type = 'VERTS'
+                    mol_obj.use_instance_vertices_rotation = True
+                    mol_obj.hide_select = True
+                elif mol_obj.data != mol_pos_mesh:
+                    mol_obj.data = mol_pos_mesh
+                if not scn_objs.get(mol_name):
+                    scn_objs.link(mol_obj)
+                # Changing parents rebuilds the scene relations, so they're only set when needed
+                if mol_shape_obj.parent != mol_obj:
+                    mol_shape_obj.parent = mol_obj
+                if mol_obj.parent != mols_obj:
+                    mol_obj.parent = mols_obj
 
                 '''
                 if (not (mol_obj is None)) and (not (mol_shape_obj is None)):
@@ -1136,9 +1425,6 @@ def mol_viz_file_read(mcell, filepath):
                     mol_shape_obj.layers = mol_layers[:]
                 '''
 
-                # Restore the visibility state
-                mol_obj.hide_viewport = hide
-
                 """
                 if mol_obj:
                     if (mol_name == "mol_volume_proxy") or (mol_name == "mol_surface_proxy"):
@@ -1325,6 +1611,41 @@ class MCellMolVizPropertyGroup(bpy.types.PropertyGroup):
         description="Disable for faster animation preview",
         default=True, update=mol_viz_update)
     molecule_read_in: BoolProperty(name = "Define molecules from Viz Data.",default= False)
+    frame_cache_enable: BoolProperty(
+        name="Cache Frames",
+        description="Keep decoded frames in memory and decode nearby frames in the background",
+        default=True, update=frame_cache_enable_callback)
+    frame_cache_size_mb: IntProperty(
+        name="Cache Size (MB)", default=512, min=0,
+        description="Memory used for cached frames",
+        update=frame_cache_size_callback)
+    prefetch_frames: IntProperty(
+        name="Prefetch Frames", default=4, min=0, max=64,
+        description="Number of frames before and after the current frame to decode in the background")
+    point_cache_enable: BoolProperty(
+        name="Use Point Cache",
+        description="Read frames from the point cache files exported for this seed",
+        default=True, update=mol_viz_update)
+    lod_enable: BoolProperty(
+        name="Level of Detail",
+        description="Draw a reduced number of molecules of large species in the viewport (every molecule is rendered)",
+        default=False, update=mol_viz_update)
+    lod_budget: IntProperty(
+        name="Molecules per Species", default=100000, min=1,
+        description="Largest number of molecules of a species drawn outside the region of interest",
+        update=mol_viz_update)
+    lod_roi_enable: BoolProperty(
+        name="Region of Interest",
+        description="Draw every molecule inside a box",
+        default=False, update=mol_viz_update)
+    lod_roi_min: FloatVectorProperty(
+        name="Min", size=3, default=(-1.0, -1.0, -1.0),
+        description="Lower corner of the region of interest",
+        update=mol_viz_update)
+    lod_roi_max: FloatVectorProperty(
+        name="Max", size=3, default=(1.0, 1.0, 1.0),
+        description="Upper corner of the region of interest",
+        update=mol_viz_update)
     color_list: CollectionProperty(
         type=MCellFloatVectorProperty, name="Molecule Color List")
     color_index: IntProperty(name="Color Index", default=0)
@@ -1634,6 +1955,7 @@ class MCellMolVizPropertyGroup(bpy.types.PropertyGroup):
                 row.operator("mcell.select_viz_data", icon='IMPORT')
             else:
                 row.operator("mcell.read_viz_data", icon='IMPORT')
+            row.operator("mcell.build_viz_index", icon='LINENUMBERS_ON', text="")
             row = layout.row()
             row.label(text="Molecule Viz Directory: " + self.mol_file_dir,icon='FILE_FOLDER')
             row = layout.row()
@@ -1652,6 +1974,26 @@ class MCellMolVizPropertyGroup(bpy.types.PropertyGroup):
 #                              rows=2)
             row = layout.row()
             layout.prop(mcell.mol_viz, "mol_viz_enable")
+            row = layout.row()
+            row.prop(mcell.mol_viz, "frame_cache_enable")
+            if self.frame_cache_enable:
+                row.prop(mcell.mol_viz, "frame_cache_size_mb")
+                row.prop(mcell.mol_viz, "prefetch_frames")
+            row = layout.row()
+            row.prop(mcell.mol_viz, "point_cache_enable")
+            row.operator("mcell.export_point_cache")
+            row = layout.row()
+            row.prop(mcell.mol_viz, "lod_enable")
+            if self.lod_enable:
+                row.prop(mcell.mol_viz, "lod_budget")
+                row = layout.row()
+                row.prop(mcell.mol_viz, "lod_roi_enable")
+                row.operator("mcell.mol_viz_lod_roi_from_selection")
+                if self.lod_roi_enable:
+                    row = layout.row()
+                    row.prop(mcell.mol_viz, "lod_roi_min")
+                    row = layout.row()
+                    row.prop(mcell.mol_viz, "lod_roi_max")
 
 
             layout.box()
@@ -1783,6 +2125,9 @@ classes = (
             MCELL_OT_read_viz_data,
             MCELL_OT_select_viz_data,
             MCELL_OT_mol_viz_set_index,
+            MCELL_OT_build_viz_index,
+            MCELL_OT_mol_viz_lod_roi_from_selection,
+            MCELL_OT_export_point_cache,
             MCELL_OT_viz_script_refresh,
             MCELL_UL_visualization_export_list,
             MolVizStringProperty,
@@ -1798,6 +2143,7 @@ def register():
       bpy.utils.register_class(cls)
 
 def unregister():
+    viz_frame_cache.shutdown()
     for cls in reversed(classes):
       bpy.utils.unregister_class(cls)
 
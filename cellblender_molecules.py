@@ -439,6 +439,9 @@ def glyph_visibility_callback(self, context):
     objs = context.scene.collection.children[0].objects
     objs[show_name].hide_viewport = not self.glyph_visibility
     objs[show_shape_name].hide_viewport = not self.glyph_visibility
+    if self.glyph_visibility and (show_name in cellblender_mol_viz.skipped_viz_species):
+        # The molecules of this species were not read for the current frame
+        cellblender_mol_viz.mol_viz_update(self, context)
     return
 
 def glyph_show_only_callback(self, context):
@@ -47,6 +47,7 @@ import time
 import shutil
 import datetime
 import math
+import functools
 
 
 # CellBlender imports
@@ -56,6 +57,8 @@ from . import cellblender_utils
 from . import data_model
 
 from cellblender.mdl import data_model_to_mdl
+from cellblender.mdl import run_cache
+from cellblender.mdl import sweep_space
 #from cellblender.mdl import run_data_model_mcell
 
 from cellblender.cellblender_utils import project_files_path, mcell_files_path
@@ -78,6 +81,13 @@ def get_pid(item):
     #return rtn_val
 
 
+def get_max_memory(run_sim):
+    # Memory budget for the simulation queue in bytes (None lets the queue use most of physical memory)
+    if run_sim.max_memory_gb <= 0:
+        return None
+    return int(run_sim.max_memory_gb * 1024 * 1024 * 1024)
+
+
 ############## Overlay Support (some from sim_runners/queue_local/__init__.py) ##################
 
 handler_list = []           # Holds returns from bpy.types.SpaceView3D.draw_handler_add() for removal
@@ -108,13 +118,18 @@ def draw_callback_px(context):
           pid_str = rs.processes_list[rs.active_process_index].name
           pid = pid_str.split(',')[0].split()[1]
 
-    if pid != None:
+    first_line = 0  # Number of newest lines scrolled below the bottom of the region
+    if (pid != None) and (int(pid) in task_dict):
         ipid = int(pid)
-        # print ( " ))))))))))) " + str(task_dict[ipid]['output'][-1]) )
-        local_display_lines[ipid] = [ l.strip() for l in task_dict[ipid]['output'] ]
-        local_display_lines[ipid].reverse()
+        # Only fetch the lines of the log that fit in the region
+        first_line = max ( 0, -(scroll_offset + 1) )
+        num_lines = 100
+        if bpy.context.region:
+            num_lines = (bpy.context.region.height // 15) + 1
+        log_lines = task_dict[ipid]['log'].tail ( num_lines, skip=first_line )
+        local_display_lines[ipid] = [ l.strip() for l in log_lines ]
+        local_display_lines[ipid].reverse()  # Reverse since they'll be drawn from the bottom up
         screen_display_lines[str(pid)] = local_display_lines[ipid]
-        # screen_display_lines[str(pid)].reverse() # Reverse since they'll be drawn from the bottom up
 
     bgl.glPushAttrib(bgl.GL_ENABLE_BIT)
 
@@ -124,7 +139,7 @@ def draw_callback_px(context):
 
     font_id = 0  # XXX, need to find out how best to get this.
 
-    y_pos = 15 * (scroll_offset + 1)
+    y_pos = 15 * (scroll_offset + 1 + first_line)
     if pid and (pid in screen_display_lines):
       for l in screen_display_lines[pid]:
           blf.position(font_id, 15, y_pos, 0)
@@ -566,8 +581,10 @@ class MCELL_OT_run_simulation_control_sweep (bpy.types.Operator):
                 pass
             else:
                 sweep_dir = os.path.join(project_dir, "output_data")
-                if (os.path.exists(sweep_dir) and run_sim.remove_append == 'remove'):
-                    shutil.rmtree(sweep_dir)
+                if run_sim.remove_append == 'remove':
+                    # Keep the shared MDL (it's only reused where its inputs are unchanged) and the completed runs
+                    keep_paths = run_cache.cached_outputs(sweep_dir) if run_sim.use_run_cache else []
+                    data_model_to_mdl.clear_output_dir(sweep_dir, keep_paths)
                 if not os.path.exists(sweep_dir):
                     os.makedirs(sweep_dir, exist_ok=True)
 
@@ -619,7 +636,9 @@ class MCELL_OT_run_simulation_control_sweep (bpy.types.Operator):
                     "-pd", project_dir,
                     "-ef", error_file_option,
                     "-lf", log_file_option,
-                    "-np", mcell_processes_str],
+                    "-np", mcell_processes_str] + ([] if run_sim.use_run_cache else ["-nc"]) +
+                    (["-bg"] if run_sim.export_binary_geometry else []) +
+                    (["-pr"] if run_sim.remove_append == 'remove' else []),
                     stdout=None,
                     stderr=None)
                 self.report({'INFO'}, "Simulation Starting...")
@@ -665,26 +684,22 @@ class MCELL_OT_percentage_done_timer(bpy.types.Operator):
                 #    return {'CANCELLED'}
                 pid = get_pid(simulation_process)
                 seed = int(simulation_process.name.split(',')[1].split(':')[1])
-                q_item = cellblender.simulation_queue.task_dict[pid] # q_item is a dictionary with stdout,stderr,status,args,cmd,process,bl_text
+                q_item = cellblender.simulation_queue.task_dict[pid] # q_item is a dictionary with log,status,args,cmd,process,bl_text
                 percent = None
-                if 'output' in q_item:
-                    output_lines = q_item['output']
-                    n = len(output_lines)
+                if 'log' in q_item:
                     last_iter = total_iter = 0
-                    for i in reversed(range(n)):
-                        l = output_lines[i]
-                        if l.startswith("Iterations"):
-                            last_iter = int(l.split()[1])
-                            total_iter = int(l.split()[3])
-                            percent = (last_iter/total_iter)*100
-                            break
+                    l = q_item['log'].find_last("Iterations")
+                    if l is not None:
+                        last_iter = int(l.split()[1])
+                        total_iter = int(l.split()[3])
+                        percent = (last_iter/total_iter)*100
                     if ((last_iter == total_iter) and (total_iter != 0)) or (q_item['status'] in ['died','mcell_error']):
                         task_ctr += 1
 
                 if percent is None:
-                    simulation_process.name = "PID: %d, Seed: %d" % (pid, seed)
+                    simulation_process.name = "Task: %d, Seed: %d" % (pid, seed)
                 else:
-                    simulation_process.name = "PID: %d, Seed: %d, %d%%" % (pid, seed, percent)
+                    simulation_process.name = "Task: %d, Seed: %d, %d%%" % (pid, seed, percent)
 
             # just a silly way of forcing a screen update. ¯\_(ツ)_/¯
             color = context.preferences.themes[0].view_3d.empty
@@ -779,10 +794,11 @@ class MCELL_OT_run_simulation_sweep_queue(bpy.types.Operator):
                 viz_dir = os.path.join(project_dir, "output_data", "viz_data")
 
                 if run_sim.export_requested and (run_sim.remove_append == 'remove'):
-                    # Remove the entire output directory
+                    # Remove the entire output directory except for the shared MDL (which is only reused where its inputs are unchanged)
+                    # Also keep the outputs of completed runs (those the sweep doesn't use are pruned once it's planned)
                     out_dir = os.path.join(project_dir, "output_data")
-                    if os.path.exists(out_dir):
-                        shutil.rmtree(out_dir)
+                    keep_paths = run_cache.cached_outputs(out_dir) if run_sim.use_run_cache else []
+                    data_model_to_mdl.clear_output_dir(out_dir, keep_paths)
 
                 if run_sim.export_requested and not os.path.exists(react_dir):
                     os.makedirs(react_dir, exist_ok=True)
@@ -811,7 +827,7 @@ class MCELL_OT_run_simulation_sweep_queue(bpy.types.Operator):
                 error_file_option = run_sim.error_file
                 log_file_option = run_sim.log_file
                 cellblender.simulation_queue.python_exec = python_path
-                cellblender.simulation_queue.start(mcell_processes)
+                cellblender.simulation_queue.start(mcell_processes, get_max_memory(run_sim))
                 cellblender.simulation_queue.notify = True
 
                 if run_sim.enable_run_once_script:
@@ -846,38 +862,44 @@ class MCELL_OT_run_simulation_sweep_queue(bpy.types.Operator):
 
                 sweep_list = engine_manager.build_sweep_list( dm['parameter_system'] )
                 print ( "Sweep list = " + str(sweep_list) )
-                # Add a "current_index" of 0 to support the sweeping
-                for sw_item in sweep_list:
-                  sw_item['current_index'] = 0
-                  print ( "  Sweep list item = " + str(sw_item) )
+                space = sweep_space.SweepSpace.from_sweep_list ( sweep_list, start_seed, end_seed )
 
                 if run_sim.export_requested:
                     # The following line will create the "data_layout.json" file describing the directory structure
                     engine_manager.write_sweep_list_to_layout_file ( sweep_list, start_seed, end_seed, os.path.join ( project_dir, "data_layout.json" ) )
 
                 # Count the number of sweep runs
-                num_sweep_runs = engine_manager.count_sweep_runs ( sweep_list )
+                num_sweep_runs = len ( space )
                 num_requested_runs = num_sweep_runs * (1 + end_seed - start_seed)
                 print ( "Number of non-seed sweep runs = " + str(num_sweep_runs) )
                 print ( "Total runs (sweep and seed) is " + str(num_requested_runs) )
 
                 bionetgen_mode = data_model_to_mdl.requires_mcellr ( {'mcell':dm} ) or mcell.cellblender_preferences.bionetgen_mode
 
+                # Runs are only identified by their data model when it includes the geometry (when exporting)
+                use_run_cache = run_sim.use_run_cache and run_sim.export_requested
+                if use_run_cache:
+                    dm_hash = run_cache.model_hash ( dm )
+                    engine = [ run_cache.engine_id(mcell_binary), mcell4_mode, bionetgen_mode ]
+
                 # Build a list of "run commands" (one for each run) to be put in the queue
                 # Note that the format of these came from the original "run_simulations.py" program and may not be what we want in the long run
                 run_cmd_list = []
-                # Build a sweep list with an "output_data" prefix directory
+                # Sections that are the same for every point of a sweep (or unchanged since the last export) are only written once
+                shared_path = os.path.join ( project_dir, "output_data", data_model_to_mdl.SHARED_MDL_DIR )
+
+                # Walk through the sweep points in run order (the last parameter varies fastest)
+                swept_pars = {}
+                for par in dm['parameter_system']['model_parameters']:
+                    if ('par_name' in par) and (par['par_name'] in space.names):
+                        swept_pars[par['par_name']] = par
                 for run in range (num_sweep_runs):
-                    sweep_path = "output_data"
-                    for sw_item in sweep_list:
-                        sweep_path += os.sep + sw_item['par_name'] + "_index_" + str(sw_item['current_index'])
+                    sweep_path = space.run_dir ( run )
                     print ( "Sweep path = " + sweep_path )
                     # Set the data model parameters to the current parameter settings
-                    for par in dm['parameter_system']['model_parameters']:
-                        if ('par_name' in par):
-                            for sweep_item in sweep_list:
-                                if par['par_name'] == sweep_item['par_name']:
-                                    par['par_expression'] = str(sweep_item['values'][sweep_item['current_index']])
+                    for par_name, value in zip ( space.names, space.parameter_values(run) ):
+                        if par_name in swept_pars:
+                            swept_pars[par_name]['par_expression'] = str(value)
                     # Sweep through the seeds for this set of parameters creating a run specification for each seed
                     for seed in range(start_seed,end_seed+1):
                         # Create the directories and write the MDL
@@ -900,22 +922,31 @@ class MCELL_OT_run_simulation_sweep_queue(bpy.types.Operator):
                             else:
                                 print ( "Writing data model as MDL at " + str(os.path.join(sweep_item_path, '%s.main.mdl' % (base_name) )) )
                                 cellblender.current_data_model = {'mcell':dm} # this creates two mcell levels: mcell: { mcell: {
-                                data_model_to_mdl.write_mdl ( cellblender.current_data_model, os.path.join(sweep_item_path, '%s.main.mdl' % (base_name) ), scene_name=context.scene.name )
+                                data_model_to_mdl.write_mdl ( cellblender.current_data_model, os.path.join(sweep_item_path, '%s.main.mdl' % (base_name) ), scene_name=context.scene.name, shared_path=shared_path, binary_geometry=run_sim.export_binary_geometry )
                             
-                        run_cmd_list.append ( [mcell_binary, sweep_item_path, base_name, error_file_option, log_file_option, seed] )
-                    # Increment the current_index counters from rightmost side (deepest directory)
-                    i = len(sweep_list) - 1
-                    while i >= 0:
-                        sweep_list[i]['current_index'] += 1
-                        if sweep_list[i]['current_index'] >= len(sweep_list[i]['values']):
-                          sweep_list[i]['current_index'] = 0
-                        else:
-                          break
-                        i += -1
+                        run_key = None
+                        if use_run_cache:
+                            run_key = run_cache.run_key ( dm_hash, dm['parameter_system'], seed, engine )
+                        run_cmd_list.append ( [mcell_binary, sweep_item_path, base_name, error_file_option, log_file_option, seed, run_key] )
 
+                output_dir = os.path.join(project_dir, "output_data")
+                if run_sim.export_requested:
+                    # Remove the shared sections that none of the runs include any more
+                    data_model_to_mdl.collect_shared_files ( output_dir )
+                if use_run_cache:
+                    # Skip (or link) the runs that have already been completed with the same data model, seed and engine
+                    actions = run_cache.plan_runs ( output_dir, [ (run_cmd[1], run_cmd[5], run_cmd[6]) for run_cmd in run_cmd_list ] )
+                    if run_sim.remove_append == 'remove':
+                        # Remove the kept results of runs that aren't part of this sweep
+                        run_cache.prune_runs ( output_dir, [ run_cmd[6] for run_cmd in run_cmd_list ] )
+                    num_cached = len(run_cmd_list) - actions.count('run')
+                    if num_cached > 0:
+                        print ( "Reusing results of " + str(num_cached) + " completed runs (" + str(actions.count('link')) + " linked)" )
+                        self.report({'INFO'}, "Reusing results of %d completed runs" % (num_cached))
+                    run_cmd_list = [ run_cmd for run_cmd, action in zip(run_cmd_list, actions) if action == 'run' ]
 
                 # Print the run commands as a record of what's being done
-                print ( "Run Cmds for Sweep Queue (0:mcell, 1:wd, 2:base_name, 3:error, 4:log, 5:seed):" )
+                print ( "Run Cmds for Sweep Queue (0:mcell, 1:wd, 2:base_name, 3:error, 4:log, 5:seed, 6:run_key):" )
                 for run_cmd in run_cmd_list:
                     print ( "  " + str(run_cmd) )
 
@@ -950,6 +981,11 @@ class MCELL_OT_run_simulation_sweep_queue(bpy.types.Operator):
                       elif log_file_option == 'console':
                           log_file = None
 
+                      on_completed = None
+                      if run_cmd[6] is not None:
+                          # Record the results of the run so it can be skipped the next time
+                          on_completed = functools.partial ( run_cache.record_run, output_dir, run_cmd[1], run_cmd[5], run_cmd[6] )
+
                       if not mcell4_mode and bionetgen_mode:
                           # execute mdlr2mdl.py to generate MDL from MDLR
 
@@ -983,7 +1019,9 @@ class MCELL_OT_run_simulation_sweep_queue(bpy.types.Operator):
                           make_texts = run_sim.save_text_logs
                           print ( 100 * "@" )
                           print ( "Add Task:" + cellblender.python_path + " args:" + str(mcellr_args) + " wd:" + str(run_cmd[1]) + " txt:" + str(make_texts) )
-                          proc = cellblender.simulation_queue.add_task([cellblender.python_path], mcellr_args, run_cmd[1], make_texts, env=my_env)
+                          task_id = cellblender.simulation_queue.add_task([cellblender.python_path], mcellr_args, run_cmd[1], make_texts, env=my_env,
+                                                                          priority=run_sim.run_priority, group=run_sim.last_simulation_run_time, model_dir=project_dir,
+                                                                          on_completed=on_completed)
                           print ( 100 * "@" )
                       elif not mcell4_mode:
 
@@ -994,7 +1032,9 @@ class MCELL_OT_run_simulation_sweep_queue(bpy.types.Operator):
                           make_texts = run_sim.save_text_logs
                           print ( 100 * "@" )
                           print ( "Add Task:" + run_cmd[0] + " args:" + str(mcell_args) + " wd:" + str(run_cmd[1]) + " txt:" + str(make_texts) )
-                          proc = cellblender.simulation_queue.add_task(run_cmd[0], mcell_args, run_cmd[1], make_texts, env=my_env)
+                          task_id = cellblender.simulation_queue.add_task(run_cmd[0], mcell_args, run_cmd[1], make_texts, env=my_env,
+                                                                          priority=run_sim.run_priority, group=run_sim.last_simulation_run_time, model_dir=project_dir,
+                                                                          on_completed=on_completed)
                           print ( 100 * "@" )
                       else:
                           # mcell4
@@ -1006,12 +1046,14 @@ class MCELL_OT_run_simulation_sweep_queue(bpy.types.Operator):
                           mcell_args = '%s -seed %d' % (py_filename, run_cmd[5])
                           make_texts = run_sim.save_text_logs
                           my_env['MCELL_PATH'] = os.path.dirname(mcell_binary)
-                          proc = cellblender.simulation_queue.add_task(python_path, mcell_args, run_cmd[1], make_texts, env=my_env)
+                          task_id = cellblender.simulation_queue.add_task(python_path, mcell_args, run_cmd[1], make_texts, env=my_env,
+                                                                          priority=run_sim.run_priority, group=run_sim.last_simulation_run_time, model_dir=project_dir,
+                                                                          on_completed=on_completed)
 
                       self.report({'INFO'}, "Simulation Starting...")
 
                       if not simulation_process.name:
-                          simulation_process.name = ("PID: %d, Seed: %d" % (proc.pid, run_cmd[5]))
+                          simulation_process.name = ("Task: %d, Seed: %d" % (task_id, run_cmd[5]))
                     bpy.ops.mcell.percentage_done_timer()
 
 
@@ -1078,8 +1120,10 @@ class MCELL_OT_run_simulation_control_sweep_sge (bpy.types.Operator):
                 pass
             else:
                 sweep_dir = os.path.join(project_dir, "output_data")
-                if (os.path.exists(sweep_dir) and run_sim.remove_append == 'remove'):
-                    shutil.rmtree(sweep_dir)
+                if run_sim.remove_append == 'remove':
+                    # Keep the shared MDL (it's only reused where its inputs are unchanged) and the completed runs
+                    keep_paths = run_cache.cached_outputs(sweep_dir) if run_sim.use_run_cache else []
+                    data_model_to_mdl.clear_output_dir(sweep_dir, keep_paths)
                 if not os.path.exists(sweep_dir):
                     os.makedirs(sweep_dir, exist_ok=True)
 
@@ -1146,6 +1190,11 @@ class MCELL_OT_run_simulation_control_sweep_sge (bpy.types.Operator):
                     "-gh", run_sim.sge_host_name,
                     "-mm", str(int(run_sim.required_memory_gig)) ]
 
+                if not run_sim.use_run_cache:
+                    cmd_list.append("-nc")
+                if run_sim.remove_append == 'remove':
+                    cmd_list.append("-pr")
+
                 if run_sim.manual_sge_host:
                     cmd_list.append("-nl")
                     cmd_list.append(computer_names_string)
@@ -1354,7 +1403,7 @@ class MCELL_OT_run_simulation_control_queue(bpy.types.Operator):
                 error_file_option = run_sim.error_file
                 log_file_option = run_sim.log_file
                 cellblender.simulation_queue.python_exec = python_path
-                cellblender.simulation_queue.start(mcell_processes)
+                cellblender.simulation_queue.start(mcell_processes, get_max_memory(run_sim))
                 cellblender.simulation_queue.notify = True
 
                 # The following line will create the "data_layout.json" file describing the directory structure
@@ -1394,12 +1443,13 @@ class MCELL_OT_run_simulation_control_queue(bpy.types.Operator):
                   mdl_filename = '%s.main.mdl' % (base_name)
                   mcell_args = '-seed %d %s' % (seed, mdl_filename)
                   make_texts = run_sim.save_text_logs
-                  proc = cellblender.simulation_queue.add_task(mcell_binary, mcell_args, os.path.join(project_dir, "output_data"), make_texts, env=my_env)
+                  task_id = cellblender.simulation_queue.add_task(mcell_binary, mcell_args, os.path.join(project_dir, "output_data"), make_texts, env=my_env,
+                                                                  priority=run_sim.run_priority, group=run_sim.last_simulation_run_time, model_dir=project_dir)
 
                   self.report({'INFO'}, "Simulation Starting...")
 
                   if not simulation_process.name:
-                      simulation_process.name = ("PID: %d, Seed: %d" % (proc.pid, seed))
+                      simulation_process.name = ("Task: %d, Seed: %d" % (task_id, seed))
                 bpy.ops.mcell.percentage_done_timer()
 
         else:
@@ -2314,6 +2364,24 @@ class MCellRunSimulationPropertyGroup(bpy.types.PropertyGroup):
         min=1,
         max=cpu_count(),
         description="Number of simultaneous simulation processes")
+    max_memory_gb: FloatProperty(
+        name="Memory Limit (GB)",
+        default=0.0,
+        min=0.0,
+        description="Total memory that queued simulations may use at once (0 for most of physical memory)")
+    use_run_cache: BoolProperty(
+        name="Reuse Completed Runs",
+        default=True,
+        description="Skip sweep runs whose data model, seed and MCell binary match a completed run in output_data"
+                    " (completed runs are kept when removing previous data)")
+    export_binary_geometry: BoolProperty(
+        name="Binary Geometry Sidecars",
+        default=False,
+        description="Also save each static mesh as a binary file next to its MDL so it can be imported without parsing the MDL text")
+    run_priority: IntProperty(
+        name="Priority",
+        default=0,
+        description="Queued runs with a higher priority start before runs with a lower priority")
     log_file_enum = [
         ('none', "Do not Generate", ""),
         ('file', "Send to File", ""),
@@ -2767,10 +2835,10 @@ class MCellRunSimulationPropertyGroup(bpy.types.PropertyGroup):
                             active_process_index = mcell.run_simulation.active_process_index
                             simulation_queue = cellblender.simulation_queue
                             pid = get_pid(processes_list[active_process_index])
-                            q_item = cellblender.simulation_queue.task_dict[pid]
+                            q_item = cellblender.simulation_queue.task_dict.get(pid)
 
-                            if q_item['stderr'] != b'':
-                                serr = str(q_item['stderr'])
+                            if (q_item is not None) and (len(q_item['errors']) > 0):
+                                serr = ''.join(q_item['errors'].tail()).strip()
                                 if len(serr) > 0:
                                     row = layout.row()
                                     row.label ( text="Error from task " + str(pid), icon="ERROR" )
@@ -2783,11 +2851,6 @@ class MCellRunSimulationPropertyGroup(bpy.types.PropertyGroup):
                                       row.alignment = 'EXPAND'
                                       row.label(text=var)
 
-                            sout = str(q_item['stdout'])
-                            if False and (len(sout) > 0):
-                                row = layout.row()
-                                row.label ( text="Out: " + sout )
-
 
                         row = layout.row()
                         row.operator("mcell.clear_simulation_queue")
@@ -2845,6 +2908,9 @@ class MCellRunSimulationPropertyGroup(bpy.types.PropertyGroup):
 
                     row = box.row()
                     row.prop(self, "mcell_processes")
+                    row = box.row()
+                    row.prop(self, "max_memory_gb")
+                    row.prop(self, "run_priority")
                     #row = box.row()
                     #row.prop(self, "log_file")
                     #row = box.row()
@@ -2855,6 +2921,10 @@ class MCellRunSimulationPropertyGroup(bpy.types.PropertyGroup):
 
                     row = box.row()
                     row.prop(self, "remove_append", expand=True)
+                    row = box.row()
+                    row.prop(self, "use_run_cache")
+                    row = box.row()
+                    row.prop(self, "export_binary_geometry")
 
 
                     #row = box.row()
@@ -38,14 +38,19 @@ cellblender_info = {
         "cellblender_partitions.py",
         "cellblender_simulation.py",
         "cellblender_mol_viz.py",
+        "mol_viz_io.py",
+        "mol_viz_cache.py",
+        "mol_viz_trajectory.py",
+        "mol_viz_lod.py",
+        "mol_viz_point_cache.py",
         "cellblender_meshalyzer.py",
+        "cellblender_mesh_analysis.py",
         "cellblender_objects.py",
         "cellblender_scripting.py",
         "cellblender_pbc.py",
         "object_surface_regions.py",
         "run_simulations.py",
         "sim_runner_queue.py",
-        "run_wrapper.py",
 
         "cellblender_legacy.py",
         
@@ -210,6 +215,8 @@ cellblender_info = {
         "mdl"+os.sep+"__init__.py",
         "mdl"+os.sep+"data_model_to_mdl.py",
         "mdl"+os.sep+"run_data_model_mcell.py",
+        "mdl"+os.sep+"run_cache.py",
+        "mdl"+os.sep+"sweep_space.py",
 
         "bng"+os.sep+"__init__.py",
         "bng"+os.sep+"sbml2blender.py",
@@ -28,6 +28,10 @@ statement is on a separate line.
 
 import pickle
 import sys
+import os
+
+sys.path.insert ( 0, os.path.join(os.path.dirname(os.path.abspath(__file__)),os.pardir,"mdl") )
+import geometry_sidecar
 
 def pickle_data_model ( dm ):
     """ Return a pickle string containing a data model """
@@ -130,6 +134,20 @@ def create_new_data_model_template():
     g['object_list'] = obj_list
     return dm
 
+def read_object_from_sidecar ( sidecar_file_name ):
+    """ Return a data model object read from a binary geometry sidecar (None if it can't be read) """
+    try:
+        sc = geometry_sidecar.read_sidecar ( sidecar_file_name )
+    except (OSError, ValueError) as e:
+        print ( "Unable to read binary geometry (" + str(e) + "), parsing the MDL instead" )
+        return None
+    obj = {}
+    obj['name'] = sc['name']
+    obj['vertex_list'] = geometry_sidecar.group_rows ( sc['vertices'] )
+    obj['element_connections'] = geometry_sidecar.group_rows ( sc['faces'] )
+    obj['define_surface_regions'] = [ { 'name': reg_name, 'include_elements': reg_faces.tolist() } for reg_name, reg_faces in sc['regions'] ]
+    return obj
+
 def read_objects_from_mdl_file ( mdl_file_name, dm ):
     # Warning: This code may make some assumptions about the formatting of the MDL to simplify its work
     mcell = dm['mcell']
@@ -150,7 +168,11 @@ def read_objects_from_mdl_file ( mdl_file_name, dm ):
     vl = None
     ec = None
     sr = None
-    
+
+    # Objects preceded by a binary geometry stub are read from their sidecar rather than from the MDL text
+    sidecar = None
+    from_sidecar = False
+
     # Read each line of the file
     for line in f:
         # Keep track of bracket nesting depth
@@ -175,22 +197,36 @@ def read_objects_from_mdl_file ( mdl_file_name, dm ):
             elif in_object_bracket:
               in_object_bracket = False
               in_object = False
+        elif 'BINARY_GEOMETRY' in line:
+            stub = geometry_sidecar.parse_sidecar_stub ( line )
+            if stub is not None:
+                sidecar = ( stub[0], os.path.join(os.path.dirname(mdl_file_name),stub[1]) )
         elif 'POLYGON_LIST' in line:
             print ( "Object Definition: " + line.strip() )
-            obj = {}
-            vl = []
-            ec = []
-            sr = []
-            obj['name'] = line.strip().split()[0]
-            obj['vertex_list'] = vl
-            obj['element_connections'] = ec
-            obj['define_surface_regions'] = sr
+            obj = None
+            from_sidecar = False
+            if (sidecar is not None) and (sidecar[0] == line.strip().split()[0]):
+                obj = read_object_from_sidecar ( sidecar[1] )
+                from_sidecar = obj is not None
+            sidecar = None
+            if obj is None:
+                obj = {}
+                obj['name'] = line.strip().split()[0]
+                obj['vertex_list'] = []
+                obj['element_connections'] = []
+                obj['define_surface_regions'] = []
+            vl = obj['vertex_list']
+            ec = obj['element_connections']
+            sr = obj['define_surface_regions']
             obj_list.append ( obj )
             in_object = True
         elif in_object_bracket and 'VERTEX_LIST' in line:
             in_vertex_list = True
         elif in_object_bracket and 'ELEMENT_CONNECTIONS' in line:
             in_element_list = True
+        elif from_sidecar:
+            # The vertices and faces have already been read
+            pass
         elif ('[' in line) and (']' in line):
             if (in_vertex_list):
                 # print ( "Vertex: " + line.strip() )
@@ -32,6 +32,15 @@ import sys
 import json
 import os
 import re
+import io
+import hashlib
+
+try:
+  # Imported as part of CellBlender
+  from . import geometry_sidecar
+except ImportError:
+  # Run as a stand-alone script
+  import geometry_sidecar
 
 # global control, set to True by argument -data_model_from_mdl 
 # needed to handle certain aspects of conversion that are impossible to control from 
@@ -211,6 +220,382 @@ def write_dm_on_off ( dm, f, dm_name, mdl_name, blank_default="", indent="" ):
         f.write ( indent + mdl_name + " = " + val + "\n" )
 
 
+#### Bulk Geometry Writing ####
+
+# Vertices and faces are formatted a chunk of rows at a time: one format
+#   string is applied to all of the values of a chunk and written at once.
+GEOMETRY_CHUNK_ROWS = 4096
+
+VERTEX_ROW_FORMAT = "    [ %.15g, %.15g, %.15g ]\n"
+FACE_ROW_FORMAT = "    [ %d, %d, %d ]\n"
+
+def flatten_rows ( rows, offset=None ):
+    """ Return the first 3 values of each row (plus an optional offset) as one flat list """
+    if hasattr ( rows, 'reshape' ):
+      # NumPy array (as read from a Blender mesh)
+      rows = rows[:,0:3]
+      if offset != None:
+        rows = rows + offset
+      return rows.reshape(-1).tolist()
+    if offset != None:
+      ( ox, oy, oz ) = offset
+      return [ x for r in rows for x in ( ox+r[0], oy+r[1], oz+r[2] ) ]
+    return [ x for r in rows for x in ( r[0], r[1], r[2] ) ]
+
+def write_geometry_rows ( f, rows, row_format, offset=None ):
+    """ Write rows of 3 values (vertices or faces) formatted with row_format """
+    for start in range ( 0, len(rows), GEOMETRY_CHUNK_ROWS ):
+      values = flatten_rows ( rows[start:start+GEOMETRY_CHUNK_ROWS], offset )
+      f.write ( (row_format * (len(values)//3)) % tuple(values) )
+
+def get_mesh_geometry ( mesh ):
+    """ Return the vertices (V,3) and first 3 vertices of each face (F,3) of a Blender mesh as NumPy arrays """
+    import numpy
+    points = numpy.empty ( 3*len(mesh.vertices), dtype=numpy.float32 )
+    mesh.vertices.foreach_get ( 'co', points )
+    loop_starts = numpy.empty ( len(mesh.polygons), dtype=numpy.int32 )
+    mesh.polygons.foreach_get ( 'loop_start', loop_starts )
+    loop_verts = numpy.empty ( len(mesh.loops), dtype=numpy.int32 )
+    mesh.loops.foreach_get ( 'vertex_index', loop_verts )
+    faces = loop_verts[loop_starts[:,None] + numpy.arange(3)]
+    return ( points.reshape((-1,3)), faces )
+
+
+#### Modular Section Files ####
+
+# Directory (in output_data) holding the section files shared by the runs of a sweep
+SHARED_MDL_DIR = "shared_mdl"
+
+# Files in output_data that are kept when clearing it for a new run (along with the shared MDL):
+# the peak memory of the latest run used by the simulation queue (sim_runner_queue.MEMORY_ESTIMATE_FILE)
+KEPT_OUTPUT_FILES = ( "task_memory.json", )
+
+# Index (in a modular MDL directory) of the sections written there and the hashes of their inputs
+SECTION_INDEX_SUFFIX = ".sections.json"
+# Index (in the shared directory) of shared section files by the hashes of their inputs
+SHARED_SECTION_INDEX = "shared_sections.json"
+SECTION_INDEX_VERSION = 2
+
+# Sections that are always written to the modular directory (they change between the runs of a sweep)
+LOCAL_SECTIONS = ( 'parameters', )
+
+def hash_inputs ( inputs ):
+    """ Return the SHA1 hex digest of the inputs of a section
+
+    The inputs are pickled rather than converted to text since that's much faster
+    for long lists of vertices (and "fast" pickling skips tracking every list).
+    Dictionaries with the same items in a different order hash differently,
+    which only causes a section to be written again.
+    """
+    buf = io.BytesIO()
+    pickler = pickle.Pickler ( buf, protocol=4 )
+    pickler.fast = True
+    pickler.dump ( inputs )
+    return hashlib.sha1 ( buf.getvalue() ).hexdigest()
+
+def read_json_file ( file_name ):
+    try:
+      with open ( file_name, 'r' ) as jf:
+        return json.load ( jf )
+    except (OSError, ValueError):
+      return {}
+
+def write_json_file ( file_name, obj ):
+    tmp_file = file_name + ".%d.tmp" % os.getpid()
+    with open ( tmp_file, 'w' ) as jf:
+      json.dump ( obj, jf, indent=1, sort_keys=True )
+    os.replace ( tmp_file, file_name )
+
+def write_shared_file ( text, shared_path, prefix ):
+    """ Write text to a file in the shared path named by its hash (unless it's already there) """
+    digest = hashlib.sha1 ( text.encode('utf-8') ).hexdigest()
+    shared_file = os.path.join ( shared_path, prefix + '.' + digest + '.mdl' )
+    if not os.path.exists ( shared_file ):
+      makedirs_exist_ok ( shared_path, exist_ok=True )
+      tmp_file = shared_file + ".%d.tmp" % os.getpid()
+      with open ( tmp_file, 'w' ) as sf:
+        sf.write ( text )
+      os.replace ( tmp_file, shared_file )
+    return shared_file
+
+def file_stamp ( file_name ):
+    """ Return the size and modification time of a file (None if it doesn't exist) """
+    try:
+      st = os.stat ( file_name )
+      return [ st.st_size, st.st_mtime_ns ]
+    except OSError:
+      return None
+
+
+class SectionFiles:
+    """ The section files of an MDL export (sections go to the main file f when not modular)
+
+    Each section is identified by a hash of its inputs. When a modular export
+    is written again to the same directory, sections whose inputs (and files)
+    haven't changed are included as they are rather than being written again.
+    The objects of the geometry section are also tracked one at a time so that
+    unchanged objects are copied from the previous geometry file.
+
+    With a shared path, sections are saved by content in the shared path so the
+    runs of a sweep with identical sections (like the geometry) all include the
+    same file. The shared path also keeps an index of its files by the hashes of
+    their inputs, so sections are only generated once for all of the runs (and
+    for later exports as long as the shared path is kept).
+    """
+
+    def __init__ ( self, f, modular_path, shared_path, scene_name, writer_id="" ):
+      self.f = f
+      self.modular_path = modular_path
+      self.shared_path = shared_path
+      self.scene_name = scene_name
+      # Anything (other than the inputs of a section) that changes what is written
+      self.writer_id = [ SECTION_INDEX_VERSION, writer_id, scene_name, shared_path is not None ]
+      self.keys = {}
+      self.old_sections = {}
+      self.old_objects = {}
+      self.new_sections = {}
+      self.new_objects = {}
+      self.old_geometry = None
+      self.shared_sections = {}
+      self.shared_geometry = None
+      self.new_shared_sections = {}
+      self.new_shared_geometry = None
+      if modular_path is not None:
+        index = read_json_file ( self.index_file_name() )
+        if index.get('writer_id') == self.writer_id:
+          self.old_sections = index['sections']
+          self.old_objects = index['objects']
+        if shared_path is not None:
+          index = read_json_file ( os.path.join(shared_path,SHARED_SECTION_INDEX) )
+          if index.get('writer_id') == self.writer_id:
+            self.shared_sections = index['sections']
+            self.shared_geometry = index['geometry']
+
+    def index_file_name ( self ):
+      return os.path.join ( self.modular_path, self.scene_name + SECTION_INDEX_SUFFIX )
+
+    def section_dir ( self, section ):
+      """ Return the directory that a written section will be saved in (None if it's written to the main file) """
+      if self.modular_path is None:
+        return None
+      if (self.shared_path is None) or (section in LOCAL_SECTIONS):
+        return self.modular_path
+      return self.shared_path
+
+    def section_file_name ( self, section ):
+      return os.path.join ( self.modular_path, self.scene_name + '.' + section + '.mdl' )
+
+    def shared_file_name ( self, base_name ):
+      """ Return the name of a shared file relative to the modular path (MCell includes files relative to the including file) """
+      return os.path.relpath(os.path.join(self.shared_path,base_name),self.modular_path).replace(os.sep,'/')
+
+    def is_unchanged ( self, entry ):
+      """ Return True if the file of a section entry hasn't changed since it was written """
+      if entry['file'] is None:
+        return True
+      return file_stamp ( os.path.join(self.modular_path,entry['file']) ) == entry['stamp']
+
+    def reuse ( self, section, inputs ):
+      """ Include a section written from the same inputs before (returns False if it must be written)
+
+      Sections with inputs of None (like geometry from scripts) are always written.
+      """
+      self.keys[section] = None
+      if (self.modular_path is None) or (inputs is None):
+        return False
+      key = hash_inputs ( [ self.writer_id, section, inputs ] )
+      self.keys[section] = key
+      entry = None
+      old = self.old_sections.get ( section )
+      if (old is not None) and (old['key'] == key) and self.is_unchanged(old):
+        entry = old
+        if section == 'geometry':
+          self.new_objects = self.old_objects
+      elif (self.shared_path is not None) and not (section in LOCAL_SECTIONS) and (key in self.shared_sections):
+        # Written by another run of the sweep (or by an earlier export)
+        file_name = self.shared_file_name ( self.shared_sections[key] )
+        stamp = file_stamp ( os.path.join(self.modular_path,file_name) )
+        if stamp is not None:
+          entry = { 'key': key, 'include': file_name, 'file': file_name, 'stamp': stamp }
+          if (section == 'geometry') and (self.shared_geometry is not None) and (self.shared_geometry['file'] == self.shared_sections[key]):
+            self.new_objects = self.shared_geometry['objects']
+      if entry is None:
+        return False
+      self.new_sections[section] = entry
+      if entry['include'] is not None:
+        self.f.write ( 'INCLUDE_FILE = "' + entry['include'] + '"\n\n' )
+      return True
+
+    def open ( self, section ):
+      """ Return the file that a section should be written to """
+      if self.modular_path is None:
+        return self.f
+      if section == 'geometry':
+        # Keep the previous geometry so unchanged objects can be copied from it
+        old = self.old_sections.get ( section )
+        file_name = None
+        if (old is not None) and (old['file'] is not None) and self.is_unchanged(old):
+          file_name = old['file']
+        elif self.shared_geometry is not None:
+          self.old_objects = self.shared_geometry['objects']
+          file_name = self.shared_file_name ( self.shared_geometry['file'] )
+        if file_name is not None:
+          try:
+            with open ( os.path.join(self.modular_path,file_name), 'r' ) as gf:
+              self.old_geometry = gf.read()
+          except OSError:
+            self.old_geometry = None
+        return io.StringIO()
+      if (self.shared_path is None) or (section in LOCAL_SECTIONS):
+        return open ( self.section_file_name(section), 'w' )
+      return io.StringIO()
+
+    def close ( self, out_file, section, actually_wrote ):
+      """ Close the file of a section and include it from the main file if anything was written """
+      if out_file == self.f:
+        return
+      file_name = None
+      if (self.shared_path is None) or (section in LOCAL_SECTIONS):
+        if isinstance ( out_file, io.StringIO ):
+          with open ( self.section_file_name(section), 'w' ) as sf:
+            sf.write ( out_file.getvalue() )
+        else:
+          out_file.close()
+        file_name = self.scene_name + '.' + section + '.mdl'
+      elif actually_wrote:
+        shared_file = write_shared_file ( out_file.getvalue(), self.shared_path, self.scene_name + '.' + section )
+        file_name = self.shared_file_name ( os.path.basename(shared_file) )
+        if self.keys.get(section) is not None:
+          self.new_shared_sections[self.keys[section]] = os.path.basename ( shared_file )
+        if section == 'geometry':
+          self.new_shared_geometry = { 'file': os.path.basename(shared_file), 'objects': self.new_objects }
+      include_name = None
+      if actually_wrote:
+        include_name = file_name
+        self.f.write ( 'INCLUDE_FILE = "' + include_name + '"\n\n' )
+      stamp = None
+      if file_name is not None:
+        stamp = file_stamp ( os.path.join(self.modular_path,file_name) )
+      self.new_sections[section] = { 'key': self.keys.get(section), 'include': include_name, 'file': file_name, 'stamp': stamp }
+      self.old_geometry = None
+
+    def object_key ( self, obj, geom_obj ):
+      return hash_inputs ( [ self.writer_id, obj, geom_obj ] )
+
+    def get_object ( self, name, key ):
+      """ Return the MDL of an object from the previous geometry file (None if it has changed) """
+      old = self.old_objects.get ( name )
+      if (self.old_geometry is None) or (old is None) or (old['key'] != key):
+        return None
+      return self.old_geometry[old['start']:old['end']]
+
+    def put_object ( self, name, key, start, end ):
+      self.new_objects[name] = { 'key': key, 'start': start, 'end': end }
+
+    def save ( self ):
+      """ Save the indexes of the sections written (for the next export) """
+      if self.modular_path is None:
+        return
+      write_json_file ( self.index_file_name(), { 'writer_id': self.writer_id,
+                        'sections': self.new_sections, 'objects': self.new_objects } )
+      if (len(self.new_shared_sections) > 0) or (self.new_shared_geometry is not None):
+        # Other exports may have added to the shared index since it was read
+        shared_index_file = os.path.join ( self.shared_path, SHARED_SECTION_INDEX )
+        index = read_json_file ( shared_index_file )
+        if index.get('writer_id') != self.writer_id:
+          index = { 'writer_id': self.writer_id, 'sections': {}, 'geometry': None }
+        index['sections'].update ( self.new_shared_sections )
+        if self.new_shared_geometry is not None:
+          index['geometry'] = self.new_shared_geometry
+        write_json_file ( shared_index_file, index )
+
+
+def clear_output_dir ( output_dir, keep_paths=() ):
+    """ Remove everything in an output directory except for the shared MDL, KEPT_OUTPUT_FILES and the paths in keep_paths
+
+    Directories holding a kept path are cleared around it (like the run
+    directories holding the cached outputs listed by run_cache.cached_outputs).
+    """
+    if not os.path.isdir ( output_dir ):
+      return
+    keep = set ( [ os.path.abspath(p) for p in keep_paths ] )
+    for name in ( SHARED_MDL_DIR, ) + KEPT_OUTPUT_FILES:
+      keep.add ( os.path.abspath(os.path.join(output_dir, name)) )
+    remove_all_except ( os.path.abspath(output_dir), keep )
+
+def remove_all_except ( dir_name, keep ):
+    """ Remove the contents of a directory except for the (absolute) paths in keep """
+    for name in os.listdir ( dir_name ):
+      path = os.path.join ( dir_name, name )
+      if path in keep:
+        continue
+      if os.path.isdir ( path ) and not os.path.islink ( path ):
+        if [ p for p in keep if p.startswith(path + os.sep) ]:
+          remove_all_except ( path, keep )
+        else:
+          shutil.rmtree ( path )
+      else:
+        os.remove ( path )
+
+def collect_shared_files ( output_dir ):
+    """ Remove the files of the shared MDL directory that no run includes (returns the number removed)
+
+    A shared file is kept while the section index of some run in the output
+    directory includes it (along with the sidecars named in it). Entries of
+    the shared index for other files are dropped, so later exports only reuse
+    sections that are still on disk. This keeps the shared directory from
+    growing with every edit of the model. Call it once all of the runs have
+    been exported.
+    """
+    shared_path = os.path.abspath ( os.path.join(output_dir, SHARED_MDL_DIR) )
+    if not os.path.isdir ( shared_path ):
+      return 0
+    used = set()
+    for dir_name, dir_names, file_names in os.walk ( output_dir ):
+      # Skip the shared directory itself and the (possibly large) simulation output
+      dir_names[:] = [ d for d in dir_names if not ( (d in ('react_data','viz_data')) or
+                       (os.path.abspath(os.path.join(dir_name,d)) == shared_path) ) ]
+      for file_name in file_names:
+        if not file_name.endswith ( SECTION_INDEX_SUFFIX ):
+          continue
+        index = read_json_file ( os.path.join(dir_name,file_name) )
+        for entry in index.get('sections',{}).values():
+          if entry.get('file') is not None:
+            path = os.path.abspath ( os.path.join(dir_name,entry['file']) )
+            if os.path.dirname(path) == shared_path:
+              used.add ( os.path.basename(path) )
+    # Sidecars are named by stubs in the geometry files that include them
+    for name in list(used):
+      try:
+        with open ( os.path.join(shared_path,name), 'r' ) as sf:
+          for line in sf:
+            stub = geometry_sidecar.parse_sidecar_stub ( line )
+            if stub is not None:
+              used.add ( stub[1] )
+      except OSError:
+        pass
+    shared_index_file = os.path.join ( shared_path, SHARED_SECTION_INDEX )
+    index = read_json_file ( shared_index_file )
+    if 'sections' in index:
+      sections = { key: name for key, name in index['sections'].items() if name in used }
+      geometry = index.get ( 'geometry' )
+      if (geometry is not None) and not (geometry['file'] in used):
+        geometry = None
+      if (sections != index['sections']) or (geometry != index.get('geometry')):
+        index['sections'] = sections
+        index['geometry'] = geometry
+        write_json_file ( shared_index_file, index )
+    num_removed = 0
+    for name in os.listdir ( shared_path ):
+      if (name.endswith('.mdl') or name.endswith(geometry_sidecar.SIDECAR_SUFFIX)) and not (name in used):
+        try:
+          os.remove ( os.path.join(shared_path,name) )
+          num_removed += 1
+        except OSError:
+          pass
+    return num_removed
+
+
 #### Start of MDL Code ####
 
 """
@@ -261,14 +646,11 @@ def write_obj_as_mdl ( scene_name, obj_name, points, faces, regions_dict, region
     out_file.write ( "{\n" )
     out_file.write ( "  VERTEX_LIST\n" )
     out_file.write ( "  {\n" )
-    for p in points:
-        out_file.write ( "    [ " + str(p[0]) + ", " + str(p[1]) + ", " + str(p[2]) + " ]\n" );
+    write_geometry_rows ( out_file, points, "    [ %s, %s, %s ]\n" )
     out_file.write ( "  }\n" )
     out_file.write ( "  ELEMENT_CONNECTIONS\n" )
     out_file.write ( "  {\n" )
-    for f in faces:
-        s = "    [ " + str(f[0]) + ", " + str(f[1]) + ", " + str(f[2]) + " ]\n"
-        out_file.write ( s );
+    write_geometry_rows ( out_file, faces, "    [ %s, %s, %s ]\n" )
     out_file.write ( "  }\n" )
 
     if len(regions_dict) > 0:
@@ -994,8 +1376,15 @@ def requires_mcellr ( dm ):
 #####################################################################################################################
 
 
-def write_mdl ( dm, file_name, scene_name='Scene', fail_on_error=False ):
-    """ Write a data model to a named file (generally follows "export_mcell_mdl" ordering) """
+def write_mdl ( dm, file_name, scene_name='Scene', fail_on_error=False, shared_path=None, binary_geometry=False ):
+    """ Write a data model to a named file (generally follows "export_mcell_mdl" ordering)
+
+    Modular sections are only written when their inputs have changed since the
+    last export to the same directory. With a shared_path, the sections other
+    than the parameters are saved by content in shared_path (see SectionFiles).
+    With binary_geometry, each static object is also saved as a binary sidecar
+    next to the file holding its MDL (see geometry_sidecar).
+    """
 
     print ( "%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%" )
     print ( "Top of data_model_to_mdl.write_mdl() to " + str(file_name) )
@@ -1045,6 +1434,10 @@ def write_mdl ( dm, file_name, scene_name='Scene', fail_on_error=False ):
     if not export_cellblender_data:
       f.write ( "/* MDL from scripts alone - all CellBlender data ignored!! */" )
 
+    # Sections are only written again when their inputs have changed since the last export
+    sections = SectionFiles ( f, modular_path, shared_path, scene_name,
+                              writer_id=[ dm['mcell'].get('cellblender_source_sha1'), DATA_MODEL_FROM_MDL, binary_geometry ] )
+
     actually_wrote = False
     if ('mcell' in dm):
       mcell = dm['mcell']
@@ -1071,75 +1464,55 @@ def write_mdl ( dm, file_name, scene_name='Scene', fail_on_error=False ):
 
       if export_cellblender_data and ('parameter_system' in mcell):
         ps = mcell['parameter_system']
-        out_file = f
-        if not (modular_path is None):
-          out_file = open ( os.path.join(modular_path,scene_name+'.parameters.mdl'), 'w' )
-        actually_wrote = write_parameter_system ( ps, out_file )
-        print ( "actually_wrote parameters = " + str(actually_wrote) )
-        if not (out_file == f):
-          out_file.close()
-          if actually_wrote:
-            f.write ( 'INCLUDE_FILE = "' + scene_name + '.parameters.mdl"\n\n' )
+        if not sections.reuse ( 'parameters', ps ):
+          out_file = sections.open ( 'parameters' )
+          actually_wrote = write_parameter_system ( ps, out_file )
+          print ( "actually_wrote parameters = " + str(actually_wrote) )
+          sections.close ( out_file, 'parameters', actually_wrote )
 
       write_export_scripting ( dm, 'after', 'parameters', f )
       write_export_scripting ( dm, 'before', 'initialization', f )
 
       if export_cellblender_data and ('initialization' in mcell):
         init = mcell['initialization']
-        out_file = f
-        if not (modular_path is None):
-          out_file = open ( os.path.join(modular_path,scene_name + '.initialization.mdl'), 'w' )
-        actually_wrote = write_initialization ( init, out_file )
-        print ( "actually_wrote initialization = " + str(actually_wrote) )
-        if 'partitions' in init:
-          parts = mcell['initialization']['partitions']
-          write_partitions ( parts, out_file )
-        if not (out_file == f):
-          out_file.close()
-          if actually_wrote:
-            f.write ( 'INCLUDE_FILE = "' + scene_name + '.initialization.mdl"\n\n' )
+        if not sections.reuse ( 'initialization', init ):
+          out_file = sections.open ( 'initialization' )
+          actually_wrote = write_initialization ( init, out_file )
+          print ( "actually_wrote initialization = " + str(actually_wrote) )
+          if 'partitions' in init:
+            parts = mcell['initialization']['partitions']
+            write_partitions ( parts, out_file )
+          sections.close ( out_file, 'initialization', actually_wrote )
 
       write_export_scripting ( dm, 'after', 'initialization', f )
       write_export_scripting ( dm, 'before', 'molecules', f )
 
       if export_cellblender_data and ('define_molecules' in mcell):
         mols = mcell['define_molecules']
-        out_file = f
-        if not (modular_path is None):
-          out_file = open ( os.path.join(modular_path,scene_name + '.molecules.mdl'), 'w' )
-        actually_wrote = write_molecules ( mols, out_file )
-        if not (out_file == f):
-          out_file.close()
-          if actually_wrote:
-            f.write ( 'INCLUDE_FILE = "' + scene_name + '.molecules.mdl"\n\n' )
+        if not sections.reuse ( 'molecules', mols ):
+          out_file = sections.open ( 'molecules' )
+          actually_wrote = write_molecules ( mols, out_file )
+          sections.close ( out_file, 'molecules', actually_wrote )
 
       write_export_scripting ( dm, 'after', 'molecules', f )
       write_export_scripting ( dm, 'before', 'surface_classes', f )
 
       if export_cellblender_data and ('define_surface_classes' in mcell):
         sclasses = mcell['define_surface_classes']
-        out_file = f
-        if not (modular_path is None):
-          out_file = open ( os.path.join(modular_path,scene_name + '.surface_classes.mdl'), 'w' )
-        actually_wrote = write_surface_classes ( sclasses, out_file )
-        if not (out_file == f):
-          out_file.close()
-          if actually_wrote:
-            f.write ( 'INCLUDE_FILE = "' + scene_name + '.surface_classes.mdl"\n\n' )
+        if not sections.reuse ( 'surface_classes', sclasses ):
+          out_file = sections.open ( 'surface_classes' )
+          actually_wrote = write_surface_classes ( sclasses, out_file )
+          sections.close ( out_file, 'surface_classes', actually_wrote )
 
       write_export_scripting ( dm, 'after', 'surface_classes', f )
       write_export_scripting ( dm, 'before', 'reactions', f )
 
       if export_cellblender_data and ('define_reactions' in mcell):
         reacts = mcell['define_reactions']
-        out_file = f
-        if not (modular_path is None):
-          out_file = open ( os.path.join(modular_path,scene_name + '.reactions.mdl'), 'w' )
-        actually_wrote = write_reactions ( reacts, out_file )
-        if not (out_file == f):
-          out_file.close()
-          if actually_wrote:
-            f.write ( 'INCLUDE_FILE = "' + scene_name + '.reactions.mdl"\n\n' )
+        if not sections.reuse ( 'reactions', reacts ):
+          out_file = sections.open ( 'reactions' )
+          actually_wrote = write_reactions ( reacts, out_file )
+          sections.close ( out_file, 'reactions', actually_wrote )
 
       write_export_scripting ( dm, 'after', 'reactions', f )
       write_export_scripting ( dm, 'before', 'geometry', f )
@@ -1154,14 +1527,23 @@ def write_mdl ( dm, file_name, scene_name='Scene', fail_on_error=False ):
             scripting = None
             if 'scripting' in mcell:
                 scripting = mcell['scripting']
-            out_file = f
-            if not (modular_path is None):
-              out_file = open ( os.path.join(modular_path,scene_name + '.geometry.mdl'), 'w' )
-            actually_wrote = write_static_geometry ( objs, geom, dm, out_file )
-            if not (out_file == f):
-              out_file.close()
-              if actually_wrote:
-                f.write ( 'INCLUDE_FILE = "' + scene_name + '.geometry.mdl"\n\n' )
+            # Geometry from scripts can depend on anything, so it's always written
+            geom_inputs = [ objs, geom ]
+            if 'script' in [ o.get('object_source') for o in objs['model_object_list'] ]:
+              geom_inputs = None
+            if not sections.reuse ( 'geometry', geom_inputs ):
+              out_file = sections.open ( 'geometry' )
+              object_cache = None
+              if not (modular_path is None):
+                object_cache = sections
+              sidecar_path = None
+              if binary_geometry:
+                # Sidecars go next to the file that will hold the geometry
+                sidecar_path = sections.section_dir ( 'geometry' )
+                if sidecar_path is None:
+                  sidecar_path = os.path.dirname ( file_name )
+              actually_wrote = write_static_geometry ( objs, geom, dm, out_file, object_cache, sidecar_path, scene_name )
+              sections.close ( out_file, 'geometry', actually_wrote )
         else:
           # The geometry will be written to other files, just specify the list file name
           out_file = f
@@ -1177,28 +1559,20 @@ def write_mdl ( dm, file_name, scene_name='Scene', fail_on_error=False ):
 
       if export_cellblender_data and ('modify_surface_regions' in mcell):
         modsurfrs = mcell['modify_surface_regions']
-        out_file = f
-        if not (modular_path is None):
-          out_file = open ( os.path.join(modular_path,scene_name + '.mod_surf_regions.mdl'), 'w' )
-        actually_wrote = write_modify_surf_regions ( modsurfrs, out_file )
-        if not (out_file == f):
-          out_file.close()
-          if actually_wrote:
-            f.write ( 'INCLUDE_FILE = "' + scene_name + '.mod_surf_regions.mdl"\n\n' )
+        if not sections.reuse ( 'mod_surf_regions', modsurfrs ):
+          out_file = sections.open ( 'mod_surf_regions' )
+          actually_wrote = write_modify_surf_regions ( modsurfrs, out_file )
+          sections.close ( out_file, 'mod_surf_regions', actually_wrote )
 
       write_export_scripting ( dm, 'after', 'mod_surf_regions', f )
       write_export_scripting ( dm, 'before', 'release_patterns', f )
 
       if export_cellblender_data and ('define_release_patterns' in mcell):
         pats = mcell['define_release_patterns']
-        out_file = f
-        if not (modular_path is None):
-          out_file = open ( os.path.join(modular_path,scene_name + '.release_patterns.mdl'), 'w' )
-        actually_wrote = write_release_patterns ( pats, out_file )
-        if not (out_file == f):
-          out_file.close()
-          if actually_wrote:
-            f.write ( 'INCLUDE_FILE = "' + scene_name + '.release_patterns.mdl"\n\n' )
+        if not sections.reuse ( 'release_patterns', pats ):
+          out_file = sections.open ( 'release_patterns' )
+          actually_wrote = write_release_patterns ( pats, out_file )
+          sections.close ( out_file, 'release_patterns', actually_wrote )
 
 
       write_export_scripting ( dm, 'after', 'release_patterns', f )
@@ -1232,10 +1606,6 @@ def write_mdl ( dm, file_name, scene_name='Scene', fail_on_error=False ):
         has_static_geometry = False
 
       # Actually write the MDL:
-      out_file = f
-      if not (modular_path is None):
-        out_file = open ( os.path.join(modular_path,scene_name + '.instantiation.mdl'), 'w' )
-
       if has_static_geometry or has_release_sites:
         # Put both together into the same INSTANTIATE block
         block_name = scene_name
@@ -1243,36 +1613,38 @@ def write_mdl ( dm, file_name, scene_name='Scene', fail_on_error=False ):
           # The dynamic geometry uses the name "Scene" so choose something else here
           block_name = "Releases"
 
-        if export_cellblender_data:
+        objs = None
+        geom = None
+        if 'model_objects' in mcell:
+          objs = mcell['model_objects']
+        if 'geometrical_objects' in mcell:
+          geom = mcell['geometrical_objects']
+        rels = None
+        if has_release_sites:
+          rels = mcell['release_sites']
+        inst_inputs = [ block_name, has_static_geometry, objs, geom, rels, mcell.get('define_molecules') ]
+        write_inst = export_cellblender_data and not sections.reuse ( 'instantiation', inst_inputs )
+
+        if write_inst:
+          out_file = sections.open ( 'instantiation' )
+          actually_wrote = False
           out_file.write ( "INSTANTIATE " + block_name + " OBJECT\n" )
           out_file.write ( "{\n" )
           if has_static_geometry:
-            objs = None
-            geom = None
-            if 'model_objects' in mcell:
-              objs = mcell['model_objects']
-            if 'geometrical_objects' in mcell:
-              geom = mcell['geometrical_objects']
             actually_wrote = write_static_instances ( scene_name, objs, geom, out_file )
 
         write_export_scripting ( dm, 'before', 'release_sites', f )
 
-        if export_cellblender_data:
+        if write_inst:
           if has_release_sites:
-            rels = mcell['release_sites']
             wrote_rels = write_release_sites ( scene_name, rels, mcell['define_molecules'], out_file )
             actually_wrote = actually_wrote or wrote_rels
 
         write_export_scripting ( dm, 'after', 'release_sites', f )
 
-        if export_cellblender_data:
+        if write_inst:
           out_file.write ( "}\n\n" )
-
-        if export_cellblender_data:
-          if not (out_file == f):
-            out_file.close()
-            if actually_wrote:
-              f.write ( 'INCLUDE_FILE = "' + scene_name + '.instantiation.mdl"\n\n' )
+          sections.close ( out_file, 'instantiation', actually_wrote )
 
       write_export_scripting ( dm, 'after', 'instantiate', f )
       write_export_scripting ( dm, 'before', 'seed', f )
@@ -1288,14 +1660,10 @@ def write_mdl ( dm, file_name, scene_name='Scene', fail_on_error=False ):
         mols = None
         if ('define_molecules' in mcell):
           mols = mcell['define_molecules']
-        out_file = f
-        if not (modular_path is None):
-          out_file = open ( os.path.join(modular_path,scene_name + '.viz_output.mdl'), 'w' )
-        actually_wrote = write_viz_out ( scene_name, vizout, mols, out_file )
-        if not (out_file == f):
-          out_file.close()
-          if actually_wrote:
-            f.write ( 'INCLUDE_FILE = "' + scene_name + '.viz_output.mdl"\n\n' )
+        if not sections.reuse ( 'viz_output', [ vizout, mols ] ):
+          out_file = sections.open ( 'viz_output' )
+          actually_wrote = write_viz_out ( scene_name, vizout, mols, out_file )
+          sections.close ( out_file, 'viz_output', actually_wrote )
 
       write_export_scripting ( dm, 'after', 'viz_output', f )
       write_export_scripting ( dm, 'before', 'rxn_output', f )
@@ -1310,20 +1678,17 @@ def write_mdl ( dm, file_name, scene_name='Scene', fail_on_error=False ):
           init = mcell['initialization']
           if "time_step" in init:
             time_step = init['time_step']
-        out_file = f
-        if not (modular_path is None):
-          out_file = open ( os.path.join(modular_path,scene_name + '.rxn_output.mdl'), 'w' )
-        actually_wrote = write_react_out ( scene_name, reactout, mols, time_step, out_file )
-        if not (out_file == f):
-          out_file.close()
-          if actually_wrote:
-            f.write ( 'INCLUDE_FILE = "' + scene_name + '.rxn_output.mdl"\n\n' )
+        if not sections.reuse ( 'rxn_output', [ reactout, mols, time_step, DATA_MODEL_FROM_MDL ] ):
+          out_file = sections.open ( 'rxn_output' )
+          actually_wrote = write_react_out ( scene_name, reactout, mols, time_step, out_file )
+          sections.close ( out_file, 'rxn_output', actually_wrote )
 
       write_export_scripting ( dm, 'after', 'rxn_output', f )
 
       write_export_scripting ( dm, 'after', 'everything', f )
 
     f.close()
+    sections.save()
 
     # Check for any dynamic objects, and update MDL as needed
 
@@ -1495,8 +1860,7 @@ def write_mdl ( dm, file_name, scene_name='Scene', fail_on_error=False ):
 #                       mesh = geom_obj.to_mesh(context.scene, True, 'PREVIEW', calc_tessface=False)
                         mesh = geom_obj.to_mesh(preserve_all_data_layers=True, depsgraph=context.evaluated_depsgraph_get())
                         mesh.transform(mathutils.Matrix() @ geom_obj.matrix_world)
-                        points = [v.co for v in mesh.vertices]
-                        faces = [f.vertices for f in mesh.polygons]
+                        ( points, faces ) = get_mesh_geometry ( mesh )
                         regions_dict = geom_obj.mcell.get_regions_dictionary(geom_obj)
                         del mesh
                     else:
@@ -1855,7 +2219,12 @@ def write_reactions ( reacts, f ):
     return wrote_mdl
 
 
-def write_static_geometry ( objs, geom, dm, f ):
+def write_static_geometry ( objs, geom, dm, f, object_cache=None, sidecar_path=None, scene_name='Scene' ):
+    """ Write the static geometry objects (copying unchanged objects from the object_cache if given)
+
+    With a sidecar_path, the objects from the data model are also saved as binary
+    sidecars in that directory and preceded by a stub naming their sidecar.
+    """
     wrote_mdl = False
     if 'object_list' in geom:
       glist = geom['object_list']
@@ -1887,7 +2256,16 @@ def write_static_geometry ( objs, geom, dm, f ):
           else:
             # Write static objects here
             wrote_mdl = True
-            if obj['object_source'] == 'script':
+            object_key = None
+            cached_mdl = None
+            if (object_cache is not None) and (obj['object_source'] != 'script'):
+              object_key = object_cache.object_key ( obj, g )
+              cached_mdl = object_cache.get_object ( g['name'], object_key )
+              object_start = f.tell()
+            if cached_mdl is not None:
+              # This object hasn't changed since the last export
+              f.write ( cached_mdl )
+            elif obj['object_source'] == 'script':
               # Generate this object's MDL from a script
 
               # print ( "  Saving static geometry for object " + obj['name'] + " with script \"" + obj['script_name'] + "\"" )
@@ -1927,8 +2305,7 @@ def write_static_geometry ( objs, geom, dm, f ):
 #                 mesh = geom_obj.to_mesh(context.scene, True, 'PREVIEW', calc_tessface=False)
                   mesh = geom_obj.to_mesh(preserve_all_data_layers=True, depsgraph=context.evaluated_depsgraph_get())
                   mesh.transform(mathutils.Matrix() @ geom_obj.matrix_world)
-                  points = [v.co for v in mesh.vertices]
-                  faces = [f.vertices for f in mesh.polygons]
+                  ( points, faces ) = get_mesh_geometry ( mesh )
                   regions_dict = geom_obj.mcell.get_regions_dictionary(geom_obj)
                   del mesh
               else:
@@ -1974,14 +2351,12 @@ def write_static_geometry ( objs, geom, dm, f ):
               if len(points) > 0:
                 f.write ( "  VERTEX_LIST\n" )
                 f.write ( "  {\n" )
-                for v in points:
-                  f.write ( "    [ %.15g, %.15g, %.15g ]\n" % ( loc_x+v[0], loc_y+v[1], loc_z+v[2] ) )
+                write_geometry_rows ( f, points, VERTEX_ROW_FORMAT, ( loc_x, loc_y, loc_z ) )
                 f.write ( "  }\n" )
               if len(faces) > 0:
                 f.write ( "  ELEMENT_CONNECTIONS\n" )
                 f.write ( "  {\n" )
-                for c in faces:
-                  f.write ( "    [ %d, %d, %d ]\n" % ( c[0], c[1], c[2] ) )
+                write_geometry_rows ( f, faces, FACE_ROW_FORMAT )
                 f.write ( "  }\n" )
               if len(regions_dict) > 0:
                 rkeys = sorted ( regions_dict.keys() )
@@ -2009,19 +2384,23 @@ def write_static_geometry ( objs, geom, dm, f ):
                 loc_x = g['location'][0]
                 loc_y = g['location'][1]
                 loc_z = g['location'][2]
+              if sidecar_path is not None:
+                regions = [ ( r['name'], [ int(e) for e in r.get('include_elements',[]) ] ) for r in g.get('define_surface_regions',[]) ]
+                sidecar_file = geometry_sidecar.write_sidecar ( sidecar_path, scene_name, g['name'],
+                                                                g.get('vertex_list',[]), g.get('element_connections',[]),
+                                                                regions, ( loc_x, loc_y, loc_z ) )
+                f.write ( geometry_sidecar.sidecar_stub ( g['name'], sidecar_file ) )
               f.write ( "%s POLYGON_LIST\n" % g['name'] )
               f.write ( "{\n" )
               if 'vertex_list' in g:
                 f.write ( "  VERTEX_LIST\n" )
                 f.write ( "  {\n" )
-                for v in g['vertex_list']:
-                  f.write ( "    [ %.15g, %.15g, %.15g ]\n" % ( loc_x+v[0], loc_y+v[1], loc_z+v[2] ) )
+                write_geometry_rows ( f, g['vertex_list'], VERTEX_ROW_FORMAT, ( loc_x, loc_y, loc_z ) )
                 f.write ( "  }\n" )
               if 'element_connections' in g:
                 f.write ( "  ELEMENT_CONNECTIONS\n" )
                 f.write ( "  {\n" )
-                for c in g['element_connections']:
-                  f.write ( "    [ %d, %d, %d ]\n" % ( c[0], c[1], c[2] ) )
+                write_geometry_rows ( f, g['element_connections'], FACE_ROW_FORMAT )
                 f.write ( "  }\n" )
               if 'define_surface_regions' in g:
                 f.write ( "  DEFINE_SURFACE_REGIONS\n" )
@@ -2036,6 +2415,8 @@ def write_static_geometry ( objs, geom, dm, f ):
                 f.write ( "  }\n" )
               f.write ( "}\n")
               f.write ( "\n" );
+            if object_key is not None:
+              object_cache.put_object ( g['name'], object_key, object_start, f.tell() )
     return wrote_mdl
 
 
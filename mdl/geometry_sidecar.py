@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+"""
+Binary geometry sidecar files for large meshes.
+
+A sidecar holds the vertices, faces and surface regions of one MDL polygon
+list object as little-endian binary arrays:
+
+  8 bytes   SIDECAR_MAGIC
+  4 bytes   length of the header (unsigned little-endian int)
+  header    JSON: name, num_vertices, num_faces, regions ([name, count] pairs)
+            and the SHA1 of the data that follows
+  data      vertices (float64 x, y, z), faces (int32 v0, v1, v2) and then the
+            faces of each region (int32) in header order
+
+MCell still reads the geometry from the MDL text, so the sidecar is written
+next to the MDL file holding the object and the object is preceded by a small
+text stub (an MDL comment) naming its sidecar:
+
+  /* BINARY_GEOMETRY Cube "Scene.Cube.<sha1>.cbgeom" */
+  Cube POLYGON_LIST
+  ...
+
+Importers that find the stub (and a sidecar matching its checksum) read the
+arrays instead of parsing the text. Sidecar names are relative to the MDL file
+holding the stub.
+
+This file is used both by CellBlender and by stand-alone scripts so it only
+depends on the standard library.
+"""
+
+import os
+import re
+import sys
+import json
+import array
+import struct
+import hashlib
+import itertools
+
+
+SIDECAR_MAGIC = b"CBGEOM1\n"
+SIDECAR_VERSION = 1
+SIDECAR_SUFFIX = ".cbgeom"
+
+STUB_FORMAT = '/* BINARY_GEOMETRY %s "%s" */\n'
+STUB_PATTERN = re.compile ( r'^\s*/\*\s*BINARY_GEOMETRY\s+(\S+)\s+"([^"]+)"\s*\*/' )
+
+
+def flat_array ( typecode, rows, offset=None ):
+    """ Return the rows (a list of lists or a NumPy array) as a flat little-endian array """
+    if hasattr ( rows, 'reshape' ):
+        if offset is not None:
+            rows = rows + offset
+        rows = rows.reshape(-1).tolist()
+    elif (offset is not None) and any ( offset ):
+        rows = [ c + o for row in rows for c, o in zip(row, offset) ]
+    else:
+        rows = itertools.chain.from_iterable ( rows )
+    a = array.array ( typecode, rows )
+    if sys.byteorder != 'little':
+        a.byteswap()
+    return a
+
+
+def encode_sidecar ( name, vertices, faces, regions, offset=None ):
+    """ Return the bytes of a sidecar (regions is a list of (name, faces) pairs) """
+    verts = flat_array ( 'd', vertices, offset )
+    tris = flat_array ( 'i', faces )
+    region_arrays = [ flat_array('i', [reg_faces]) for reg_name, reg_faces in regions ]
+    h = hashlib.sha1()
+    for a in [ verts, tris ] + region_arrays:
+        h.update ( a.tobytes() )
+    header = { 'version': SIDECAR_VERSION, 'name': name,
+               'num_vertices': len(verts) // 3, 'num_faces': len(tris) // 3,
+               'regions': [ [reg_name, len(a)] for (reg_name, reg_faces), a in zip(regions, region_arrays) ],
+               'sha1': h.hexdigest() }
+    header_bytes = json.dumps ( header, sort_keys=True ).encode ( 'utf-8' )
+    parts = [ SIDECAR_MAGIC, struct.pack('<I', len(header_bytes)), header_bytes ]
+    parts.extend ( [ a.tobytes() for a in [ verts, tris ] + region_arrays ] )
+    return ( b"".join(parts), header['sha1'] )
+
+
+def write_sidecar ( directory, prefix, name, vertices, faces, regions, offset=None ):
+    """ Write a sidecar named by its checksum (unless it's already there) and return its file name """
+    ( data, digest ) = encode_sidecar ( name, vertices, faces, regions, offset )
+    file_name = os.path.join ( directory, prefix + '.' + name + '.' + digest + SIDECAR_SUFFIX )
+    if not os.path.exists ( file_name ):
+        if not os.path.exists ( directory ):
+            os.makedirs ( directory, exist_ok=True )
+        tmp_file = file_name + ".%d.tmp" % os.getpid()
+        with open ( tmp_file, 'wb' ) as f:
+            f.write ( data )
+        os.replace ( tmp_file, file_name )
+    return file_name
+
+
+def sidecar_stub ( name, file_name ):
+    """ Return the MDL comment that names the sidecar of an object """
+    return STUB_FORMAT % ( name, os.path.basename(file_name) )
+
+
+def parse_sidecar_stub ( line ):
+    """ Return (object name, sidecar name) from a stub line (None if it isn't a stub) """
+    m = STUB_PATTERN.match ( line )
+    if m is None:
+        return None
+    return ( m.group(1), m.group(2) )
+
+
+def read_sidecar ( file_name ):
+    """ Read a sidecar and return a dictionary of its name, vertices, faces and regions
+
+    The vertices and faces are flat arrays (see group_rows) and the regions are
+    a list of (name, faces) pairs. Raises ValueError if the file isn't a valid
+    sidecar or doesn't match its checksum.
+    """
+    with open ( file_name, 'rb' ) as f:
+        data = f.read()
+    if data[0:len(SIDECAR_MAGIC)] != SIDECAR_MAGIC:
+        raise ValueError ( "Not a binary geometry file: " + str(file_name) )
+    pos = len(SIDECAR_MAGIC)
+    header_len = struct.unpack_from ( '<I', data, pos )[0]
+    pos += 4
+    header = json.loads ( data[pos:pos+header_len].decode('utf-8') )
+    pos += header_len
+    if header.get('version') != SIDECAR_VERSION:
+        raise ValueError ( "Unsupported binary geometry version in " + str(file_name) )
+    if hashlib.sha1(data[pos:]).hexdigest() != header['sha1']:
+        raise ValueError ( "Checksum mismatch in binary geometry file " + str(file_name) )
+
+    def next_array ( typecode, count ):
+        nonlocal pos
+        a = array.array ( typecode )
+        end = pos + (count * a.itemsize)
+        if end > len(data):
+            raise ValueError ( "Truncated binary geometry file " + str(file_name) )
+        a.frombytes ( data[pos:end] )
+        if sys.byteorder != 'little':
+            a.byteswap()
+        pos = end
+        return a
+
+    result = { 'name': header['name'] }
+    result['vertices'] = next_array ( 'd', 3 * header['num_vertices'] )
+    result['faces'] = next_array ( 'i', 3 * header['num_faces'] )
+    result['regions'] = [ (reg_name, next_array('i', count)) for reg_name, count in header['regions'] ]
+    return result
+
+
+def group_rows ( values, n=3 ):
+    """ Return a flat array as a list of lists of n values """
+    it = iter ( values )
+    return [ list(row) for row in zip(*([it]*n)) ]
+
+
+def find_sidecars ( mdl_file_name ):
+    """ Return the stubs in an MDL file as a list of (object name, sidecar file name) """
+    stubs = []
+    directory = os.path.dirname ( mdl_file_name )
+    with open ( mdl_file_name, 'r' ) as f:
+        for line in f:
+            if 'BINARY_GEOMETRY' in line:
+                stub = parse_sidecar_stub ( line )
+                if stub is not None:
+                    stubs.append ( ( stub[0], os.path.join(directory, stub[1]) ) )
+    return stubs
@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+
+"""
+Content-addressed cache of completed simulation runs.
+
+Each run is identified by a key: a hash of its fully expanded data model (with the
+swept parameter values substituted), its seed and the engine that runs it.
+When a run completes, its key and location (run directory and seed) are recorded in
+an index file in the output_data directory. When a sweep is run again, runs whose key
+is already in the index are either skipped (when the results are already where the
+new sweep expects them) or linked from where they were computed (when changing a
+sweep range moved the point to a different index directory).
+
+This file is used both by CellBlender and by the stand-alone run_data_model_mcell.py
+so it only depends on the standard library.
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import threading
+
+
+# Index of completed runs (in the output_data directory)
+RUN_CACHE_INDEX = "run_cache.json"
+
+# Directory (in the output_data directory) where linked results are staged
+RUN_CACHE_STAGING = ".run_cache_staging"
+
+# Top level data model entries that don't change the results of a run
+IGNORED_DM_KEYS = ( 'blender_version', 'cellblender_version', 'cellblender_source_sha1',
+                    'api_version', 'mol_viz', 'simulation_control' )
+
+# Parameter entries that describe the sweep rather than the value used by a run
+IGNORED_PAR_KEYS = ( 'sweep_expression', 'sweep_enabled', '_extras' )
+
+# Directories (relative to a run directory) holding the results of a seed
+SEED_OUTPUT_DIRS = ( "react_data", "viz_data" )
+
+index_lock = threading.Lock()
+
+
+def hash_json ( obj ):
+    """ Return the SHA1 hex digest of a canonical JSON encoding of obj """
+    text = json.dumps ( obj, sort_keys=True, separators=(',',':'), default=str )
+    return hashlib.sha1 ( text.encode('utf-8') ).hexdigest()
+
+
+def model_hash ( dm ):
+    """ Hash everything in an (unwrapped) data model except the parameters, which change between sweep points """
+    static_dm = {}
+    for k in dm.keys():
+        if not ((k in IGNORED_DM_KEYS) or (k == 'parameter_system')):
+            static_dm[k] = dm[k]
+    return hash_json ( static_dm )
+
+
+def parameters_hash ( par_system ):
+    """ Hash the parameter values of a data model (after sweep values have been substituted) """
+    pars = []
+    if 'model_parameters' in par_system:
+        for par in par_system['model_parameters']:
+            pars.append ( { k:par[k] for k in par.keys() if not (k in IGNORED_PAR_KEYS) } )
+    return hash_json ( pars )
+
+
+def engine_id ( engine_path ):
+    """ Identify the engine binary or script by its name, size and modification time """
+    try:
+        st = os.stat ( engine_path )
+        return "%s:%d:%d" % ( os.path.basename(engine_path), st.st_size, int(st.st_mtime) )
+    except (OSError, TypeError):
+        return str(engine_path)
+
+
+def run_key ( model_hash_str, par_system, seed, engine ):
+    """ Return the cache key for one run of a sweep point """
+    return hash_json ( [ model_hash_str, parameters_hash(par_system), int(seed), engine ] )
+
+
+def seed_output_dirs ( run_dir, seed ):
+    return [ os.path.join(run_dir, d, "seed_%05d" % seed) for d in SEED_OUTPUT_DIRS ]
+
+
+def has_outputs ( run_dir, seed ):
+    """ Return True if the output directories of a run hold any (non-empty) result files """
+    for d in seed_output_dirs ( run_dir, seed ):
+        for dir_path, dir_names, file_names in os.walk ( d ):
+            for file_name in file_names:
+                try:
+                    if os.path.getsize ( os.path.join(dir_path, file_name) ) > 0:
+                        return True
+                except OSError:
+                    pass
+    return False
+
+
+def read_index ( output_dir ):
+    """ Return the index of completed runs: { key: [run_dir relative to output_dir, seed] } """
+    try:
+        with open ( os.path.join(output_dir, RUN_CACHE_INDEX) ) as f:
+            return json.load ( f )
+    except (OSError, ValueError):
+        return {}
+
+
+def write_index ( output_dir, index ):
+    index_path = os.path.join ( output_dir, RUN_CACHE_INDEX )
+    with open ( index_path + ".tmp", "w" ) as f:
+        json.dump ( index, f, indent=1, sort_keys=True )
+    os.replace ( index_path + ".tmp", index_path )
+
+
+def record_run ( output_dir, run_dir, seed, key ):
+    """ Record a completed run in the index """
+    with index_lock:
+        index = read_index ( output_dir )
+        index[key] = [ os.path.relpath(run_dir, output_dir), seed ]
+        write_index ( output_dir, index )
+
+
+def cached_outputs ( output_dir ):
+    """ Return the paths in output_dir that hold the cache (the index and the outputs of the runs it lists)
+
+    Clearing output_data for a new sweep keeps these so completed runs can be
+    reused (see prune_runs for removing the ones that the sweep doesn't use).
+    """
+    index = read_index ( output_dir )
+    if len(index) == 0:
+        return []
+    paths = [ os.path.join(output_dir, RUN_CACHE_INDEX) ]
+    for rel_dir, seed in index.values():
+        paths.extend ( seed_output_dirs(os.path.join(output_dir, rel_dir), seed) )
+    return paths
+
+
+def prune_runs ( output_dir, keys ):
+    """ Remove the runs that aren't in keys from the index along with their outputs """
+    keys = set ( keys )
+    with index_lock:
+        index = read_index ( output_dir )
+        kept = { key: loc for key, loc in index.items() if key in keys }
+        if len(kept) == len(index):
+            return
+        kept_locations = set ( [ (loc[0], loc[1]) for loc in kept.values() ] )
+        for key, loc in index.items():
+            if not ((key in kept) or ((loc[0], loc[1]) in kept_locations)):
+                for d in seed_output_dirs ( os.path.join(output_dir, loc[0]), loc[1] ):
+                    if os.path.isdir ( d ):
+                        shutil.rmtree ( d )
+        write_index ( output_dir, kept )
+
+
+def link_or_copy ( src, dst ):
+    # Hard links share the data of the original results (copy where links aren't supported)
+    try:
+        os.link ( src, dst )
+    except OSError:
+        shutil.copy2 ( src, dst )
+
+
+def touch_reaction_data ( run_dir, seed ):
+    """ Mark the reaction data of a reused run as current
+
+    Reaction data plots skip files older than the start of the latest run
+    (start_time.txt), so reused results must look like they were just written.
+    """
+    react_dir = seed_output_dirs ( run_dir, seed )[SEED_OUTPUT_DIRS.index("react_data")]
+    for dir_path, dir_names, file_names in os.walk ( react_dir ):
+        for file_name in file_names:
+            os.utime ( os.path.join(dir_path, file_name) )
+
+
+def plan_runs ( output_dir, runs ):
+    """ Decide which runs need to be run and put cached results in place for the others
+
+    runs is a list of (run_dir, seed, key). Returns a list with 'skip', 'link' or 'run'
+    for each run. Linked results are hard linked (or copied) into their new run directory
+    and old results are removed from the directories of runs that need to be run.
+    The reaction data of skipped and linked runs is touched (see touch_reaction_data).
+    """
+    with index_lock:
+        index = read_index ( output_dir )
+        locations = {}
+        for key, loc in index.items():
+            locations.setdefault ( (loc[0], loc[1]), [] ).append ( key )
+
+        actions = []
+        sources = {}
+        for run_dir, seed, key in runs:
+            rel_dir = os.path.relpath ( run_dir, output_dir )
+            loc = index.get ( key )
+            if (loc is not None) and (loc[0] == rel_dir) and (loc[1] == seed) and has_outputs(run_dir, seed):
+                actions.append ( 'skip' )
+            elif (loc is not None) and has_outputs(os.path.join(output_dir, loc[0]), loc[1]):
+                actions.append ( 'link' )
+                sources[key] = ( os.path.join(output_dir, loc[0]), loc[1] )
+            else:
+                actions.append ( 'run' )
+
+        # Stage the linked results first since their sources may be replaced by other runs
+        staging_dir = os.path.join ( output_dir, RUN_CACHE_STAGING )
+        for key, (src_dir, src_seed) in sources.items():
+            for d, src in zip ( SEED_OUTPUT_DIRS, seed_output_dirs(src_dir, src_seed) ):
+                if os.path.isdir ( src ):
+                    shutil.copytree ( src, os.path.join(staging_dir, key, d), copy_function=link_or_copy )
+
+        for (run_dir, seed, key), action in zip ( runs, actions ):
+            if action == 'skip':
+                continue
+            # Anything at this location is stale
+            rel_dir = os.path.relpath ( run_dir, output_dir )
+            for old_key in locations.pop ( (rel_dir, seed), [] ):
+                if index.get(old_key) == [rel_dir, seed]:
+                    index.pop ( old_key )
+            for d in seed_output_dirs ( run_dir, seed ):
+                if os.path.isdir ( d ):
+                    shutil.rmtree ( d )
+            if action == 'link':
+                for d, dst in zip ( SEED_OUTPUT_DIRS, seed_output_dirs(run_dir, seed) ):
+                    staged = os.path.join ( staging_dir, key, d )
+                    if os.path.isdir ( staged ):
+                        os.makedirs ( os.path.dirname(dst), exist_ok=True )
+                        os.rename ( staged, dst )
+                index[key] = [ rel_dir, seed ]
+
+        if os.path.isdir ( staging_dir ):
+            shutil.rmtree ( staging_dir )
+        write_index ( output_dir, index )
+
+        for (run_dir, seed, key), action in zip ( runs, actions ):
+            if action != 'run':
+                touch_reaction_data ( run_dir, seed )
+    return actions
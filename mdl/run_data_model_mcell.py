@@ -9,6 +9,8 @@ import time
 import sys
 import argparse
 import data_model_to_mdl
+import run_cache
+import sweep_space
 
 
 
@@ -43,6 +45,7 @@ def run_sim(arglist):
     elif log_file_option == 'console':
         log_file = None
 
+    rc = None
     print("Running: " + mcell_binary + " " + mdl_filepath)
     subprocess_cwd = os.path.dirname(mdl_filepath)
     print("  Should run from cwd = " +  subprocess_cwd)
@@ -51,34 +54,31 @@ def run_sim(arglist):
     if (log_file_option == 'file' and error_file_option == 'file'):
         with open(log_filepath, "w") as log_file:
             with open (error_filepath, "w") as error_file:
-                subprocess.call(
+                rc = subprocess.call(
                     [mcell_binary, '-seed', '%d' % seed, mdl_filepath],
                     cwd=subprocess_cwd, stdout=log_file, stderr=error_file)
     # Only output log file
     elif log_file_option == 'file':
         with open(log_filepath, "w") as log_file:
-            subprocess.call(
+            rc = subprocess.call(
                 [mcell_binary, '-seed', '%d' % seed, mdl_filepath],
                 cwd=subprocess_cwd, stdout=log_file, stderr=error_file)
     # Only error log file
     elif error_file_option == 'file':
         with open(error_filepath, "w") as error_file:
-            subprocess.call(
+            rc = subprocess.call(
                 [mcell_binary, '-seed', '%d' % seed, mdl_filepath],
                 cwd=subprocess_cwd, stdout=log_file, stderr=error_file)
     # Neither error nor output log
     else:
-        subprocess.call(
+        rc = subprocess.call(
             [mcell_binary, '-seed', '%d' % seed, mdl_filepath],
             cwd=subprocess_cwd, stdout=log_file, stderr=error_file)
+    return rc
 
 
-######################################################################################
-#### This function has been duplicated in cellblender/mdl/run_data_model_mcell.py ####
-####          Many attempts were made to import it, but they all failed.          ####
-######################################################################################
 def build_sweep_list ( par_dict ):
-    """ Count the number of runs that will be swept with this data model. """
+    """ Build a list of the swept parameters and their (lazily expanded) values. """
     sweep_list = []
     print ( "Building sweep list... " )
     if 'model_parameters' in par_dict:
@@ -92,53 +92,7 @@ def build_sweep_list ( par_dict ):
                     else:
                         sweep_item['par_name'] = "Unknown"
                     # Sweep expression example: "0, 2, 9, 10:20, 25:35:5, 50"
-                    num_runs_for_this_parameter = 0
-                    # Get the sweep expression sublists which are separated by commas
-                    sw_items = []
-                    if 'sweep_expression' in par:
-                        sw_items = [ p.strip() for p in par['sweep_expression'].split(',') ]
-                    #print ( "Sweep item list = " + str(sw_items) )
-                    # Count the number of runs represented by each sweep item (either:  #  or  #:#  or  #:#:#  )
-                    sweep_values = []
-                    for sw_item in sw_items:
-                        parts = [ p.strip() for p in sw_item.split(':') ]
-                        if len(parts) <= 0:
-                          # This would be two commas together?
-                          pass
-                        elif len(parts) == 1:
-                          # This is a scalar
-                          sweep_values.append ( float(parts[0]) )
-                          #print ( "Added " + parts[0] )
-                        elif len(parts) >= 2:
-                          # This is a range with a start and stop
-                          start = float(parts[0])
-                          stop = float(parts[1])
-                          step = 1
-                          if len(parts) > 2:
-                            step = float(parts[2])
-                          if start > stop:
-                            start = float(parts[1])
-                            stop = float(parts[0])
-                          if step < 0:
-                            step = -step
-                          if step == 0:
-                            # Do something to keep it from an infinite loop
-                            step = 1;
-                          # Start with a pessimistic guess
-                          num = int((stop-start) / step)
-                          # Increase until equal or over
-                          #print ( "Before increasing, num = " + str(num) )
-                          while (start+((num-1)*step)) < (stop+(step/1000)):
-                            num += 1
-                            #print ( "Increased to num = " + str(num) )
-                          # Reduce while actually over
-                          while start+((num-1)*step) > (stop+(step/1000)):
-                            num += -1
-                            #print ( "Decreased to num = " + str(num) )
-                          # Finally append the values
-                          for n in range(num):
-                            sweep_values.append ( start + (n*step) )
-                    sweep_item['values'] = sweep_values
+                    sweep_item['values'] = sweep_space.parse_sweep_expression ( par['sweep_expression'] )
                     sweep_list.append ( sweep_item )
     return sweep_list
 
@@ -230,6 +184,9 @@ if __name__ == "__main__":
     arg_parser.add_argument ( '-mm', '--min_memory',      type=int, default=0,         help='minimum memory in Gigabytes' )
     arg_parser.add_argument ( '-em', '--email_addr',      type=str, default='',        help='email address for notifications of job results' )
     arg_parser.add_argument ( '-gh', '--grid_host',       type=str, default='',        help='grid engine host name' )
+    arg_parser.add_argument ( '-nc', '--no_run_cache',    action='store_true',         help='run every sweep point even if it was already completed' )
+    arg_parser.add_argument ( '-bg', '--binary_geometry', action='store_true',         help='also save static meshes as binary geometry sidecars' )
+    arg_parser.add_argument ( '-pr', '--prune_run_cache', action='store_true',         help='remove the cached runs that are not part of this sweep' )
 
     parsed_args = arg_parser.parse_args() # Without any arguments this uses sys.argv automatically
 
@@ -269,13 +226,11 @@ if __name__ == "__main__":
     dm = data_model_to_mdl.read_data_model ( data_model_file_name )
     # data_model_to_mdl.dump_data_model ( dm )
 
-    # Build a sweep list and add a "current_index" of 0 to support the sweeping
+    # Build a sweep list and the space of runs it defines
     print ( "Building sweep list" )
     sweep_list = build_sweep_list( dm['mcell']['parameter_system'] )
     print ( "Sweep list = " + str(sweep_list) )
-    for sw_item in sweep_list:
-      sw_item['current_index'] = 0
-      print ( "  Sweep list item = " + str(sw_item) )
+    space = sweep_space.SweepSpace.from_sweep_list ( sweep_list, start_seed, end_seed )
 
 
     # Save the sweep list to a file for plotting, visualization, and other processing
@@ -296,10 +251,11 @@ if __name__ == "__main__":
     sweep_list_file.write ( " ]\n" )
     sweep_list_file.write ( "}\n" )
     sweep_list_file.close()
+    sweep_space.write_sweep_index ( space, project_dir )
 
 
-    # Count the number of sweep runs (could be done in build_sweep_list, but it's nice as a separate function) 
-    num_sweep_runs = count_sweep_runs ( sweep_list )
+    # Count the number of sweep runs
+    num_sweep_runs = len ( space )
     num_requested_runs = num_sweep_runs * (1 + parsed_args.last_seed - parsed_args.first_seed)
     print ( "Number of non-seed sweep runs = " + str(num_sweep_runs) )
     print ( "Total runs (sweep and seed) is " + str(num_requested_runs) )
@@ -315,21 +271,30 @@ if __name__ == "__main__":
         print ( 100*"%" )
         sys.exit(111)
 
+    # Runs are identified by their data model (with the sweep values substituted), seed and binary
+    use_run_cache = not parsed_args.no_run_cache
+    dm_hash = run_cache.model_hash ( dm['mcell'] )
+    engine = [ run_cache.engine_id(mcell_binary), False, False ]
+
     # Build a list of "run commands" (one for each run) to be run by the multiprocessing pool and "run_sim" (above)
     # Note that the format of these came from the original "run_simulations.py" program and may not be what we want in the long run
     run_cmd_list = []
-    # Build a sweep list with a "output_data" prefix directory
+    run_key_list = []
+    # Sections that are the same for every point of a sweep (or unchanged since the last export) are only written once
+    shared_path = os.path.join ( project_dir, "output_data", data_model_to_mdl.SHARED_MDL_DIR )
+
+    # Walk through the sweep points in run order (the last parameter varies fastest)
+    swept_pars = {}
+    for par in dm['mcell']['parameter_system']['model_parameters']:
+        if ('par_name' in par) and (par['par_name'] in space.names):
+            swept_pars[par['par_name']] = par
     for run in range (num_sweep_runs):
-        sweep_path = "output_data"
-        for sw_item in sweep_list:
-            sweep_path += "/" + sw_item['par_name'] + "_index_" + str(sw_item['current_index'])
+        sweep_path = space.run_dir ( run )
         print ( "Sweep path = " + sweep_path )
         # Set the data model parameters to the current parameter settings
-        for par in dm['mcell']['parameter_system']['model_parameters']:
-            if ('par_name' in par):
-                for sweep_item in sweep_list:
-                    if par['par_name'] == sweep_item['par_name']:
-                        par['par_expression'] = str(sweep_item['values'][sweep_item['current_index']])
+        for par_name, value in zip ( space.names, space.parameter_values(run) ):
+            if par_name in swept_pars:
+                swept_pars[par_name]['par_expression'] = str(value)
         # Sweep through the seeds for this set of parameters creating a run specification for each seed
         for seed in range(start_seed,end_seed+1):
             # Create the directories and write the MDL
@@ -337,17 +302,21 @@ if __name__ == "__main__":
             makedirs_exist_ok ( sweep_item_path, exist_ok=True )
             makedirs_exist_ok ( os.path.join(sweep_item_path,'react_data'), exist_ok=True )
             makedirs_exist_ok ( os.path.join(sweep_item_path,'viz_data'), exist_ok=True )
-            data_model_to_mdl.write_mdl ( dm, os.path.join(sweep_item_path, '%s.main.mdl' % (base_name) ) )
+            data_model_to_mdl.write_mdl ( dm, os.path.join(sweep_item_path, '%s.main.mdl' % (base_name) ), shared_path=shared_path, binary_geometry=parsed_args.binary_geometry )
             run_cmd_list.append ( [mcell_binary, sweep_item_path, base_name, error_file_option, log_file_option, seed] )
-        # Increment the current_index counters from rightmost side (deepest directory)
-        i = len(sweep_list) - 1
-        while i >= 0:
-            sweep_list[i]['current_index'] += 1
-            if sweep_list[i]['current_index'] >= len(sweep_list[i]['values']):
-              sweep_list[i]['current_index'] = 0
-            else:
-              break
-            i += -1
+            run_key_list.append ( run_cache.run_key ( dm_hash, dm['mcell']['parameter_system'], seed, engine ) )
+
+    output_dir = os.path.join(project_dir, "output_data")
+    # Remove the shared sections that none of the runs include any more
+    data_model_to_mdl.collect_shared_files ( output_dir )
+    if use_run_cache:
+        # Skip (or link) the runs that have already been completed
+        actions = run_cache.plan_runs ( output_dir, [ (run_cmd[1], run_cmd[5], key) for run_cmd, key in zip(run_cmd_list, run_key_list) ] )
+        if parsed_args.prune_run_cache:
+            run_cache.prune_runs ( output_dir, run_key_list )
+        print ( "Reusing results of " + str(len(actions) - actions.count('run')) + " completed runs" )
+        run_key_list = [ key for key, action in zip(run_key_list, actions) if action == 'run' ]
+        run_cmd_list = [ run_cmd for run_cmd, action in zip(run_cmd_list, actions) if action == 'run' ]
 
     # Print the run commands as a record of what's being done
     print ( "Run Cmds for submission via " + str(parsed_args.runner_type) + ":" )
@@ -358,7 +327,12 @@ if __name__ == "__main__":
 
         # Create a pool of mcell processes and run the command list on them
         pool = multiprocessing.Pool(processes=mcell_processors)
-        pool.map(run_sim, run_cmd_list)
+        return_codes = pool.map(run_sim, run_cmd_list)
+        if use_run_cache:
+            # Record the completed runs so they can be skipped the next time
+            for run_cmd, key, rc in zip ( run_cmd_list, run_key_list, return_codes ):
+                if rc == 0:
+                    run_cache.record_run ( output_dir, run_cmd[1], run_cmd[5], key )
 
     if str(parsed_args.runner_type) == "sge":
         # Find the best nodes to use for running
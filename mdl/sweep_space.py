@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+
+"""
+Parameter sweep spaces and the layout of their runs.
+
+A sweep is the Cartesian product of the values of each swept parameter. Sweep
+expressions (like "0, 2, 9, 10:20, 25:35:5, 50") are parsed into SweepValues which
+keep ranges as (start, step, count) rather than expanding them, and a SweepSpace
+maps between run indexes and parameter points with mixed radix arithmetic (the last
+parameter varies fastest, matching the output_data/par_index_#/... directories).
+Nothing is enumerated until it's asked for, so large sweeps can be counted, indexed
+and iterated without building lists of every run.
+
+The space is also saved next to data_layout.json (as sweep_index.json) so that
+tools reading the results can find run paths without expanding data_layout.json.
+
+This file is used both by CellBlender and by the stand-alone run_data_model_mcell.py
+so it only depends on the standard library.
+"""
+
+import os
+import json
+import math
+import bisect
+
+
+# Run path index (in the project directory, next to data_layout.json)
+SWEEP_INDEX_FILE = "sweep_index.json"
+SWEEP_INDEX_VERSION = 1
+
+# Names of the data_layout.json levels that aren't parameters (version 2 and earlier)
+LAYOUT_DIR = ( '/DIR', 'dir' )
+LAYOUT_FILE_TYPE = ( '/FILE_TYPE', 'file_type' )
+LAYOUT_SEED = ( '/SEED', 'SEED' )
+
+
+def range_count ( start, stop, step ):
+    """ Return the number of values in start:stop:step (stop is included within step/1000) """
+    limit = stop + (step/1000)
+    num = int ( math.floor ( (limit - start) / step ) ) + 1
+    # The division may round either way, so check the count against the values themselves
+    while (num > 0) and ((start + ((num-1)*step)) > limit):
+        num += -1
+    while (start + (num*step)) <= limit:
+        num += 1
+    return max ( num, 0 )
+
+
+class SweepValues:
+    """ The values of one swept parameter with ranges kept as (start, step, count) """
+
+    def __init__ ( self, items=() ):
+        # Each item is either a scalar or a (start, step, count) range
+        self.items = []
+        self.offsets = []
+        self.num_values = 0
+        for item in items:
+            self.append ( item )
+
+    def append ( self, item ):
+        if isinstance ( item, (tuple,list) ):
+            item = tuple ( item )
+            count = item[2]
+        else:
+            count = 1
+        if count > 0:
+            self.items.append ( item )
+            self.offsets.append ( self.num_values )
+            self.num_values += count
+
+    def __len__ ( self ):
+        return self.num_values
+
+    def __getitem__ ( self, index ):
+        if isinstance ( index, slice ):
+            return [ self[i] for i in range(*index.indices(self.num_values)) ]
+        if index < 0:
+            index += self.num_values
+        if (index < 0) or (index >= self.num_values):
+            raise IndexError ( "sweep value index out of range" )
+        n = bisect.bisect_right ( self.offsets, index ) - 1
+        item = self.items[n]
+        if isinstance ( item, tuple ):
+            return item[0] + ((index - self.offsets[n]) * item[1])
+        return item
+
+    def __iter__ ( self ):
+        for item in self.items:
+            if isinstance ( item, tuple ):
+                start, step, count = item
+                for n in range(count):
+                    yield start + (n*step)
+            else:
+                yield item
+
+    def __repr__ ( self ):
+        # Written into data_layout.json as a list
+        return repr ( list(self) )
+
+    def to_json ( self ):
+        return [ (list(item) if isinstance(item,tuple) else item) for item in self.items ]
+
+    @classmethod
+    def from_json ( cls, items ):
+        return cls ( items )
+
+
+def parse_sweep_expression ( sweep_expression ):
+    """ Parse a sweep expression like "0, 2, 9, 10:20, 25:35:5, 50" into SweepValues """
+    sweep_values = SweepValues()
+    for sw_item in [ p.strip() for p in sweep_expression.split(',') ]:
+        parts = [ p.strip() for p in sw_item.split(':') ]
+        if len(parts) == 1:
+            # This is a scalar
+            sweep_values.append ( float(parts[0]) )
+        elif len(parts) >= 2:
+            # This is a range with a start and stop (and an optional step)
+            start = float(parts[0])
+            stop = float(parts[1])
+            step = 1
+            if len(parts) > 2:
+                step = float(parts[2])
+            if start > stop:
+                start, stop = stop, start
+            if step < 0:
+                step = -step
+            if step == 0:
+                # Do something to keep it from an infinite loop
+                step = 1
+            sweep_values.append ( (start, step, range_count(start, stop, step)) )
+    return sweep_values
+
+
+class SweepSpace:
+    """ The runs of a sweep: an index <-> parameter point mapping with the last parameter varying fastest """
+
+    def __init__ ( self, parameters, root="output_data", file_types=("react_data","viz_data"), seeds=() ):
+        # parameters is a list of (name, values) where values is any sequence
+        self.names = [ p[0] for p in parameters ]
+        self.values = [ p[1] for p in parameters ]
+        self.sizes = [ len(v) for v in self.values ]
+        self.root = root
+        self.file_types = list ( file_types )
+        self.seeds = list ( seeds )
+        self.strides = [ 1 for n in self.sizes ]
+        for i in range(len(self.sizes)-2, -1, -1):
+            self.strides[i] = self.strides[i+1] * self.sizes[i+1]
+        self.num_points = 1
+        for n in self.sizes:
+            self.num_points *= n
+
+    def __len__ ( self ):
+        return self.num_points
+
+    def point ( self, index ):
+        """ Return the value index of each parameter for a run index """
+        if (index < 0) or (index >= self.num_points):
+            raise IndexError ( "sweep run index out of range" )
+        return tuple ( [ (index // stride) % size for stride, size in zip(self.strides, self.sizes) ] )
+
+    def index ( self, point ):
+        """ Return the run index of a point given as the value index of each parameter """
+        index = 0
+        for i, stride, size in zip ( point, self.strides, self.sizes ):
+            if (i < 0) or (i >= size):
+                raise IndexError ( "sweep value index out of range" )
+            index += i * stride
+        return index
+
+    def parameter_values ( self, index ):
+        return tuple ( [ v[i] for v, i in zip(self.values, self.point(index)) ] )
+
+    def run_dir ( self, index, file_type=None ):
+        """ Return the directory of a run (relative to the project directory) """
+        dirs = [ self.root ] + [ n + "_index_" + str(i) for n, i in zip(self.names, self.point(index)) ]
+        if file_type is not None:
+            dirs.append ( file_type )
+        return os.path.join ( *dirs )
+
+    def parameter_label ( self, index ):
+        """ Return a "name=value,name=value" label for a run """
+        return ",".join ( [ n + "=" + str(v) for n, v in zip(self.names, self.parameter_values(index)) ] )
+
+    def find_run ( self, run_dir ):
+        """ Return the run index of a run directory (None if it isn't in this space) """
+        parts = os.path.normpath(run_dir).split(os.sep)
+        try:
+            start = parts.index ( self.root ) + 1
+            point = []
+            for n, part in zip ( self.names, parts[start:start+len(self.names)] ):
+                if not part.startswith ( n + "_index_" ):
+                    return None
+                point.append ( int(part[len(n + "_index_"):]) )
+            if len(point) != len(self.names):
+                return None
+            return self.index ( point )
+        except (ValueError, IndexError):
+            return None
+
+    def __iter__ ( self ):
+        """ Lazily yield the value index of each parameter for every run in order """
+        num_pars = len(self.sizes)
+        point = [ 0 for n in self.sizes ]
+        for run in range(self.num_points):
+            yield tuple ( point )
+            # Increment the counters from rightmost side (deepest directory)
+            i = num_pars - 1
+            while i >= 0:
+                point[i] += 1
+                if point[i] < self.sizes[i]:
+                    break
+                point[i] = 0
+                i += -1
+
+    def to_json ( self ):
+        pars = []
+        for name, values in zip ( self.names, self.values ):
+            if not isinstance ( values, SweepValues ):
+                values = SweepValues ( values )
+            pars.append ( [ name, values.to_json() ] )
+        return { 'version': SWEEP_INDEX_VERSION, 'root': self.root, 'file_types': self.file_types,
+                 'seeds': self.seeds, 'num_runs': self.num_points, 'parameters': pars }
+
+    @classmethod
+    def from_json ( cls, spec ):
+        if spec.get('version') != SWEEP_INDEX_VERSION:
+            raise ValueError ( "Unsupported sweep index version: " + str(spec.get('version')) )
+        pars = [ (p[0], SweepValues.from_json(p[1])) for p in spec['parameters'] ]
+        return cls ( pars, spec['root'], spec['file_types'], spec['seeds'] )
+
+    @classmethod
+    def from_sweep_list ( cls, sweep_list, start_seed=1, end_seed=1 ):
+        """ Build a space from a list of {'par_name':..., 'values':...} (as built by build_sweep_list) """
+        return cls ( [ (sw_item['par_name'], sw_item['values']) for sw_item in sweep_list ],
+                     seeds=range(start_seed, end_seed+1) )
+
+    @classmethod
+    def from_data_layout ( cls, layout_spec ):
+        """ Build a space from the contents of a data_layout.json file (version 2 or earlier) """
+        root = "output_data"
+        file_types = []
+        seeds = []
+        pars = []
+        for level in layout_spec['data_layout']:
+            if level[0] in LAYOUT_DIR:
+                root = level[1][0]
+            elif level[0] in LAYOUT_FILE_TYPE:
+                file_types = level[1]
+            elif level[0] in LAYOUT_SEED:
+                seeds = level[1]
+            else:
+                pars.append ( (level[0], level[1]) )
+        return cls ( pars, root, file_types, seeds )
+
+
+def write_sweep_index ( space, project_dir ):
+    """ Save a sweep space next to data_layout.json """
+    index_path = os.path.join ( project_dir, SWEEP_INDEX_FILE )
+    with open ( index_path + ".tmp", "w" ) as f:
+        json.dump ( space.to_json(), f )
+    os.replace ( index_path + ".tmp", index_path )
+
+
+def read_sweep_space ( project_dir, layout_file="data_layout.json" ):
+    """ Return the sweep space of the runs in a project directory (None if there's no layout)
+
+    The sweep index is used when it's at least as new as the layout, otherwise the layout is read.
+    """
+    layout_path = os.path.join ( project_dir, layout_file )
+    index_path = os.path.join ( project_dir, SWEEP_INDEX_FILE )
+    try:
+        layout_time = os.stat(layout_path).st_mtime_ns
+    except OSError:
+        layout_time = None
+    try:
+        if (layout_time is None) or (os.stat(index_path).st_mtime_ns >= layout_time):
+            with open ( index_path ) as f:
+                return SweepSpace.from_json ( json.load(f) )
+    except (OSError, ValueError, KeyError):
+        pass
+    if layout_time is None:
+        return None
+    with open ( layout_path ) as f:
+        return SweepSpace.from_data_layout ( json.load(f) )
@@ -0,0 +1,234 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+"""
+This file contains the decoded frame cache used by CellBlender's Mol Viz.
+
+Frames (binary or ASCII) are decoded by mol_viz_io into lists of
+VizSpeciesBlocks and kept in a least recently used cache limited by the
+number of bytes held in the arrays.
+Frames near the current frame can be decoded ahead of time on a small pool of
+worker threads so that playback and scrubbing are served from memory.
+
+Frames are keyed by (file path, modification time, size) so that files that
+are rewritten by a new simulation run are never served stale. A frame can be
+read with only some of its species (for frames with an index or in a
+trajectory) and is then keyed by the species read as well. The other species
+are returned as empty blocks.
+"""
+
+import os
+import threading
+import collections
+import concurrent.futures
+
+import numpy
+
+from . import mol_viz_io
+from . import mol_viz_trajectory
+
+
+def frame_key ( filepath, names=None ):
+    """ Return the cache key for a frame file read with the species in names (None if the file doesn't exist) """
+    try:
+        st = os.stat ( filepath )
+    except OSError:
+        # Frames in trajectory files change when their trajectory changes
+        traj_frame = mol_viz_trajectory.find_trajectory_frame ( filepath )
+        if traj_frame is None:
+            return None
+        st = os.stat ( traj_frame[0].path )
+    return ( os.path.abspath(filepath), st.st_mtime_ns, st.st_size, None if names is None else frozenset(names) )
+
+
+def empty_block ( name, mol_type ):
+    return mol_viz_io.VizSpeciesBlock ( name, mol_type, numpy.zeros((0,3), dtype=numpy.float32) )
+
+
+def load_viz_frame ( filepath, names=None ):
+    """ Read a frame into blocks that own their arrays (no views into the file).
+
+    Owning the data means a cached frame doesn't keep its file mapped, which
+    would prevent a new run from replacing the file on some platforms.
+    If names is given, only those species are read from frames with an index
+    or in a trajectory (the others are empty blocks).
+    """
+    if not os.path.exists(filepath):
+        # Trajectory frames are always decompressed into new arrays
+        traj, frame = mol_viz_trajectory.find_trajectory_frame ( filepath )
+        if names is None:
+            return traj.read_frame ( frame )
+        blocks = traj.read_frame ( frame, names )
+        for row in traj.frame_rows ( frame ):
+            name = traj.species_names[row['species']]
+            if not (name in names):
+                blocks.append ( empty_block(name, int(row['mol_type'])) )
+        return blocks
+    if mol_viz_io.viz_file_version(filepath) == 0:
+        # ASCII frames are always parsed into new arrays
+        return mol_viz_io.read_ascii_viz_frame ( filepath )
+    index = None
+    if names is not None:
+        index = mol_viz_io.read_viz_index ( filepath )
+    if index is None:
+        blocks = mol_viz_io.read_binary_viz_frame ( filepath )
+    else:
+        blocks = mol_viz_io.read_indexed_viz_blocks ( filepath, index, names )
+    frame = []
+    for block in blocks:
+        frame.append ( mol_viz_io.VizSpeciesBlock (
+            block.name, block.mol_type,
+            numpy.array(block.positions),
+            None if block.orientations is None else numpy.array(block.orientations),
+            None if block.ids is None else numpy.array(block.ids),
+            block.offset ) )
+    if index is not None:
+        for entry in index['species']:
+            if not (entry['name'] in names):
+                frame.append ( empty_block(entry['name'], entry['mol_type']) )
+    return frame
+
+
+def frame_nbytes ( frame ):
+    nbytes = 0
+    for block in frame:
+        nbytes += block.positions.nbytes
+        if block.orientations is not None:
+            nbytes += block.orientations.nbytes
+        if block.ids is not None:
+            nbytes += block.ids.nbytes
+    return nbytes
+
+
+class VizFrameCache:
+    """ A byte limited LRU cache of decoded frames with background prefetching """
+
+    def __init__ ( self, max_bytes=512*1024*1024, num_workers=2 ):
+        self.max_bytes = max_bytes
+        self.num_workers = num_workers
+        self.frames = collections.OrderedDict()   # key -> (frame, nbytes)
+        self.total_bytes = 0
+        self.pending = {}                          # key -> Future
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def set_max_bytes ( self, max_bytes ):
+        with self.lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear ( self ):
+        with self.lock:
+            for future in self.pending.values():
+                future.cancel()
+            self.pending.clear()
+            self.frames.clear()
+            self.total_bytes = 0
+
+    def shutdown ( self ):
+        """ Clear the cache and stop the prefetch threads (they're started again by the next prefetch) """
+        self.clear()
+        with self.lock:
+            executor = self.executor
+            self.executor = None
+        if executor is not None:
+            executor.shutdown ( wait=False )
+
+    def get ( self, filepath, names=None ):
+        """ Return the decoded frame for filepath from the cache, a pending prefetch, or the file
+
+        If names is given, a frame may be returned with only those species
+        (a whole frame that is already cached is returned as is).
+        """
+        key = frame_key ( filepath, names )
+        if key is None:
+            return []
+        with self.lock:
+            for k in ( key, key[:-1] + (None,) ):
+                if k in self.frames:
+                    self.frames.move_to_end ( k )
+                    return self.frames[k][0]
+            future = self.pending.get ( key )
+        if (future is not None) and not future.cancelled():
+            try:
+                # Wait for the worker that's already decoding this frame
+                return future.result()
+            except Exception:
+                # Cancelled or failed in the background: read it here (raising any error to the caller)
+                pass
+        frame = load_viz_frame ( filepath, names )
+        self._store ( key, frame )
+        return frame
+
+    def prefetch ( self, filepaths, select=None ):
+        """ Decode frames in the background (in the order given) and cancel unstarted requests for others
+
+        select (if given) returns the names of the species to read from a frame
+        file (or None for all of them), matching the names later passed to get.
+        """
+        if self.max_bytes <= 0:
+            return
+        keys = []
+        for filepath in filepaths:
+            key = frame_key ( filepath, None if select is None else select(filepath) )
+            if key is not None:
+                keys.append ( (key, filepath) )
+        with self.lock:
+            wanted = set ( [ k for k, f in keys ] )
+            for key in list(self.pending.keys()):
+                if not (key in wanted):
+                    if self.pending[key].cancel():
+                        self.pending.pop ( key )
+            if self.executor is None:
+                self.executor = concurrent.futures.ThreadPoolExecutor ( max_workers=self.num_workers )
+            for key, filepath in keys:
+                if (key in self.frames) or (key[:-1] + (None,) in self.frames) or (key in self.pending):
+                    continue
+                self.pending[key] = self.executor.submit ( self._prefetch_frame, key, filepath )
+
+    def _prefetch_frame ( self, key, filepath ):
+        # Frames that can't be read aren't cached (get reads them again and reports the error)
+        try:
+            frame = load_viz_frame ( filepath, key[-1] )
+        except Exception:
+            with self.lock:
+                self.pending.pop ( key, None )
+            raise
+        self._store ( key, frame )
+        with self.lock:
+            self.pending.pop ( key, None )
+        return frame
+
+    def _store ( self, key, frame ):
+        nbytes = frame_nbytes ( frame )
+        with self.lock:
+            if nbytes > self.max_bytes:
+                # Too large to cache at all
+                return
+            if key in self.frames:
+                self.total_bytes -= self.frames.pop(key)[1]
+            self.frames[key] = ( frame, nbytes )
+            self.total_bytes += nbytes
+            self._evict()
+
+    def _evict ( self ):
+        # The lock must be held by the caller
+        while (self.total_bytes > self.max_bytes) and (len(self.frames) > 0):
+            key, (frame, nbytes) = self.frames.popitem ( last=False )
+            self.total_bytes -= nbytes
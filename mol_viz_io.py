@@ -0,0 +1,431 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+"""
+This file contains the readers for MCell's molecule visualization files.
+
+It does not depend on Blender so it can be used from CellBlender's Mol Viz
+code as well as from command line tools and simulation engines.
+
+Binary frames are memory mapped and each species block is returned as NumPy
+views into the mapped file, so the molecule data is never copied while the
+frame is parsed. All values are in the native byte order of the writer.
+
+  Binary Version 1 species block:
+    uint8    length of the species name
+    char     species name
+    uint8    molecule type (1=surface, 0=volume)
+    uint32   number of floats (3 times the number of molecules)
+    float32  positions (x,y,z for each molecule)
+    float32  orientations (surface molecules only)
+
+  Binary Version 2 species block:
+    uint32   length of the species name
+    char     species name
+    uint8    molecule type (1=surface, 0=volume)
+    uint32   number of molecules
+    uint32   molecule ids
+    float32  positions (x,y,z for each molecule)
+    float32  orientations (surface molecules only)
+
+Both versions start with a single uint32 containing the version number.
+
+ASCII frames have one line per molecule:
+
+    species_name id x y z nx ny nz
+
+They are parsed in chunks of lines with bulk NumPy conversions and grouped
+by species name, so memory use is bounded by the chunk size and the arrays.
+"""
+
+import os
+import mmap
+import json
+import threading
+import collections
+
+import numpy
+
+
+UINT8 = numpy.dtype(numpy.uint8)
+UINT32 = numpy.dtype(numpy.uint32)
+FLOAT32 = numpy.dtype(numpy.float32)
+
+
+class VizSpeciesBlock:
+    """ The molecules of one species in one viz frame.
+
+    positions and orientations are (N,3) float32 arrays. The orientations
+    are None for volume molecules and ids is None for files without ids.
+    offset is the byte offset of the block in its file (or -1 if unknown).
+    """
+
+    __slots__ = ( 'name', 'mol_type', 'positions', 'orientations', 'ids', 'offset' )
+
+    def __init__ ( self, name, mol_type, positions, orientations=None, ids=None, offset=-1 ):
+        self.name = name
+        self.mol_type = mol_type
+        self.positions = positions
+        self.orientations = orientations
+        self.ids = ids
+        self.offset = offset
+
+    @property
+    def count ( self ):
+        return self.positions.shape[0]
+
+    def __repr__ ( self ):
+        return "VizSpeciesBlock(%r, type=%d, count=%d)" % ( self.name, self.mol_type, self.count )
+
+
+def viz_file_version ( filepath ):
+    """ Return 1 or 2 for binary viz files and 0 for ASCII (or empty) files """
+    with open ( filepath, 'rb' ) as f:
+        head = f.read(4)
+    if len(head) < 4:
+        return 0
+    version = int(numpy.frombuffer(head, dtype=UINT32)[0])
+    if version in (1, 2):
+        return version
+    return 0
+
+
+def map_viz_file ( filepath ):
+    """ Return a read-only memory map of the whole file (None for empty files) """
+    with open ( filepath, 'rb' ) as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        # The map keeps its own handle so the file can be closed right away
+        return mmap.mmap ( f.fileno(), 0, access=mmap.ACCESS_READ )
+
+
+def parse_binary_viz_block ( buf, pos, version ):
+    """ Parse the species block starting at byte pos of buf and return (block, next_pos).
+
+    Raises ValueError if the block runs past the end of the buffer.
+    """
+    block_start = pos
+    if version == 1:
+        name_len = int(numpy.frombuffer(buf, dtype=UINT8, count=1, offset=pos)[0])
+        pos += 1
+    else:
+        name_len = int(numpy.frombuffer(buf, dtype=UINT32, count=1, offset=pos)[0])
+        pos += 4
+    name_bytes = bytes(buf[pos:pos+name_len])
+    if len(name_bytes) != name_len:
+        raise ValueError ( "Species name runs past the end of the buffer" )
+    name = name_bytes.decode()
+    pos += name_len
+    mol_type = int(numpy.frombuffer(buf, dtype=UINT8, count=1, offset=pos)[0])
+    pos += 1
+    num = int(numpy.frombuffer(buf, dtype=UINT32, count=1, offset=pos)[0])
+    pos += 4
+    ids = None
+    if version == 1:
+        num_mols = num // 3
+    else:
+        num_mols = num
+        ids = numpy.frombuffer(buf, dtype=UINT32, count=num_mols, offset=pos)
+        pos += 4 * num_mols
+    positions = numpy.frombuffer(buf, dtype=FLOAT32, count=3*num_mols, offset=pos).reshape((num_mols, 3))
+    pos += 12 * num_mols
+    orientations = None
+    if mol_type == 1:
+        orientations = numpy.frombuffer(buf, dtype=FLOAT32, count=3*num_mols, offset=pos).reshape((num_mols, 3))
+        pos += 12 * num_mols
+    return ( VizSpeciesBlock ( name, mol_type, positions, orientations, ids, block_start ), pos )
+
+
+def parse_binary_viz_buffer ( buf ):
+    """ Parse a binary viz frame held in buf (bytes, mmap, ...) into a list of VizSpeciesBlocks.
+
+    The arrays in the returned blocks are views into buf. A truncated block
+    ends the parse and the complete blocks read before it are returned.
+    """
+    size = len(buf)
+    blocks = []
+    if size < 4:
+        return blocks
+    version = int(numpy.frombuffer(buf, dtype=UINT32, count=1, offset=0)[0])
+    if not (version in (1, 2)):
+        raise ValueError ( "Not a binary viz file (version word = %d)" % version )
+
+    pos = 4
+    while pos < size:
+        try:
+            block, pos = parse_binary_viz_block ( buf, pos, version )
+        except (ValueError, UnicodeDecodeError):
+            # numpy raises ValueError when a count runs past the end of the buffer
+            print ( "Truncated viz data block at byte %d" % pos )
+            break
+        blocks.append ( block )
+    return blocks
+
+
+def read_binary_viz_frame ( filepath ):
+    """ Memory map a binary viz file and return its list of VizSpeciesBlocks """
+    mm = map_viz_file ( filepath )
+    if mm is None:
+        return []
+    # The views returned in the blocks keep the map alive until they are released
+    return parse_binary_viz_buffer ( mm )
+
+
+# Number of bytes of an ASCII frame parsed at a time
+ASCII_CHUNK_BYTES = 8*1024*1024
+
+
+def parse_ascii_viz_lines ( chunk, species ):
+    """ Parse a chunk of complete lines one line at a time (for chunks with ragged lines) """
+    for line in chunk.split(b'\n'):
+        fields = line.split()
+        if len(fields) < 7:
+            continue
+        name = fields[0].decode()
+        if len(fields) > 7:
+            values = numpy.array ( fields[2:8], dtype=numpy.float64 ).reshape((1,6))
+            ids = numpy.array ( fields[1:2], dtype=numpy.float64 )
+        else:
+            values = numpy.array ( fields[1:7], dtype=numpy.float64 ).reshape((1,6))
+            ids = None
+        if not (name in species):
+            species[name] = []
+        species[name].append ( (values, ids) )
+
+
+def parse_ascii_viz_chunk ( chunk, species ):
+    """ Parse a chunk of complete ASCII lines into species (a dict of name -> list of (values, ids)).
+
+    The values are (N,6) arrays of positions and orientations. The ids are
+    None for files without an id column.
+    """
+    tokens = chunk.split()
+    if len(tokens) == 0:
+        return
+    ncols = len(chunk.lstrip().split(b'\n', 1)[0].split())
+    # Every line must have the columns of the first line (lines with only spaces take the slow path too)
+    lines = chunk.split(b'\n')
+    num_lines = len(lines) - lines.count(b'')
+    if (ncols < 7) or (num_lines * ncols != len(tokens)):
+        parse_ascii_viz_lines ( chunk, species )
+        return
+
+    # Separate the names and convert all of the numbers at once
+    names = tokens[0::ncols]
+    del tokens[0::ncols]
+    try:
+        values = numpy.array ( tokens, dtype=numpy.float64 ).reshape((-1, ncols-1))
+    except ValueError:
+        # Lines with different numbers of columns that happen to add up
+        parse_ascii_viz_lines ( chunk, species )
+        return
+
+    # Group the lines by species name (in order of first appearance)
+    codes = {}
+    inverse = numpy.fromiter ( (codes.setdefault(n, len(codes)) for n in names), dtype=numpy.intp, count=len(names) )
+    counts = numpy.bincount ( inverse, minlength=len(codes) )
+    values = values[numpy.argsort(inverse, kind='stable')]
+    start = 0
+    for name, code in codes.items():
+        group = values[start:start+counts[code]]
+        start += counts[code]
+        name = name.decode()
+        if not (name in species):
+            species[name] = []
+        if ncols > 7:
+            species[name].append ( (group[:,1:7], group[:,0]) )
+        else:
+            species[name].append ( (group[:,0:6], None) )
+
+
+def read_ascii_viz_frame ( filepath, chunk_bytes=ASCII_CHUNK_BYTES ):
+    """ Read an ASCII viz file in chunks and return a list of VizSpeciesBlocks (one per species name).
+
+    A species is a surface species when its first molecule has a non-zero orientation.
+    """
+    species = {}
+    with open ( filepath, 'rb' ) as f:
+        while True:
+            chunk = f.read ( chunk_bytes )
+            if len(chunk) == 0:
+                break
+            if not chunk.endswith(b'\n'):
+                # Complete the last line of this chunk
+                chunk += f.readline()
+            parse_ascii_viz_chunk ( chunk, species )
+
+    blocks = []
+    for name, parts in species.items():
+        values = numpy.concatenate ( [ v for v, i in parts ] )
+        ids = None
+        if not ([ i for v, i in parts if i is None ]):
+            ids = numpy.concatenate ( [ i for v, i in parts ] ).astype(UINT32)
+        positions = values[:,0:3].astype(FLOAT32)
+        orientations = None
+        mol_type = 0
+        if (len(values) > 0) and values[0,3:6].any():
+            mol_type = 1
+            orientations = values[:,3:6].astype(FLOAT32)
+        blocks.append ( VizSpeciesBlock ( name, mol_type, positions, orientations, ids ) )
+    return blocks
+
+
+def read_viz_frame ( filepath ):
+    """ Return the list of VizSpeciesBlocks for a binary or ASCII viz file """
+    if viz_file_version(filepath) > 0:
+        return read_binary_viz_frame ( filepath )
+    return read_ascii_viz_frame ( filepath )
+
+
+##### Viz Index Sidecar Files
+
+# A viz index is a small JSON file written beside a binary frame file (with
+# ".cbidx" appended to the frame file name). It lists every species block of
+# the frame so that readers can learn which species are present, and jump
+# directly to the ones they need, without parsing the frame itself:
+#
+#  {
+#   "cbidx_version": 1,
+#   "viz_version": 2,
+#   "file_size": 1234,
+#   "species": [
+#     { "name": "a", "offset": 4, "mol_type": 0, "count": 100,
+#       "bbox": [[xmin,ymin,zmin],[xmax,ymax,zmax]] },
+#     ...
+#   ]
+#  }
+#
+# The bbox is null for species without molecules. An index is only used when
+# file_size matches the frame file and the index is not older than the frame.
+
+VIZ_INDEX_SUFFIX = ".cbidx"
+VIZ_INDEX_VERSION = 1
+
+
+# Parsed indexes keyed by index file: (stamp, index or None), least recently used first
+VIZ_INDEX_CACHE_SIZE = 4096
+viz_index_cache = collections.OrderedDict()
+viz_index_lock = threading.Lock()
+
+
+def viz_index_path ( filepath ):
+    return filepath + VIZ_INDEX_SUFFIX
+
+
+def make_viz_index ( blocks, viz_version, file_size ):
+    """ Build the index dictionary for a frame from its parsed blocks """
+    species = []
+    for block in blocks:
+        bbox = None
+        if block.count > 0:
+            bbox = [ [ float(v) for v in block.positions.min(axis=0) ],
+                     [ float(v) for v in block.positions.max(axis=0) ] ]
+        species.append ( { 'name': block.name,
+                           'offset': int(block.offset),
+                           'mol_type': int(block.mol_type),
+                           'count': int(block.count),
+                           'bbox': bbox } )
+    return { 'cbidx_version': VIZ_INDEX_VERSION,
+             'viz_version': viz_version,
+             'file_size': file_size,
+             'species': species }
+
+
+def write_viz_index ( filepath ):
+    """ Write the index sidecar for a binary frame file and return the index (None for ASCII files) """
+    viz_version = viz_file_version ( filepath )
+    if viz_version == 0:
+        return None
+    blocks = read_binary_viz_frame ( filepath )
+    index = make_viz_index ( blocks, viz_version, os.path.getsize(filepath) )
+    with open ( viz_index_path(filepath), 'w' ) as f:
+        json.dump ( index, f, separators=(',', ':') )
+    return index
+
+
+def read_viz_index ( filepath ):
+    """ Return the index for a frame file or None if there is no valid (current) index
+
+    Indexes are kept (by the modification times and sizes of the frame and
+    index files) so they're only parsed again when either file changes. The
+    returned index is shared and must not be modified.
+    """
+    index_path = viz_index_path ( filepath )
+    try:
+        index_st = os.stat ( index_path )
+        frame_st = os.stat ( filepath )
+    except OSError:
+        return None
+    if index_st.st_mtime < frame_st.st_mtime:
+        return None
+    stamp = ( index_st.st_mtime_ns, index_st.st_size, frame_st.st_mtime_ns, frame_st.st_size )
+    with viz_index_lock:
+        cached = viz_index_cache.get ( index_path )
+        if (cached is not None) and (cached[0] == stamp):
+            viz_index_cache.move_to_end ( index_path )
+            return cached[1]
+    try:
+        with open ( index_path, 'r' ) as f:
+            index = json.load ( f )
+    except (OSError, ValueError):
+        return None
+    if (index.get('cbidx_version') != VIZ_INDEX_VERSION) or (index.get('file_size') != frame_st.st_size):
+        index = None
+    with viz_index_lock:
+        viz_index_cache[index_path] = ( stamp, index )
+        while len(viz_index_cache) > VIZ_INDEX_CACHE_SIZE:
+            viz_index_cache.popitem ( last=False )
+    return index
+
+
+def read_indexed_viz_blocks ( filepath, index, names=None ):
+    """ Read only the species blocks in names (all if None) using a frame's index """
+    mm = map_viz_file ( filepath )
+    if mm is None:
+        return []
+    blocks = []
+    for entry in index['species']:
+        if (names is None) or (entry['name'] in names):
+            block, pos = parse_binary_viz_block ( mm, entry['offset'], index['viz_version'] )
+            blocks.append ( block )
+    return blocks
+
+
+def index_viz_files ( paths ):
+    """ Write index sidecars for viz files and for all ".dat" files in directories """
+    num_indexed = 0
+    for path in paths:
+        if os.path.isdir(path):
+            file_names = sorted ( [ os.path.join(path, f) for f in os.listdir(path) if f.endswith(".dat") ] )
+        else:
+            file_names = [ path ]
+        for file_name in file_names:
+            if write_viz_index(file_name) is not None:
+                num_indexed += 1
+    return num_indexed
+
+
+if __name__ == "__main__":
+
+    """Run this file from the command line to index viz data:  python mol_viz_io.py index viz_data/seed_00001"""
+    import sys
+    if (len(sys.argv) > 2) and (sys.argv[1] == "index"):
+        print ( "Indexed %d viz files" % index_viz_files(sys.argv[2:]) )
+    else:
+        print ( "Usage: python mol_viz_io.py index dir_or_file [dir_or_file ...]" )
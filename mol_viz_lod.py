@@ -0,0 +1,91 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+"""
+This file contains the level of detail reduction used by CellBlender's Mol Viz.
+
+Species with more molecules than a display budget are reduced to a
+deterministic subset of their molecules before their glyphs are instanced.
+When the file has molecule ids, a molecule is kept when a hash of its id falls
+below the kept fraction, so the same molecules are shown from frame to frame.
+Otherwise the kept molecules are evenly spaced through the block.
+
+Molecules inside a region of interest box are always kept (the budget applies
+to the molecules outside the box).
+
+It doesn't depend on bpy and works on (N,3) float32 arrays.
+"""
+
+import numpy
+
+
+def id_hash ( ids ):
+    """ Return a uint32 multiplicative hash of molecule ids """
+    return ids.astype(numpy.uint32) * numpy.uint32(2246822519)
+
+
+def select_stratified ( count, budget, ids=None ):
+    """ Return the indexes of about budget of count molecules (exactly budget without ids) """
+    if budget >= count:
+        return numpy.arange(count)
+    if (ids is not None) and (len(ids) == count):
+        limit = numpy.uint32(min(int((float(budget) / count) * 4294967296.0), 4294967295))
+        return numpy.flatnonzero(id_hash(ids) < limit)
+    return (numpy.arange(budget, dtype=numpy.int64) * count) // budget
+
+
+def in_box ( positions, box_min, box_max ):
+    """ Return a mask of the positions inside a box """
+    lo = numpy.array(box_min, dtype=numpy.float32)
+    hi = numpy.array(box_max, dtype=numpy.float32)
+    return numpy.all((positions >= numpy.minimum(lo, hi)) & (positions <= numpy.maximum(lo, hi)), axis=1)
+
+
+def reduce_molecules ( positions, orientations, budget, ids=None, roi=None ):
+    """ Reduce the molecules of a species to a display budget
+
+    roi is None or a (box_min, box_max) pair. Returns (positions, orientations).
+    """
+    if (ids is not None) and (len(ids) != len(positions)):
+        ids = None
+    keep = None
+    if roi is not None:
+        inside = in_box(positions, roi[0], roi[1])
+        if numpy.any(inside):
+            keep = numpy.flatnonzero(inside)
+            outside = numpy.flatnonzero(~inside)
+            positions_out = positions[outside]
+            orientations_out = orientations[outside]
+            ids_out = None if ids is None else ids[outside]
+        else:
+            positions_out, orientations_out, ids_out = positions, orientations, ids
+    else:
+        positions_out, orientations_out, ids_out = positions, orientations, ids
+    if len(positions_out) <= budget:
+        return positions, orientations
+
+    index = select_stratified(len(positions_out), budget, ids_out)
+    positions_out = positions_out[index]
+    orientations_out = orientations_out[index]
+
+    if keep is None:
+        return positions_out, orientations_out
+    return (numpy.concatenate((positions[keep], positions_out)),
+            numpy.concatenate((orientations[keep], orientations_out)))
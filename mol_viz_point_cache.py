@@ -0,0 +1,347 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+"""
+This file contains the point cache export for molecule viz data.
+
+A point cache holds one file per frame, converted ahead of time from the viz
+files of a seed (in parallel worker processes) so that rendering doesn't parse
+the viz files frame by frame. The cache files are written to a "point_cache"
+directory in the seed directory and are named after the frame they came from
+(Scene.cellbin.0001.dat -> point_cache/Scene.cellbin.0001.dat.cbpc).
+
+Each cache file is laid out to be memory mapped and handed to Blender's
+foreach_set without conversion:
+
+    8 bytes   magic (CBPCACH1)
+    4 bytes   JSON header length (uint32)
+    ...       JSON header (version, source viz_version and one entry per
+              species with its name, mol_type, count, bbox and array offsets)
+    ...       padding to a multiple of 16 bytes
+    ...       arrays, each starting on a multiple of 16 bytes:
+                float32 positions (x,y,z for each molecule)
+                float32 orientations (surface molecules only)
+                uint32  molecule ids (files with ids only)
+
+All values are little endian and array offsets are from the start of the
+arrays. Frames stored in trajectory files can be exported as well.
+
+Run this file from the command line to export a seed (frames start to stop
+inclusive, every step frames):
+
+    python mol_viz_point_cache.py export viz_data/seed_00001 [-o cache_dir] [-j workers] [--start N] [--stop N] [--step N] [--force]
+"""
+
+import os
+import sys
+import site
+import json
+import struct
+import importlib.util
+import multiprocessing
+import concurrent.futures
+
+import numpy
+
+if __package__:
+    from . import mol_viz_io
+    from . import mol_viz_trajectory
+else:
+    import mol_viz_io
+    import mol_viz_trajectory
+
+
+POINT_CACHE_DIR = "point_cache"
+POINT_CACHE_SUFFIX = ".cbpc"
+POINT_CACHE_VERSION = 1
+MAGIC = b"CBPCACH1"
+
+ALIGNMENT = 16
+
+# Name used to import this file in worker processes (the cellblender package can't be imported without bpy)
+WORKER_MODULE = "mol_viz_point_cache"
+
+# Exports of fewer frames than this are written in this process (starting workers costs more)
+PARALLEL_MIN_FRAMES = 8
+
+
+def aligned ( n ):
+    return (n + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def point_cache_path ( filepath, cache_dir=None ):
+    """ Return the point cache file for a frame file """
+    dir_name, frame_name = os.path.split ( filepath )
+    if cache_dir is None:
+        cache_dir = os.path.join ( dir_name, POINT_CACHE_DIR )
+    return os.path.join ( cache_dir, frame_name + POINT_CACHE_SUFFIX )
+
+
+def is_current ( cache_path, filepath ):
+    """ Return True if the cache file exists and isn't older than its frame file (if that is still there) """
+    try:
+        cache_mtime = os.path.getmtime ( cache_path )
+    except OSError:
+        return False
+    try:
+        return cache_mtime >= os.path.getmtime ( filepath )
+    except OSError:
+        return True
+
+
+def find_point_cache_frame ( filepath ):
+    """ Return the current point cache file for a frame file or None """
+    cache_path = point_cache_path ( filepath )
+    if is_current ( cache_path, filepath ):
+        return cache_path
+    return None
+
+
+def point_cache_frame_names ( dir_name ):
+    """ Return the names of the frames with point cache files in a seed directory """
+    cache_dir = os.path.join ( dir_name, POINT_CACHE_DIR )
+    if not os.path.isdir(cache_dir):
+        return []
+    return sorted ( [ f[:-len(POINT_CACHE_SUFFIX)] for f in os.listdir(cache_dir) if f.endswith(POINT_CACHE_SUFFIX) ] )
+
+
+def encode_point_cache ( blocks, viz_version ):
+    """ Return the bytes of a point cache file for a frame's VizSpeciesBlocks """
+    species = []
+    arrays = []
+    pos = 0
+    for block in blocks:
+        entry = { 'name': block.name, 'mol_type': int(block.mol_type), 'count': int(block.count),
+                  'bbox': None, 'positions': None, 'orientations': None, 'ids': None }
+        if block.count > 0:
+            entry['bbox'] = [ [ float(v) for v in block.positions.min(axis=0) ],
+                              [ float(v) for v in block.positions.max(axis=0) ] ]
+        for key, a, dtype in ( ( 'positions', block.positions, '<f4' ),
+                               ( 'orientations', block.orientations, '<f4' ),
+                               ( 'ids', block.ids, '<u4' ) ):
+            if a is None:
+                continue
+            data = numpy.ascontiguousarray ( a, dtype=dtype ).tobytes()
+            entry[key] = pos
+            arrays.append ( data + bytes(aligned(len(data)) - len(data)) )
+            pos += aligned ( len(data) )
+        species.append ( entry )
+    header = { 'cbpc_version': POINT_CACHE_VERSION, 'viz_version': viz_version, 'species': species }
+    header_bytes = json.dumps ( header, separators=(',', ':') ).encode()
+    head = MAGIC + struct.pack ( '<I', len(header_bytes) ) + header_bytes
+    return b"".join ( [ head, bytes(aligned(len(head)) - len(head)) ] + arrays )
+
+
+def map_point_cache ( cache_path ):
+    """ Return (memory map, header, start of the arrays) for a point cache file
+
+    Raises ValueError if the file isn't a valid point cache.
+    """
+    mm = mol_viz_io.map_viz_file ( cache_path )
+    if (mm is None) or (mm[0:len(MAGIC)] != MAGIC):
+        raise ValueError ( "Not a point cache file: " + cache_path )
+    header_len = struct.unpack_from ( '<I', mm, len(MAGIC) )[0]
+    header = json.loads ( mm[len(MAGIC)+4:len(MAGIC)+4+header_len].decode() )
+    if header.get('cbpc_version') != POINT_CACHE_VERSION:
+        raise ValueError ( "Unsupported point cache version in " + cache_path )
+    return ( mm, header, aligned(len(MAGIC) + 4 + header_len) )
+
+
+def read_point_cache_header ( cache_path ):
+    """ Return the header of a point cache file (viz_version and the species entries) without its arrays """
+    return map_point_cache ( cache_path )[1]
+
+
+def read_point_cache ( cache_path, names=None ):
+    """ Return (blocks, viz_version) for a point cache file
+
+    The block arrays are views into the memory mapped file. viz_version is that
+    of the frame the cache was written from (0 for ASCII frames). If names is
+    given, the species not in names are returned without molecules (their
+    arrays aren't mapped). Raises ValueError if the file isn't a valid point
+    cache.
+    """
+    mm, header, start = map_point_cache ( cache_path )
+    blocks = []
+    for entry in header['species']:
+        if (names is not None) and not (entry['name'] in names):
+            blocks.append ( mol_viz_io.VizSpeciesBlock ( entry['name'], entry['mol_type'], numpy.zeros((0,3), dtype=numpy.float32) ) )
+            continue
+        count = entry['count']
+        positions = numpy.frombuffer ( mm, dtype='<f4', count=3*count, offset=start+entry['positions'] ).reshape((count,3))
+        orientations = None
+        if entry['orientations'] is not None:
+            orientations = numpy.frombuffer ( mm, dtype='<f4', count=3*count, offset=start+entry['orientations'] ).reshape((count,3))
+        ids = None
+        if entry['ids'] is not None:
+            ids = numpy.frombuffer ( mm, dtype='<u4', count=count, offset=start+entry['ids'] )
+        blocks.append ( mol_viz_io.VizSpeciesBlock ( entry['name'], entry['mol_type'], positions, orientations, ids ) )
+    return ( blocks, header['viz_version'] )
+
+
+def read_source_frame ( filepath ):
+    """ Return (blocks, viz_version) for a frame file or a frame stored in a trajectory """
+    if os.path.exists ( filepath ):
+        viz_version = mol_viz_io.viz_file_version ( filepath )
+        return ( mol_viz_io.read_viz_frame(filepath), viz_version )
+    traj_frame = mol_viz_trajectory.find_trajectory_frame ( filepath )
+    if traj_frame is None:
+        raise OSError ( "Viz file not found: " + filepath )
+    traj, frame = traj_frame
+    # Trajectories are read like binary frames
+    return ( traj.read_frame(frame), 1 )
+
+
+def export_frame_job ( job ):
+    """ Write the point cache file of one (filepath, cache_path) job and return (filepath, molecules, error) """
+    filepath, cache_path = job
+    try:
+        blocks, viz_version = read_source_frame ( filepath )
+        data = encode_point_cache ( blocks, viz_version )
+        tmp_path = cache_path + ".%d.tmp" % os.getpid()
+        with open ( tmp_path, 'wb' ) as f:
+            f.write ( data )
+        os.replace ( tmp_path, cache_path )
+        return ( filepath, sum([block.count for block in blocks]), None )
+    except (OSError, ValueError) as e:
+        return ( filepath, 0, str(e) )
+
+
+def worker_module():
+    """ Return this file imported under its top level name (which worker processes can import) """
+    if __name__ == WORKER_MODULE:
+        return sys.modules[__name__]
+    if not (WORKER_MODULE in sys.modules):
+        # The top level copy imports the viz readers by their top level names as well
+        here = os.path.dirname ( os.path.abspath(__file__) )
+        sys.path.insert ( 0, here )
+        try:
+            spec = importlib.util.spec_from_file_location ( WORKER_MODULE, os.path.abspath(__file__) )
+            module = importlib.util.module_from_spec ( spec )
+            sys.modules[WORKER_MODULE] = module
+            spec.loader.exec_module ( module )
+        finally:
+            sys.path.remove ( here )
+    return sys.modules[WORKER_MODULE]
+
+
+def stored_frame_names ( viz_dir ):
+    """ Return the names of the frames of a seed stored in trajectory files or the point cache """
+    names = set ( mol_viz_trajectory.trajectory_frame_names(viz_dir) )
+    names.update ( point_cache_frame_names(viz_dir) )
+    return sorted ( names )
+
+
+def seed_frame_names ( viz_dir ):
+    """ Return the sorted names of the frames of a seed (files, trajectory frames and point cache frames) """
+    names = set ( [ f for f in os.listdir(viz_dir) if f.endswith(".dat") ] )
+    names.update ( stored_frame_names(viz_dir) )
+    return sorted ( names )
+
+
+def has_source_frame ( filepath ):
+    """ Return True if a frame can be read from its file or a trajectory """
+    return os.path.exists ( filepath ) or (mol_viz_trajectory.find_trajectory_frame(filepath) is not None)
+
+
+def export_point_cache ( viz_dir, cache_dir=None, start=0, stop=None, step=1, max_workers=None, python_path=None, force=False, frame_names=None ):
+    """ Write the point cache files of frames start to stop (inclusive) of a seed
+
+    Frames are indexed in frame_names (seed_frame_names by default). Frames
+    with a current cache file are skipped unless force is True (frames only
+    left in the cache are always skipped). Large exports are written by a pool
+    of processes running python_path (the current interpreter by default).
+    Returns (frames written, frames already current, list of (frame file,
+    error) for frames that couldn't be exported).
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if frame_names is None:
+        frame_names = seed_frame_names ( viz_dir )
+    if stop is None:
+        stop = len(frame_names) - 1
+    frame_names = frame_names[max(start, 0):stop+1:max(step, 1)]
+    if cache_dir is None:
+        cache_dir = os.path.join ( viz_dir, POINT_CACHE_DIR )
+    os.makedirs ( cache_dir, exist_ok=True )
+    jobs = []
+    for frame_name in frame_names:
+        filepath = os.path.join ( viz_dir, frame_name )
+        cache_path = point_cache_path ( filepath, cache_dir )
+        if not is_current(cache_path, filepath) or (force and has_source_frame(filepath)):
+            jobs.append ( ( filepath, cache_path ) )
+    num_current = len(frame_names) - len(jobs)
+
+    results = None
+    if (len(jobs) >= PARALLEL_MIN_FRAMES) and (max_workers > 1):
+        try:
+            ctx = multiprocessing.get_context('spawn')
+            if python_path is not None:
+                ctx.set_executable(python_path)
+            module = worker_module()
+            num_workers = min(max_workers, len(jobs))
+            with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers, mp_context=ctx,
+                    initializer=site.addsitedir, initargs=(os.path.dirname(os.path.abspath(__file__)),)) as pool:
+                # Frames are sent in chunks since a single frame is often quick to convert
+                results = list ( pool.map(module.export_frame_job, jobs, chunksize=max(1, len(jobs) // (4*num_workers))) )
+        except (OSError, ImportError, concurrent.futures.process.BrokenProcessPool) as e:
+            print ( "Unable to export the point cache in parallel (%s), exporting one frame at a time" % (str(e)) )
+            results = None
+    if results is None:
+        results = [ export_frame_job(job) for job in jobs ]
+
+    errors = [ (filepath, error) for filepath, count, error in results if error is not None ]
+    return ( len(results) - len(errors), num_current, errors )
+
+
+if __name__ == "__main__":
+
+    args = sys.argv[1:]
+    if (len(args) < 2) or (args[0] != "export"):
+        print ( "Usage: python mol_viz_point_cache.py export viz_dir [-o cache_dir] [-j workers] [--start N] [--stop N] [--step N] [--force]" )
+        sys.exit ( 1 )
+    viz_dir = args[1]
+    args = args[2:]
+    cache_dir = None
+    max_workers = None
+    start = 0
+    stop = None
+    step = 1
+    force = False
+    while len(args) > 0:
+        arg = args.pop(0)
+        if arg == "-o":
+            cache_dir = args.pop(0)
+        elif arg == "-j":
+            max_workers = int(args.pop(0))
+        elif arg == "--start":
+            start = int(args.pop(0))
+        elif arg == "--stop":
+            stop = int(args.pop(0))
+        elif arg == "--step":
+            step = int(args.pop(0))
+        elif arg == "--force":
+            force = True
+
+    num_written, num_current, errors = export_point_cache ( viz_dir, cache_dir, start, stop, step, max_workers, force=force )
+    for filepath, error in errors:
+        print ( "Unable to export %s: %s" % (filepath, error) )
+    print ( "Wrote %d point cache frames (%d already current)" % (num_written, num_current) )
+    sys.exit ( 1 if errors else 0 )
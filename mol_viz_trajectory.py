@@ -0,0 +1,348 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+# <pep8 compliant>
+
+"""
+This file contains the single file trajectory container for molecule viz data.
+
+A trajectory (".cbtraj") file holds all of the frames of one seed instead of
+one file per iteration. Each species of each frame is stored as a separately
+compressed block so a reader can decompress only the species it needs:
+
+    8 bytes   magic (CBTRAJ01)
+    ...       compressed species blocks (positions, orientations, ids)
+    ...       JSON description (encoding, species names, frame names)
+    ...       block table (one row per species per frame, see TABLE_DTYPE)
+    8 bytes   JSON offset          (uint64)
+    8 bytes   JSON length          (uint64)
+    8 bytes   block table offset   (uint64)
+    8 bytes   block table rows     (uint64)
+    8 bytes   magic (CBTRAJ01)
+
+All values are little endian. Positions are stored as float32, float16 or
+16 bit integers quantized to the bounding box of the block ("quantized").
+Orientations (surface molecules only) are float32 for the float32 encoding
+and float16 otherwise. Ids are uint32.
+
+The frames keep the names of the files they were converted from, so CellBlender
+can find a frame in a trajectory when its original file is not on the disk.
+
+Run this file from the command line to convert a directory of frames:
+
+    python mol_viz_trajectory.py convert viz_data/seed_00001 [out.cbtraj] [--float16|--quantized] [--remove]
+"""
+
+import os
+import sys
+import json
+import zlib
+import threading
+
+import numpy
+
+if __package__:
+    from . import mol_viz_io
+else:
+    import mol_viz_io
+
+
+TRAJECTORY_SUFFIX = ".cbtraj"
+TRAJECTORY_VERSION = 1
+MAGIC = b"CBTRAJ01"
+
+ENCODINGS = ( 'float32', 'float16', 'quantized' )
+
+TABLE_DTYPE = numpy.dtype ( [ ('frame', '<u4'),
+                              ('species', '<u4'),
+                              ('mol_type', 'u1'),
+                              ('has_ids', 'u1'),
+                              ('count', '<u4'),
+                              ('offset', '<u8'),
+                              ('nbytes', '<u8'),
+                              ('bbox_min', '<f4', (3,)),
+                              ('bbox_max', '<f4', (3,)) ] )
+
+FOOTER_DTYPE = numpy.dtype('<u8')
+FOOTER_SIZE = 4*8 + len(MAGIC)
+
+QUANTIZED_MAX = 65535.0
+
+
+def encode_block ( block, encoding ):
+    """ Return (bytes, bbox_min, bbox_max) for the uncompressed contents of a species block """
+    positions = numpy.asarray ( block.positions, dtype=numpy.float32 )
+    if len(positions) > 0:
+        bbox_min = positions.min(axis=0)
+        bbox_max = positions.max(axis=0)
+    else:
+        bbox_min = numpy.zeros(3, dtype=numpy.float32)
+        bbox_max = numpy.zeros(3, dtype=numpy.float32)
+    if encoding == 'float32':
+        parts = [ positions.astype('<f4') ]
+    elif encoding == 'float16':
+        parts = [ positions.astype('<f2') ]
+    else:
+        scale = numpy.where ( bbox_max > bbox_min, bbox_max - bbox_min, 1.0 )
+        quantized = numpy.rint ( (positions - bbox_min) * (QUANTIZED_MAX / scale) )
+        parts = [ quantized.astype('<u2') ]
+    if block.mol_type == 1:
+        parts.append ( numpy.asarray(block.orientations).astype('<f4' if encoding == 'float32' else '<f2') )
+    if block.ids is not None:
+        parts.append ( numpy.asarray(block.ids).astype('<u4') )
+    return ( b"".join([p.tobytes() for p in parts]), bbox_min, bbox_max )
+
+
+def decode_block ( data, row, name, encoding ):
+    """ Return a VizSpeciesBlock from the uncompressed contents of a block """
+    count = int(row['count'])
+    pos_dtype = { 'float32': '<f4', 'float16': '<f2', 'quantized': '<u2' } [encoding]
+    offset = 0
+    positions = numpy.frombuffer ( data, dtype=pos_dtype, count=3*count, offset=offset ).reshape((count,3))
+    offset += positions.nbytes
+    if encoding == 'quantized':
+        bbox_min = row['bbox_min']
+        bbox_max = row['bbox_max']
+        scale = numpy.where ( bbox_max > bbox_min, bbox_max - bbox_min, 1.0 )
+        positions = (positions * (scale / QUANTIZED_MAX) + bbox_min).astype(numpy.float32)
+    else:
+        positions = positions.astype(numpy.float32)
+    orientations = None
+    if row['mol_type'] == 1:
+        orient_dtype = '<f4' if encoding == 'float32' else '<f2'
+        orientations = numpy.frombuffer ( data, dtype=orient_dtype, count=3*count, offset=offset ).reshape((count,3))
+        offset += orientations.nbytes
+        orientations = orientations.astype(numpy.float32)
+    ids = None
+    if row['has_ids']:
+        ids = numpy.frombuffer ( data, dtype='<u4', count=count, offset=offset ).astype(numpy.uint32)
+    return mol_viz_io.VizSpeciesBlock ( name, int(row['mol_type']), positions, orientations, ids )
+
+
+class TrajectoryWriter:
+    """ Write frames (lists of VizSpeciesBlocks) to a new trajectory file
+
+    The frames are written to a temporary file that replaces path when the
+    writer is closed, so readers never see a partial trajectory.
+    """
+
+    def __init__ ( self, path, encoding='float32', compress_level=6 ):
+        if not (encoding in ENCODINGS):
+            raise ValueError ( "Unknown trajectory encoding: " + str(encoding) )
+        self.path = path
+        self.encoding = encoding
+        self.compress_level = compress_level
+        self.species_names = []
+        self.species_codes = {}
+        self.frame_names = []
+        self.rows = []
+        self.tmp_path = path + ".%d.tmp" % os.getpid()
+        self.f = open ( self.tmp_path, 'wb' )
+        self.f.write ( MAGIC )
+
+    def add_frame ( self, frame_name, blocks ):
+        frame = len(self.frame_names)
+        self.frame_names.append ( frame_name )
+        for block in blocks:
+            if not (block.name in self.species_codes):
+                self.species_codes[block.name] = len(self.species_names)
+                self.species_names.append ( block.name )
+            data, bbox_min, bbox_max = encode_block ( block, self.encoding )
+            data = zlib.compress ( data, self.compress_level )
+            self.rows.append ( ( frame, self.species_codes[block.name], block.mol_type, block.ids is not None,
+                                 block.count, self.f.tell(), len(data), bbox_min, bbox_max ) )
+            self.f.write ( data )
+
+    def close ( self ):
+        desc = { 'cbtraj_version': TRAJECTORY_VERSION,
+                 'encoding': self.encoding,
+                 'species': self.species_names,
+                 'frames': self.frame_names }
+        desc_bytes = json.dumps(desc).encode()
+        desc_offset = self.f.tell()
+        self.f.write ( desc_bytes )
+        table = numpy.array ( self.rows, dtype=TABLE_DTYPE )
+        table_offset = self.f.tell()
+        self.f.write ( table.tobytes() )
+        footer = numpy.array ( [desc_offset, len(desc_bytes), table_offset, len(table)], dtype=FOOTER_DTYPE )
+        self.f.write ( footer.tobytes() )
+        self.f.write ( MAGIC )
+        self.f.close()
+        os.replace ( self.tmp_path, self.path )
+
+    def abort ( self ):
+        """ Remove the partly written trajectory """
+        self.f.close()
+        if os.path.exists ( self.tmp_path ):
+            os.remove ( self.tmp_path )
+
+
+class TrajectoryFile:
+    """ Random access reader for a trajectory file """
+
+    def __init__ ( self, path ):
+        self.path = path
+        self.lock = threading.Lock()
+        self.f = open ( path, 'rb' )
+        self.f.seek ( 0, os.SEEK_END )
+        size = self.f.tell()
+        if size < len(MAGIC) + FOOTER_SIZE:
+            raise ValueError ( "Not a trajectory file: " + path )
+        self.f.seek ( size - FOOTER_SIZE )
+        footer = self.f.read ( FOOTER_SIZE )
+        if footer[-len(MAGIC):] != MAGIC:
+            raise ValueError ( "Not a complete trajectory file: " + path )
+        desc_offset, desc_len, table_offset, table_rows = [ int(v) for v in numpy.frombuffer(footer, dtype=FOOTER_DTYPE, count=4) ]
+        self.f.seek ( desc_offset )
+        desc = json.loads ( self.f.read(desc_len).decode() )
+        if desc['cbtraj_version'] != TRAJECTORY_VERSION:
+            raise ValueError ( "Unsupported trajectory version: " + str(desc['cbtraj_version']) )
+        self.encoding = desc['encoding']
+        self.species_names = desc['species']
+        self.frame_names = desc['frames']
+        self.frame_codes = dict ( [ (n, i) for i, n in enumerate(self.frame_names) ] )
+        self.f.seek ( table_offset )
+        self.table = numpy.frombuffer ( self.f.read(table_rows*TABLE_DTYPE.itemsize), dtype=TABLE_DTYPE )
+        # Rows are written frame by frame, so each frame is a contiguous range of rows
+        self.frame_starts = numpy.searchsorted ( self.table['frame'], numpy.arange(len(self.frame_names)+1) )
+
+    @property
+    def num_frames ( self ):
+        return len(self.frame_names)
+
+    def frame_rows ( self, frame ):
+        return self.table[self.frame_starts[frame]:self.frame_starts[frame+1]]
+
+    def read_frame ( self, frame, names=None ):
+        """ Return the VizSpeciesBlocks of a frame (only the species in names if given) """
+        blocks = []
+        for row in self.frame_rows ( frame ):
+            name = self.species_names[row['species']]
+            if (names is not None) and not (name in names):
+                continue
+            with self.lock:
+                self.f.seek ( int(row['offset']) )
+                data = self.f.read ( int(row['nbytes']) )
+            blocks.append ( decode_block ( zlib.decompress(data), row, name, self.encoding ) )
+        return blocks
+
+    def close ( self ):
+        self.f.close()
+
+
+# Open trajectories keyed by path and checked against the file's modification time
+open_trajectories = {}
+open_trajectories_lock = threading.Lock()
+
+
+def get_trajectory ( path ):
+    """ Return an open TrajectoryFile for path (reopened if the file changed) """
+    mtime = os.path.getmtime ( path )
+    with open_trajectories_lock:
+        if path in open_trajectories:
+            traj, traj_mtime = open_trajectories[path]
+            if traj_mtime == mtime:
+                return traj
+            traj.close()
+        traj = TrajectoryFile ( path )
+        open_trajectories[path] = ( traj, mtime )
+        return traj
+
+
+def find_trajectories ( dir_name ):
+    if not os.path.isdir(dir_name):
+        return []
+    return sorted ( [ os.path.join(dir_name, f) for f in os.listdir(dir_name) if f.endswith(TRAJECTORY_SUFFIX) ] )
+
+
+# Paths of trajectories that couldn't be read (so each is only reported once)
+unreadable_trajectories = set()
+
+
+def readable_trajectories ( dir_name ):
+    """ Return the open TrajectoryFiles in a directory (skipping files that can't be read) """
+    trajectories = []
+    for path in find_trajectories ( dir_name ):
+        try:
+            trajectories.append ( get_trajectory(path) )
+        except (OSError, ValueError) as e:
+            if not (path in unreadable_trajectories):
+                unreadable_trajectories.add ( path )
+                print ( "Skipping unreadable trajectory " + path + ": " + str(e) )
+    return trajectories
+
+
+def trajectory_frame_names ( dir_name ):
+    """ Return the frame names of all trajectories in a directory """
+    frame_names = []
+    for traj in readable_trajectories ( dir_name ):
+        frame_names.extend ( traj.frame_names )
+    return frame_names
+
+
+def find_trajectory_frame ( filepath ):
+    """ Return (TrajectoryFile, frame) holding the frame originally stored in filepath, or None """
+    dir_name, frame_name = os.path.split ( filepath )
+    for traj in readable_trajectories ( dir_name ):
+        if frame_name in traj.frame_codes:
+            return ( traj, traj.frame_codes[frame_name] )
+    return None
+
+
+def default_trajectory_name ( frame_names ):
+    """ Name a trajectory after its frames (Scene.cellbin.0001.dat -> Scene.cbtraj) """
+    if frame_names and (".cellbin." in frame_names[0]):
+        return frame_names[0].split(".cellbin.")[0] + TRAJECTORY_SUFFIX
+    return "viz_data" + TRAJECTORY_SUFFIX
+
+
+def convert_viz_dir ( viz_dir, traj_path=None, encoding='float32', remove=False ):
+    """ Convert all ".dat" frames in viz_dir to one trajectory file and return its path """
+    frame_names = sorted ( [ f for f in os.listdir(viz_dir) if f.endswith(".dat") ] )
+    if traj_path is None:
+        traj_path = os.path.join ( viz_dir, default_trajectory_name(frame_names) )
+    writer = TrajectoryWriter ( traj_path, encoding )
+    try:
+        for frame_name in frame_names:
+            writer.add_frame ( frame_name, mol_viz_io.read_viz_frame(os.path.join(viz_dir, frame_name)) )
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+    if remove:
+        for frame_name in frame_names:
+            os.remove ( os.path.join(viz_dir, frame_name) )
+            index_path = mol_viz_io.viz_index_path ( os.path.join(viz_dir, frame_name) )
+            if os.path.exists(index_path):
+                os.remove ( index_path )
+    return traj_path
+
+
+if __name__ == "__main__":
+
+    args = [ a for a in sys.argv[1:] if not a.startswith("--") ]
+    opts = [ a for a in sys.argv[1:] if a.startswith("--") ]
+    if (len(args) in (2, 3)) and (args[0] == "convert"):
+        encoding = 'float32'
+        if "--float16" in opts:
+            encoding = 'float16'
+        elif "--quantized" in opts:
+            encoding = 'quantized'
+        traj_path = convert_viz_dir ( args[1], args[2] if len(args) > 2 else None, encoding, "--remove" in opts )
+        print ( "Wrote " + traj_path )
+    else:
+        print ( "Usage: python mol_viz_trajectory.py convert viz_dir [out.cbtraj] [--float16|--quantized] [--remove]" )
@@ -32,6 +32,7 @@ import mathutils
 
 # python imports
 import re
+import numpy
 
 import cellblender
 
@@ -202,6 +203,193 @@ def region_update(self, context):
     return
 
 
+# Region Face Storage:
+
+# The faces of each region are stored on the mesh (in mesh["mcell"]["regions"][id])
+# as run-length encoded ID-property arrays. A face index starts a run and a
+# negative value (-n) following it adds the next n faces to that run:
+#   faces 3,4,5,6,9,11,12 are stored as [3,-3,9,11,12]
+# The encoded values are split into segments of at most RLE_SEG_LEN values.
+
+RLE_SEG_LEN = 32767
+
+# Decoded region faces keyed by (mesh pointer, region id): (stamp, RegionFaceArray)
+#   (see get_region_stamp)
+region_faces_cache = {}
+
+# Face to region indexes keyed by mesh pointer: FaceRegionIndex
+face_region_index_cache = {}
+
+
+def get_region_edits(mesh):
+    """ Return the number of region edits of a mesh
+
+    The count is stored with the regions (in mesh["mcell"]["region_edits"])
+    so undo restores it along with the faces it counts.
+    """
+    mcell = mesh.get("mcell")
+    if mcell is None:
+        return(0)
+    return(mcell.get("region_edits", 0))
+
+
+def count_region_edit(mesh):
+    """ Count an edit of the regions of a mesh (mesh["mcell"] must exist) """
+    mesh["mcell"]["region_edits"] = get_region_edits(mesh) + 1
+
+
+def rle_encode_faces(faces):
+    """ Run-length encode a sorted array of unique face indices """
+
+    faces = numpy.asarray(faces, dtype=numpy.int64)
+    if len(faces) == 0:
+        return numpy.zeros(0, dtype=numpy.int32)
+
+    bounds = numpy.flatnonzero(numpy.diff(faces) != 1) + 1
+    starts = faces[numpy.concatenate(([0], bounds))]
+    lengths = numpy.diff(numpy.concatenate(([0], bounds, [len(faces)])))
+
+    # Runs of one face are stored as [start], runs of two as [start, start+1]
+    #   and longer runs as [start, -(length-1)]
+    num_vals = numpy.where(lengths > 1, 2, 1)
+    pos = numpy.cumsum(num_vals) - num_vals
+    rle = numpy.empty(num_vals.sum(), dtype=numpy.int32)
+    rle[pos] = starts
+    ext = lengths > 1
+    rle[pos[ext] + 1] = numpy.where(
+        lengths[ext] == 2, starts[ext] + 1, 1 - lengths[ext])
+
+    return(rle)
+
+
+def rle_decode_faces(rle):
+    """ Decode run-length encoded face indices into a sorted array """
+
+    rle = numpy.asarray(rle, dtype=numpy.int64)
+    if len(rle) == 0:
+        return numpy.zeros(0, dtype=numpy.int64)
+
+    # Each negative value adds faces after the start value preceding it
+    ext = rle < 0
+    counts = numpy.where(ext, -rle, 1)
+    firsts = rle.copy()
+    firsts[ext] = rle[numpy.flatnonzero(ext) - 1] + 1
+    offsets = numpy.cumsum(counts) - counts
+
+    return(numpy.repeat(firsts - offsets, counts) + numpy.arange(counts.sum()))
+
+
+class RegionFaceArray:
+    """ The faces of a region as a sorted array of face indices
+
+    Single faces are looked up by binary search, and a bitmap over all the
+    faces of the mesh is built the first time one is asked for.
+    """
+
+    def __init__(self, faces):
+        self.faces = faces
+        self.mask = None
+
+    def __len__(self):
+        return len(self.faces)
+
+    def __contains__(self, face_index):
+        i = numpy.searchsorted(self.faces, face_index)
+        return bool((i < len(self.faces)) and (self.faces[i] == face_index))
+
+    def contains(self, faces):
+        """ Return a boolean array telling which of the faces are in the region """
+        faces = numpy.asarray(faces, dtype=numpy.int64)
+        if len(self.faces) == 0:
+            return numpy.zeros(len(faces), dtype=bool)
+        i = numpy.minimum(numpy.searchsorted(self.faces, faces), len(self.faces) - 1)
+        return(self.faces[i] == faces)
+
+    def get_mask(self, num_faces):
+        """ Return a bitmap (boolean array) of the region faces of a mesh """
+        if (self.mask is None) or (len(self.mask) != num_faces):
+            self.mask = numpy.zeros(num_faces, dtype=bool)
+            self.mask[self.faces[self.faces < num_faces]] = True
+        return(self.mask)
+
+
+class FaceRegionIndex:
+    """ The regions of each face of a mesh as a bitmask (one bit per region)
+
+    Bit n of a face is set when the face is in the n-th region of the region
+    list the index was built from. The index is current while the region ids
+    and the region edit count of the mesh (see get_region_edits) are the ones
+    it was built from or updated to. It keeps the RegionFaceArray of each
+    region to clear the old bits of a region that is set again.
+    """
+
+    def __init__(self, region_ids, region_faces, num_faces, edits):
+        self.region_ids = list(region_ids)
+        self.edits = edits
+        self.region_faces = list(region_faces)
+        for reg_faces in self.region_faces:
+            if len(reg_faces) > 0:
+                num_faces = max(num_faces, int(reg_faces.faces[-1]) + 1)
+        self.num_faces = num_faces
+        num_words = max(1, (len(self.region_ids) + 63) // 64)
+        self.bits = numpy.zeros((num_faces, num_words), dtype=numpy.uint64)
+        for n, reg_faces in enumerate(self.region_faces):
+            self.bits[reg_faces.faces, n // 64] |= numpy.uint64(1 << (n % 64))
+
+    def is_current(self, region_ids, edits):
+        """ Return True if the index was built from (or updated to) these regions """
+        return (edits == self.edits) and (region_ids == self.region_ids)
+
+    def update_region(self, region_id, reg_faces, edits):
+        """ Replace the faces of one region (returns False if the index must be rebuilt)
+
+        edits is the region edit count of the mesh after the change.
+        """
+        if not (region_id in self.region_ids) or (edits != self.edits + 1):
+            return False
+        if (len(reg_faces) > 0) and (reg_faces.faces[-1] >= self.num_faces):
+            return False
+        n = self.region_ids.index(region_id)
+        bit = numpy.uint64(1 << (n % 64))
+        self.bits[self.region_faces[n].faces, n // 64] &= ~bit
+        self.bits[reg_faces.faces, n // 64] |= bit
+        self.region_faces[n] = reg_faces
+        self.edits = edits
+        return True
+
+    def get_face_bits(self, faces):
+        """ Return the bitwise or of the region bits of the faces """
+        faces = numpy.asarray(faces, dtype=numpy.int64)
+        faces = faces[(faces >= 0) & (faces < self.num_faces)]
+        return(numpy.bitwise_or.reduce(self.bits[faces], axis=0))
+
+    def bits_to_regions(self, bits):
+        """ Return the region list positions of the bits set in a bitmask """
+        return([n for n in range(len(self.region_ids))
+                if bits[n // 64] & numpy.uint64(1 << (n % 64))])
+
+    def faces_get_regions(self, faces):
+        """ Return the region list positions of the regions containing any of the faces """
+        return(self.bits_to_regions(self.get_face_bits(faces)))
+
+
+def get_selected_faces(mesh):
+    """ Return the sorted indices of the selected faces (mesh must be in object mode) """
+
+    sel = numpy.zeros(len(mesh.polygons), dtype=bool)
+    mesh.polygons.foreach_get("select", sel)
+    return(numpy.flatnonzero(sel))
+
+
+def set_faces_select(mesh, faces, state):
+    """ Select or deselect the given faces (mesh must be in object mode) """
+
+    sel = numpy.zeros(len(mesh.polygons), dtype=bool)
+    mesh.polygons.foreach_get("select", sel)
+    sel[faces[faces < len(sel)]] = state
+    mesh.polygons.foreach_set("select", sel)
+
+
 # CellBlender Properties Classes for Surface Regions:
 
 class MCellSurfaceRegionProperty(bpy.types.PropertyGroup):
@@ -234,14 +422,12 @@ class MCellSurfaceRegionProperty(bpy.types.PropertyGroup):
     def assign_region_faces(self, context):
         mesh = context.active_object.data
         if (mesh.total_face_sel > 0):
-            face_set = self.get_region_faces(mesh) 
+            faces = self.get_region_face_array(mesh).faces
             bpy.ops.object.mode_set(mode='OBJECT')
-            for f in mesh.polygons:
-                if f.select:
-                    face_set.add(f.index)
+            sel_faces = get_selected_faces(mesh)
             bpy.ops.object.mode_set(mode='EDIT')
 
-            self.set_region_faces(mesh,face_set) 
+            self.set_region_faces(mesh,numpy.union1d(faces,sel_faces))
 
         return {'FINISHED'}
 
@@ -249,27 +435,23 @@ class MCellSurfaceRegionProperty(bpy.types.PropertyGroup):
     def remove_region_faces(self, context):
         mesh = context.active_object.data
         if (mesh.total_face_sel > 0):
-            face_set = self.get_region_faces(mesh) 
+            faces = self.get_region_face_array(mesh).faces
             bpy.ops.object.mode_set(mode='OBJECT')
-            for f in mesh.polygons:
-                if f.select:
-                    if f.index in face_set:
-                        face_set.remove(f.index)
+            sel_faces = get_selected_faces(mesh)
             bpy.ops.object.mode_set(mode='EDIT')
 
-            self.set_region_faces(mesh,face_set) 
+            self.set_region_faces(mesh,numpy.setdiff1d(faces,sel_faces,assume_unique=True))
 
         return {'FINISHED'}
 
 
     def select_region_faces(self, context):
         mesh = context.active_object.data
-        face_set = self.get_region_faces(mesh)
+        faces = self.get_region_face_array(mesh).faces
         msm = context.scene.tool_settings.mesh_select_mode[0:3]
         context.scene.tool_settings.mesh_select_mode = (False, False, True)
         bpy.ops.object.mode_set(mode='OBJECT')
-        for f in face_set:
-            mesh.polygons[f].select = True
+        set_faces_select(mesh, faces, True)
         bpy.ops.object.mode_set(mode='EDIT')
         context.scene.tool_settings.mesh_select_mode = msm
 
@@ -278,29 +460,27 @@ class MCellSurfaceRegionProperty(bpy.types.PropertyGroup):
 
     def deselect_region_faces(self, context):
         mesh = context.active_object.data
-        face_set = self.get_region_faces(mesh)
+        faces = self.get_region_face_array(mesh).faces
         msm = context.scene.tool_settings.mesh_select_mode[0:3]
         context.scene.tool_settings.mesh_select_mode = (False, False, True)
         bpy.ops.object.mode_set(mode='OBJECT')
-        for f in face_set:
-            mesh.polygons[f].select = False
+        set_faces_select(mesh, faces, False)
         bpy.ops.object.mode_set(mode='EDIT')
         context.scene.tool_settings.mesh_select_mode = msm
 
         return {'FINISHED'}
 
     def eliminate_overlapping_faces(self, context):
-        bpy.ops.mesh.select_all(action = 'DESELECT')
-        #mesh = context.active_object.data
-        self.select_region_faces(context)
-        reg_names = context.object.mcell.regions.faces_get_regions(context)
-        for reg_name in reg_names:
-            if reg_name != self.name:
-                reg = bpy.data.objects[context.active_object.name].mcell.regions.region_list[reg_name]
-                reg.remove_region_faces(context)
-                #bpy.data.objects[context.active_object.name].mcell.regions.active_reg_index = bpy.data.objects[context.active_object.name].mcell.regions.region_list.find(reg)
-                #bpy.ops.mcell.region_faces_remove()
-        #bpy.data.objects[context.active_object.name].mcell.regions.active_reg_index = bpy.data.objects[context.active_object.name].mcell.regions.region_list.find(self.name)
+        """Remove the faces of this region from all other regions"""
+        mesh = context.active_object.data
+        regions = context.active_object.mcell.regions
+        face_index = regions.get_face_region_index(mesh)
+        faces = self.get_region_face_array(mesh).faces
+        for n in face_index.faces_get_regions(faces):
+            reg = regions.region_list[n]
+            if reg.id != self.id:
+                reg_faces = reg.get_region_face_array(mesh).faces
+                reg.set_region_faces(mesh,numpy.setdiff1d(reg_faces,faces,assume_unique=True))
 
 
     def destroy_region(self, context):
@@ -317,13 +497,15 @@ class MCellSurfaceRegionProperty(bpy.types.PropertyGroup):
                   mesh["mcell"]["regions"][id][seg_id] = []
               mesh["mcell"]["regions"][id].clear()
               mesh["mcell"]["regions"].pop(id)
+              count_region_edit(mesh)
+        region_faces_cache.pop((mesh.as_pointer(), id), None)
+        face_region_index_cache.pop(mesh.as_pointer(), None)
 
 
     def face_in_region(self, context, face_index):
         """Return True if face is in this region"""
         mesh = context.active_object.data
-        reg_faces = self.get_region_faces(mesh)
-        return(face_index in reg_faces)
+        return(face_index in self.get_region_face_array(mesh))
 
 
     def init_region(self, context, id):
@@ -353,115 +535,108 @@ class MCellSurfaceRegionProperty(bpy.types.PropertyGroup):
         for seg_id in mesh["mcell"]["regions"][id].keys():
             mesh["mcell"]["regions"][id][seg_id] = []
         mesh["mcell"]["regions"][id].clear()
+        count_region_edit(mesh)
+        region_faces_cache.pop((mesh.as_pointer(), id), None)
 
 
-    def get_region_faces(self, mesh):
-        """Given a mesh and a region id, return the set of region face indices"""
+    def get_region_stamp(self, mesh):
+        """ Return a stamp that changes when the stored faces of this region change
+
+        The stamp is the edit count of the mesh and the length of each
+        segment, so it's checked without reading the faces themselves.
+        """
+
+        id = str(self.id)
+
+        seg_lens = ()
+        if mesh.get('mcell'):
+          if mesh['mcell'].get('regions'):
+            if mesh['mcell']['regions'].get(id):
+              segs = mesh["mcell"]["regions"][id]
+              seg_lens = tuple([len(segs[seg_id]) for seg_id in segs.keys()])
+
+        return((get_region_edits(mesh), seg_lens))
+
+
+    def get_region_rle(self, mesh):
+        """Given a mesh, return the run-length encoded faces of this region"""
 
         id = str(self.id)
 
-        face_rle = []
+        segs = []
         if mesh.get('mcell'):
           if mesh['mcell'].get('regions'):
             if mesh['mcell']['regions'].get(id):
               for seg_id in mesh["mcell"]["regions"][id].keys():
-                face_rle.extend(mesh["mcell"]["regions"][id][seg_id].to_list())
+                segs.append(numpy.asarray(
+                    mesh["mcell"]["regions"][id][seg_id], dtype=numpy.int64))
 
-        if (len(face_rle) > 0): 
-            face_set = set(self.rl_decode(face_rle))
-        else:
-            face_set = set([])
+        if (len(segs) > 0):
+            return(numpy.concatenate(segs))
+        return(numpy.zeros(0, dtype=numpy.int64))
+
+
+    def get_region_face_array(self, mesh):
+        """Given a mesh, return the faces of this region as a RegionFaceArray"""
+
+        key = (mesh.as_pointer(), str(self.id))
+        stamp = self.get_region_stamp(mesh)
+
+        # The stored faces may have changed without us (undo), so only
+        #   reuse the decoded faces while the stamp is the same
+        cached = region_faces_cache.get(key)
+        if (cached is not None) and (cached[0] == stamp):
+            return(cached[1])
+
+        reg_faces = RegionFaceArray(rle_decode_faces(self.get_region_rle(mesh)))
+        region_faces_cache[key] = (stamp, reg_faces)
+        return(reg_faces)
+
+
+    def get_region_faces(self, mesh):
+        """Given a mesh and a region id, return the set of region face indices"""
 
-        return(face_set)
+        return(set(self.get_region_face_array(mesh).faces.tolist()))
 
 
     def set_region_faces(self, mesh, face_set):
-        """Set the faces of a given region id on a mesh, given a set of faces """
+        """Set the faces of a given region id on a mesh, given a set (or array) of faces """
 
         id = str(self.id)
-        face_list = list(face_set)
-        face_list.sort()
-        face_rle = self.rl_encode(face_list)
+        if not isinstance(face_set, numpy.ndarray):
+            face_set = numpy.fromiter(face_set, dtype=numpy.int64)
+        faces = numpy.unique(face_set.astype(numpy.int64))
+        face_rle = rle_encode_faces(faces)
 
         # Clear existing faces from this region id
         self.reset_region(mesh)
 
-        # segment face_rle into pieces <= max_len (i.e. <= 32767)
+        # segment face_rle into pieces <= RLE_SEG_LEN (i.e. <= 32767)
         #   and assign these segments to the region id
-        max_len = 32767
-        seg_rle = face_rle
-        len_rle = len(seg_rle)
-        seg_idx = 0
-        while len_rle > 0:
-          if len_rle <= 32767:
-            mesh["mcell"]["regions"][id][str(seg_idx)] = seg_rle
-            len_rle = 0
-          else:
-            mesh["mcell"]["regions"][id][str(seg_idx)] = seg_rle[0:max_len]
-            tmp_rle = seg_rle[max_len:]
-            seg_rle = tmp_rle
-            len_rle = len(seg_rle)
-          seg_idx += 1
+        for seg_idx, seg_start in enumerate(range(0, len(face_rle), RLE_SEG_LEN)):
+            mesh["mcell"]["regions"][id][str(seg_idx)] = \
+                face_rle[seg_start:seg_start+RLE_SEG_LEN].tolist()
+
+        reg_faces = RegionFaceArray(faces)
+        region_faces_cache[(mesh.as_pointer(), id)] = (
+            self.get_region_stamp(mesh), reg_faces)
+
+        # Keep the face to region index of the mesh up to date
+        face_index = face_region_index_cache.get(mesh.as_pointer())
+        if (face_index is not None) and not face_index.update_region(self.id, reg_faces, get_region_edits(mesh)):
+            face_region_index_cache.pop(mesh.as_pointer())
 
 
     def rl_encode(self, l):
-        """Run-length encode an array of face indices"""
-
-        runlen = 0
-        runstart = 0
-        rle = []
-        i = 0
-
-        while (i < len(l)):
-          if (runlen == 0):
-            rle.append(l[i])
-            runstart = l[i]
-            runlen = 1
-            i+=1
-          elif (l[i] == (runstart+runlen)):
-            if (i < (len(l)-1)):
-              runlen += 1
-            else:
-              if (runlen == 1):
-                rle.append(runstart+1)
-              else:
-                rle.append(-runlen)
-            i+=1
-          elif (runlen == 1):
-            runlen = 0
-          elif (runlen == 2):
-            rle.append(runstart+1)
-            runlen = 0
-          else:
-            rle.append(-(runlen-1))
-            runlen = 0
-
-        return(rle)
+        """Run-length encode a sorted list of face indices"""
+
+        return(rle_encode_faces(l).tolist())
 
 
     def rl_decode(self, l):
-        """Decode a run-length encoded array of face indices"""
-
-        runlen = 0
-        runstart = 0
-        rld = []
-        i = 0
-
-        while (i < len(l)):
-          if (runlen == 0):
-            rld.append(l[i])
-            runstart = l[i]
-            runlen = 1
-            i+=1
-          elif (l[i] > 0):
-            runlen = 0
-          else:
-            for j in range(1,-l[i]+1):
-              rld.append(runstart+j)
-            runlen = 0
-            i+=1
-
-        return(rld)
+        """Decode a run-length encoded list of face indices"""
+
+        return(rle_decode_faces(l).tolist())
 
 
 class MCellSurfaceRegionListProperty(bpy.types.PropertyGroup):
@@ -490,17 +665,28 @@ class MCellSurfaceRegionListProperty(bpy.types.PropertyGroup):
         return(id)
 
 
+    def get_face_region_index(self, mesh):
+        """ Return the face to region index of the mesh (rebuilt when regions have changed) """
+        region_ids = [reg.id for reg in self.region_list]
+        edits = get_region_edits(mesh)
+        face_index = face_region_index_cache.get(mesh.as_pointer())
+        if (face_index is None) or not face_index.is_current(region_ids, edits):
+            region_faces = [reg.get_region_face_array(mesh) for reg in self.region_list]
+            face_index = FaceRegionIndex(region_ids, region_faces, len(mesh.polygons), edits)
+            face_region_index_cache[mesh.as_pointer()] = face_index
+        return(face_index)
+
+
     def face_get_regions(self,context):
         """ Return the list of region IDs associated with one selected face """
         reg_list = ""
         mesh = context.active_object.data
         if (mesh.total_face_sel == 1):
           bpy.ops.object.mode_set(mode='OBJECT')
-          face_index = [f.index for f in mesh.polygons if f.select][0]
+          face_index = int(get_selected_faces(mesh)[0])
           bpy.ops.object.mode_set(mode='EDIT')
-          for reg in self.region_list: 
-            if reg.face_in_region(context,face_index):
-              reg_list = reg_list + " " + reg.name
+          for n in self.get_face_region_index(mesh).faces_get_regions([face_index]):
+            reg_list = reg_list + " " + self.region_list[n].name
         
         return(reg_list)
 
@@ -511,12 +697,10 @@ class MCellSurfaceRegionListProperty(bpy.types.PropertyGroup):
         mesh = context.active_object.data
         if (mesh.total_face_sel > 0):
           bpy.ops.object.mode_set(mode='OBJECT')
-          selface_set = set([f.index for f in mesh.polygons if f.select])
+          sel_faces = get_selected_faces(mesh)
           bpy.ops.object.mode_set(mode='EDIT')
-          for reg in self.region_list: 
-            reg_faces = reg.get_region_faces(mesh)
-            if not selface_set.isdisjoint(reg_faces):
-              reg_info.append(reg.name)
+          for n in self.get_face_region_index(mesh).faces_get_regions(sel_faces):
+            reg_info.append(self.region_list[n].name)
 
         return(reg_info)
 
@@ -781,9 +965,7 @@ class MCellObjectPropertyGroup(bpy.types.PropertyGroup):
             id = str(reg.id)
             mesh = obj.data
             #reg_faces = list(object_surface_regions.get_region_faces(mesh,id))
-            reg_faces = list(reg.get_region_faces(mesh))
-            reg_faces.sort()
-            reg_dict[reg.name] = reg_faces
+            reg_dict[reg.name] = reg.get_region_face_array(mesh).faces.tolist()
         return reg_dict
 
     def get_face_regions_dictionary (self, obj):
@@ -792,7 +974,7 @@ class MCellObjectPropertyGroup(bpy.types.PropertyGroup):
         obj_regs = self.regions.region_list
         for reg in obj_regs:
             mesh = obj.data
-            reg_faces = list(reg.get_region_faces(mesh))
+            reg_faces = reg.get_region_face_array(mesh).faces.tolist()
             for face in reg_faces:
                 if not face_reg_dict.get(face):
                     face_reg_dict[face] = []
@@ -809,6 +991,10 @@ def object_regions_format_update(context):
     if not context:
         context = bpy.context
 
+    # Decoded region faces belong to the meshes of the previous file
+    region_faces_cache.clear()
+    face_region_index_cache.clear()
+
     scn_objs = context.scene.collection.children[0].objects
     objs = [obj for obj in scn_objs if obj.type == 'MESH']
     for obj in objs:
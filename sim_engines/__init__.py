@@ -22,6 +22,8 @@ import os
 import subprocess
 import sys
 
+from ..mdl import sweep_space
+
 # import cellblender
 
 plug_modules = None  # This is currently set by "cellblender_simulation.load_plug_modules"
@@ -74,12 +76,8 @@ def get_modules():
 
 
 
-######################################################################################
-#### This function has been duplicated in cellblender/mdl/run_data_model_mcell.py ####
-#### This function was originally in the run_data_model_mcell_3.py file as well.  ####
-######################################################################################
 def build_sweep_list ( par_dict ):
-    """ Count the number of runs that will be swept with this data model. """
+    """ Build a list of the swept parameters and their (lazily expanded) values. """
     sweep_list = []
     print ( "Building sweep list... " )
     if 'model_parameters' in par_dict:
@@ -93,53 +91,7 @@ def build_sweep_list ( par_dict ):
                     else:
                         sweep_item['par_name'] = "Unknown"
                     # Sweep expression example: "0, 2, 9, 10:20, 25:35:5, 50"
-                    num_runs_for_this_parameter = 0
-                    # Get the sweep expression sublists which are separated by commas
-                    sw_items = []
-                    if 'sweep_expression' in par:
-                        sw_items = [ p.strip() for p in par['sweep_expression'].split(',') ]
-                    #print ( "Sweep item list = " + str(sw_items) )
-                    # Count the number of runs represented by each sweep item (either:  #  or  #:#  or  #:#:#  )
-                    sweep_values = []
-                    for sw_item in sw_items:
-                        parts = [ p.strip() for p in sw_item.split(':') ]
-                        if len(parts) <= 0:
-                          # This would be two commas together?
-                          pass
-                        elif len(parts) == 1:
-                          # This is a scalar
-                          sweep_values.append ( float(parts[0]) )
-                          #print ( "Added " + parts[0] )
-                        elif len(parts) >= 2:
-                          # This is a range with a start and stop
-                          start = float(parts[0])
-                          stop = float(parts[1])
-                          step = 1
-                          if len(parts) > 2:
-                            step = float(parts[2])
-                          if start > stop:
-                            start = float(parts[1])
-                            stop = float(parts[0])
-                          if step < 0:
-                            step = -step
-                          if step == 0:
-                            # Do something to keep it from an infinite loop
-                            step = 1;
-                          # Start with a pessimistic guess
-                          num = int((stop-start) / step)
-                          # Increase until equal or over
-                          #print ( "Before increasing, num = " + str(num) )
-                          while (start+((num-1)*step)) < (stop+(step/1000)):
-                            num += 1
-                            #print ( "Increased to num = " + str(num) )
-                          # Reduce while actually over
-                          while start+((num-1)*step) > (stop+(step/1000)):
-                            num += -1
-                            #print ( "Decreased to num = " + str(num) )
-                          # Finally append the values
-                          for n in range(num):
-                            sweep_values.append ( start + (n*step) )
-                    sweep_item['values'] = sweep_values
+                    sweep_item['values'] = sweep_space.parse_sweep_expression ( par['sweep_expression'] )
                     sweep_list.append ( sweep_item )
     return sweep_list
 
@@ -157,7 +109,7 @@ def build_sweep_layout ( sweep_list, start_seed, end_seed ):
     sweep_layout['data_layout'] = []
     sweep_layout['data_layout'].append ( [ '/DIR', [ 'output_data' ] ] )
     for sw_item in sweep_list:
-      sweep_layout['data_layout'].append ( [ sw_item['par_name'], sw_item['values'] ] )
+      sweep_layout['data_layout'].append ( [ sw_item['par_name'], list(sw_item['values']) ] )
     sweep_layout['data_layout'].append ( [ '/FILE_TYPE', [ 'react_data', 'viz_data' ] ] )
     sweep_layout['data_layout'].append ( [ '/SEED', [s for s in range(start_seed,end_seed+1)] ] )
     return sweep_layout
@@ -182,6 +134,9 @@ def write_sweep_list_to_layout_file ( sweep_list, start_seed, end_seed, sweep_li
     sweep_list_file.write ( " ]\n" )
     sweep_list_file.write ( "}\n" )
     sweep_list_file.close()
+    # Save the space of runs next to the layout so the run paths don't need to be rebuilt from it
+    space = sweep_space.SweepSpace.from_sweep_list ( sweep_list, start_seed, end_seed )
+    sweep_space.write_sweep_index ( space, os.path.dirname(sweep_list_file_name) )
 
 
 def write_default_data_layout(project_dir, start, end):
@@ -23,6 +23,10 @@ def reset():
   parameter_dictionary['Output Detail (0-100)']['val'] = 20
   parameter_dictionary['Python Command']['val'] = ""
   parameter_dictionary['Reaction Factor']['val'] = 1.0
+  parameter_dictionary['Write Viz Index']['val'] = False
+  parameter_dictionary['Vectorized']['val'] = False
+  parameter_dictionary['Batch Seeds']['val'] = False
+  parameter_dictionary['Batch Processes']['val'] = 1
 
 def blenders_python():
   global parameter_dictionary
@@ -49,6 +53,10 @@ parameter_dictionary = {
   'Output Detail (0-100)': {'val': 20, 'desc':"Amount of Information to Print (0-100)", 'icon':'INFO'},
   'Python Command': {'val': "", 'as':'filename', 'desc':"Command to run Python (default is python)", 'icon':'SCRIPTWIN'},
   'Reaction Factor': {'val': 1.0, 'desc':"Decay Rate Multiplier", 'icon':'ARROW_LEFTRIGHT'},
+  'Write Viz Index': {'val': False, 'desc':"Write a .cbidx index beside each viz file"},
+  'Vectorized': {'val': False, 'desc':"Simulate each species as a NumPy array (when NumPy is available). Uses a different random number stream, so results differ from the default per-molecule mode for the same seed"},
+  'Batch Seeds': {'val': False, 'desc':"Run all seeds in one simulation process (reading the data model once)"},
+  'Batch Processes': {'val': 1, 'desc':"Number of worker processes used to run the seeds of a batch"},
   'Print Information': {'val': print_info, 'desc':"Print information about Limited Python Simulation"},
   "Blender's Python": {'val': blenders_python, 'desc':"Set Python Command to Blender's Python"},
   'Reset': {'val': reset, 'desc':"Reset everything"}
@@ -58,6 +66,8 @@ parameter_layout = [
   ['Python Command'],
   ['Output Detail (0-100)'],
   ['Reaction Factor'],
+  ['Write Viz Index', 'Vectorized'],
+  ['Batch Seeds', 'Batch Processes'],
   ["Blender's Python", 'Print Information', 'Reset']
 ]
 
@@ -149,25 +159,41 @@ def prepare_runs_data_model_full ( data_model, project_dir, data_layout=None ):
         if not os.path.exists(react_seed_dir):
             os.makedirs(react_seed_dir)
 
-      # Build the list of commands to be run along with any data files needed
-      for sim_seed in range(start,end+1):
-          if output_detail > 10: print ("Running with seed " + str(sim_seed) )
-
-          file_name = os.path.join(project_dir,"dm.txt")
+      # The data model is the same for every seed, so only save it once
+      file_name = os.path.join(project_dir,"dm.txt")
+
+      if output_detail > 20: print ( "Saving CellBlender model to file: " + file_name )
+      f = open ( file_name, 'w' )
+      f.write ( pickle.dumps({'mcell':data_model},protocol=0).decode('latin1') )
+      f.close()
+      if output_detail > 10: print ( "Done saving CellBlender model." )
+
+      common_args = [ "output_detail="+str(parameter_dictionary['Output Detail (0-100)']['val']),
+                      "proj_path="+project_dir,
+                      "decay_factor="+str(parameter_dictionary['Reaction Factor']['val']),
+                      "viz_index="+str(int(parameter_dictionary['Write Viz Index']['val'])),
+                      "vectorized="+str(int(parameter_dictionary['Vectorized']['val'])),
+                      "data_model=dm.txt" ]
+
+      if parameter_dictionary['Batch Seeds']['val'] and (end > start):
+          # Run all of the seeds in a single process (which may use a pool of its own)
+          if output_detail > 10: print ("Running seeds " + str(start) + " to " + str(end) + " in one batch" )
+          command_dict = { 'cmd': python_cmd,
+                           'args': [ final_script_path,
+                               "seeds="+str(start)+":"+str(end),
+                               "processes="+str(parameter_dictionary['Batch Processes']['val']) ] + common_args,
+                           'wd': project_dir
+                         }
+          command_list.append ( command_dict )
+          if output_detail > 70: print ( str(command_dict) )
 
-          if output_detail > 20: print ( "Saving CellBlender model to file: " + file_name )
-          f = open ( file_name, 'w' )
-          f.write ( pickle.dumps({'mcell':data_model},protocol=0).decode('latin1') )
-          f.close()
-          if output_detail > 10: print ( "Done saving CellBlender model." )
+      else:
+        # Build the list of commands to be run along with any data files needed
+        for sim_seed in range(start,end+1):
+          if output_detail > 10: print ("Running with seed " + str(sim_seed) )
 
           command_dict = { 'cmd': python_cmd,
-                           'args': [ final_script_path,
-                               "output_detail="+str(parameter_dictionary['Output Detail (0-100)']['val']),
-                               "proj_path="+project_dir,
-                               "seed="+str(sim_seed),
-                               "decay_factor="+str(parameter_dictionary['Reaction Factor']['val']),
-                               "data_model=dm.txt" ],
+                           'args': [ final_script_path, "seed="+str(sim_seed) ] + common_args,
                            'wd': project_dir
                          }
 
@@ -182,7 +208,16 @@ def get_progress_message_and_status ( stdout_txt ):
   task_complete = False
   # MCell Pure Prototype iteration lines look like this:
   # Iteration 10 of 1000
+  # Batches of seeds report each completed seed like this:
+  # Completed 3 of 20 seeds
   for i in reversed(stdout_txt.split("\n")):
+      if i.startswith("Completed "):
+          num_done = int(i.split()[1])
+          num_seeds = int(i.split()[3])
+          if (num_done == num_seeds) and (num_seeds != 0):
+              task_complete = True
+          progress_message = "PySim: %d of %d seeds" % (num_done, num_seeds)
+          break
       if i.startswith("Iteration "):
           last_iter = int(i.split()[1])
           total_iter = int(i.split()[3])
@@ -5,6 +5,8 @@ import math
 import random
 import array
 import shutil
+import json
+import multiprocessing
 
 def print_and_flush ( some_string ):
   # sys.stdout.write ( some_string + "\n" )
@@ -18,225 +20,349 @@ proj_path = ""
 data_model_file_name = ""
 data_model_full_path = ""
 run_seed = 1
+seed_list = None
+num_processes = 1
 decay_rate_factor = 1.0
+write_viz_index = False
+vectorized = False
 output_detail = 0
-for arg in sys.argv:
-  if output_detail > 10: print_and_flush ( "   " + str(arg) )
-  if arg[0:10] == "proj_path=":
-    proj_path = arg[10:]
-  elif arg[0:11] == "data_model=":
-    data_model_file_name = arg[11:]
-  elif arg[0:5] == "seed=":
-    run_seed = int(arg[5:])
-  elif arg[0:13] == "decay_factor=":
-    decay_rate_factor = float(arg[13:])
-  elif arg[0:14] == "output_detail=":
-    output_detail = int(arg[14:])
-  else:
-    if output_detail > 0: print_and_flush ( "Unknown argument = " + str(arg) )
-if output_detail > 10: print_and_flush ( "\n\n" )
 
-if output_detail > 0:
-  print_and_flush ( "**********************************************" )
-  print_and_flush ( "*  Limited Pure Python Prototype Simulation  *" )
-  print_and_flush ( "*          Updated: July 19th, 2017          *" )
-  print_and_flush ( "**********************************************" )
-  print_and_flush ( "" )
-  print_and_flush ( "Running with Python:" )
-  print_and_flush ( sys.version )
-  print_and_flush ( "" )
+def parse_args ( argv ):
+  global proj_path, data_model_file_name, run_seed, seed_list, num_processes, decay_rate_factor, write_viz_index, vectorized, output_detail
+  for arg in argv:
+    if output_detail > 10: print_and_flush ( "   " + str(arg) )
+    if arg[0:10] == "proj_path=":
+      proj_path = arg[10:]
+    elif arg[0:11] == "data_model=":
+      data_model_file_name = arg[11:]
+    elif arg[0:5] == "seed=":
+      run_seed = int(arg[5:])
+    elif arg[0:6] == "seeds=":
+      # Batch mode: run every seed in first:last in this process
+      first, last = [ int(s) for s in arg[6:].split(':') ]
+      seed_list = list ( range(first, last+1) )
+    elif arg[0:10] == "processes=":
+      num_processes = max ( int(arg[10:]), 1 )
+    elif arg[0:13] == "decay_factor=":
+      decay_rate_factor = float(arg[13:])
+    elif arg[0:10] == "viz_index=":
+      write_viz_index = int(arg[10:]) != 0
+    elif arg[0:11] == "vectorized=":
+      vectorized = int(arg[11:]) != 0
+    elif arg[0:14] == "output_detail=":
+      output_detail = int(arg[14:])
+    else:
+      if output_detail > 0: print_and_flush ( "Unknown argument = " + str(arg) )
+  if output_detail > 10: print_and_flush ( "\n\n" )
+
+  if vectorized:
+    # The vectorized mode keeps each species in a NumPy array (and falls back to lists without NumPy)
+    try:
+      import numpy
+    except ImportError:
+      print_and_flush ( "NumPy is not available, running without vectorization" )
+      vectorized = False
+
+
+##### Use the Data Model to set up the simulation
 
-if output_detail > 10: print_and_flush ( "Arguments: " + str(sys.argv) )
+par_val_dict = {}
+iterations = 0
+time_step = 0
+mols = []
+rels = []
+rxns = []
 
-random.seed ( run_seed )
-seed_dir = "seed_%05d" % run_seed
+def convert_to_value ( expression ):
+  global par_val_dict
+  return eval(expression,globals(),par_val_dict)
 
-if len(data_model_file_name) > 0:
-  data_model_full_path = os.path.join ( proj_path, data_model_file_name )
+def setup_model ( dm ):
+  global par_val_dict, iterations, time_step, mols, rels, rxns
 
-print_and_flush ( "Project path = \"%s\", data_model_file_name = \"%s\"" % (proj_path, data_model_full_path) )
+  ## Start by building a parameter value dictionary
 
-##### Read in the data model itself
+  par_val_dict = {}
+  for p in dm['mcell']['parameter_system']['model_parameters']:
+    par_val_dict[p['par_name']] = p['_extras']['par_value']
 
-dm = None
-if len(data_model_full_path) > 0:
-  if output_detail > 0: print_and_flush ( "Loading data model from file: " + data_model_full_path + " ..." )
-  f = open ( data_model_full_path, 'r' )
-  pickle_string = f.read()
-  f.close()
-  dm = pickle.loads ( pickle_string.encode('latin1') )
+  if output_detail > 0:
+    print_and_flush ( "Parameter Dictionary: " + str(par_val_dict) )
+    for k in par_val_dict.keys():
+      print_and_flush ( "   " + str(k) + ": " + str(par_val_dict[k]) )
 
-if output_detail > 0: print_and_flush ( "Done loading CellBlender model." )
+  iterations = int(convert_to_value(dm['mcell']['initialization']['iterations']))
+  time_step = convert_to_value(dm['mcell']['initialization']['time_step'])
+  mols = dm['mcell']['define_molecules']['molecule_list']
+  rels = dm['mcell']['release_sites']['release_site_list']
 
-if dm is None:
-  print_and_flush ( "ERROR: Unable to use data model" )
-  sys.exit(1)
+  rxns = []
+  if 'define_reactions' in dm['mcell']:
+    if 'reaction_list' in dm['mcell']['define_reactions']:
+      if len(dm['mcell']['define_reactions']['reaction_list']) > 0:
+        rxns = dm['mcell']['define_reactions']['reaction_list']
 
-#print_and_flush ( str(dm) )
+def print_model ( ):
+  for m in mols:
+    if output_detail > 0: print_and_flush ( "Molecule " + m['mol_name'] + " is a " + m['mol_type'] + " molecule diffusing with " + str(m['diffusion_constant']) )
 
-##### Clear out the old data
+  for r in rels:
+    if output_detail > 0: print_and_flush ( "Release " + str(r['quantity']) + " of " + r['molecule'] + " at (" + str(r['location_x']) + "," + str(r['location_y']) + "," + str(r['location_z']) + ")"  )
 
-# Note that there have been some errors calling rmtree, which are currently being ignored:
-#  OSError: [Errno 16] Device or resource busy: '.nfs0000000000a48d3e00005e12'
-#  OSError: [Errno 39] Directory not empty: 'seed_00001'
+  for r in rxns:
+    arrow = '->'
+    bkwd = ''
+    if len(r['bkwd_rate']) > 0:
+      arrow = '<->'
+      bkwd = ", " + str(r['bkwd_rate'])
+    if output_detail > 0: print_and_flush ( "Reaction: " + r['reactants'] + " " + arrow + " " + r['products'] + "  [" + str(r['fwd_rate']) + bkwd + "]"  )
 
-react_dir = os.path.join(proj_path, "output_data", "react_data")
-if not os.path.exists(react_dir):
-    os.makedirs(react_dir)
 
-viz_dir = os.path.join(proj_path, "output_data", "viz_data")
-if not os.path.exists(viz_dir):
-    os.makedirs(viz_dir)
+def init_batch_worker ( dm, args ):
+  # Pool workers may not share the main process's globals (Windows starts new interpreters)
+  # Progress is reported by the main process as each seed completes, so the workers are quiet
+  global output_detail
+  output_detail = 0
+  parse_args ( [ arg for arg in args[1:] if not arg.startswith("output_detail=") ] )
+  setup_model ( dm )
 
-viz_seed_dir = os.path.join(viz_dir, seed_dir)
-if not os.path.exists(viz_seed_dir):
-    os.makedirs(viz_seed_dir)
 
-react_seed_dir = os.path.join(react_dir, seed_dir)
-if not os.path.exists(react_seed_dir):
-    os.makedirs(react_seed_dir)
+##### Run the simulation for one seed
 
-##### Use the Data Model to generate output files
+def simulate ( run_seed, iteration_prefix="" ):
 
-## Start by building a parameter value dictionary
+  random.seed ( run_seed )
+  if vectorized:
+    import numpy
+    rng = numpy.random.default_rng ( run_seed )
+  seed_dir = "seed_%05d" % run_seed
 
-par_val_dict = {}
-for p in dm['mcell']['parameter_system']['model_parameters']:
-  par_val_dict[p['par_name']] = p['_extras']['par_value']
+  ##### Clear out the old data
 
-if output_detail > 0:
-  print_and_flush ( "Parameter Dictionary: " + str(par_val_dict) )
-  for k in par_val_dict.keys():
-    print_and_flush ( "   " + str(k) + ": " + str(par_val_dict[k]) )
+  # Note that there have been some errors calling rmtree, which are currently being ignored:
+  #  OSError: [Errno 16] Device or resource busy: '.nfs0000000000a48d3e00005e12'
+  #  OSError: [Errno 39] Directory not empty: 'seed_00001'
 
-def convert_to_value ( expression ):
-  global par_val_dict
-  return eval(expression,globals(),par_val_dict)
+  react_dir = os.path.join(proj_path, "output_data", "react_data")
+  if not os.path.exists(react_dir):
+      os.makedirs(react_dir, exist_ok=True)
 
-iterations = int(convert_to_value(dm['mcell']['initialization']['iterations']))
-time_step = convert_to_value(dm['mcell']['initialization']['time_step'])
-mols = dm['mcell']['define_molecules']['molecule_list']
-rels = dm['mcell']['release_sites']['release_site_list']
+  viz_dir = os.path.join(proj_path, "output_data", "viz_data")
+  if not os.path.exists(viz_dir):
+      os.makedirs(viz_dir, exist_ok=True)
 
-rxns = []
-if 'define_reactions' in dm['mcell']:
-  if 'reaction_list' in dm['mcell']['define_reactions']:
-    if len(dm['mcell']['define_reactions']['reaction_list']) > 0:
-      rxns = dm['mcell']['define_reactions']['reaction_list']
-
-for m in mols:
-  if output_detail > 0: print_and_flush ( "Molecule " + m['mol_name'] + " is a " + m['mol_type'] + " molecule diffusing with " + str(m['diffusion_constant']) )
-
-for r in rels:
-  if output_detail > 0: print_and_flush ( "Release " + str(r['quantity']) + " of " + r['molecule'] + " at (" + str(r['location_x']) + "," + str(r['location_y']) + "," + str(r['location_z']) + ")"  )
-
-for r in rxns:
-  arrow = '->'
-  bkwd = ''
-  if len(r['bkwd_rate']) > 0:
-    arrow = '<->'
-    bkwd = ", " + str(r['bkwd_rate'])
-  if output_detail > 0: print_and_flush ( "Reaction: " + r['reactants'] + " " + arrow + " " + r['products'] + "  [" + str(r['fwd_rate']) + bkwd + "]"  )
-
-# Create instances for each molecule that is released (note that release patterns are not handled)
-
-for m in mols:
-  m['instances'] = []
-
-for r in rels:
-  rel_x = convert_to_value(r['location_x'])
-  rel_y = convert_to_value(r['location_y'])
-  rel_z = convert_to_value(r['location_z'])
-  q = int(convert_to_value(r['quantity']))
-  for m in mols:
-    if m['mol_name'] == r['molecule']:
-      for i in range(q):
-        x = rel_x  # +random.gauss(0.0,0.1)
-        y = rel_y  # +random.gauss(0.0,0.1)
-        z = rel_z  # +random.gauss(0.0,0.1)
-        m['instances'].append ( [x,y,z] )
-
-# Figure out the number of digits needed for file names
-
-ndigits = 1 + math.log(iterations+1,10)
-file_name_template = "Scene.cellbin.%%0%dd.dat" % ndigits
-
-# Create the count files for each molecule species (doesn't currently use the count specifications)
-
-count_files = {}
-
-for m in mols:
-  react_file_name = "%s/%s/%s.World.dat" % ( react_dir, seed_dir, m['mol_name'] )
-  count_files[m['mol_name']] = open(react_file_name,"w")
-
-
-# Begin the simulation
-
-print_every = math.pow(10,math.floor(math.log10((iterations/10))));
-if print_every < 1: print_every = 1;
-for i in range(iterations+1):
-  # Write the viz data (every iteration for now)
-  viz_file_name = file_name_template % i
-  viz_file_name = os.path.join(viz_seed_dir,viz_file_name)
-  if (i % print_every) == 0:
-    #if output_detail > 0: print_and_flush ( "File = " + viz_file_name )
-    if output_detail > 0: print_and_flush ( "Iteration %d of %d" % (i, iterations) )
-  f = open(viz_file_name,"wb")
-  int_array = array.array("I")   # Marker indicating a binary file
-  int_array.fromlist([1])
-  int_array.tofile(f)
-  for m in mols:
-    name = m['mol_name']
-    f.write(bytearray([len(name)]))       # Number of bytes in the name
-    for ni in range(len(name)):
-      f.write(bytearray([ord(name[ni])]))  # Each byte of the name
-    f.write(bytearray([0]))                # Molecule Type, 1=Surface, 0=Volume?
-
-    # Write out the total number of values for this molecule species
-    int_array = array.array("I")
-    int_array.fromlist([3*len(m['instances'])])
-    int_array.tofile(f)
-    
-    dc = convert_to_value(m['diffusion_constant'])
-    ds = math.sqrt(4.0 * 1.0e8 * dc * time_step)
-    for mi in m['instances']:
-      x = mi[0]
-      y = mi[1]
-      z = mi[2]
-      mol_pos = array.array("f")
-      mol_pos.fromlist ( [ x, y, z ] )
-      mol_pos.tofile(f)
-      mi[0] += random.gauss(0.0,ds) * 0.70710678118654752440
-      mi[1] += random.gauss(0.0,ds) * 0.70710678118654752440
-      mi[2] += random.gauss(0.0,ds) * 0.70710678118654752440
-  f.close()
-  # Write the count data (every iteration for now)
-  for m in mols:
-    name = m['mol_name']
-    count = len(m['instances'])
-    count_files[name].write ( "%.15g" % (i*time_step) + " " + str(count) + "\n" )
+  viz_seed_dir = os.path.join(viz_dir, seed_dir)
+  if not os.path.exists(viz_seed_dir):
+      os.makedirs(viz_seed_dir)
+
+  react_seed_dir = os.path.join(react_dir, seed_dir)
+  if not os.path.exists(react_seed_dir):
+      os.makedirs(react_seed_dir)
+
+  # Create instances for each molecule that is released (note that release patterns are not handled)
 
-  # Perform approximate decay reactions for now  (TODO: Make this realistic)
+  instances = {}
   for m in mols:
-    if len(m['instances']) > 0:
-      # There are some molecules left to react
-      for r in rxns:
-        if r['reactants'] == m['mol_name']:
-          # The reaction applies to this molecule
-          rate = convert_to_value(r['fwd_rate'])
-          fraction_to_remove = decay_rate_factor * rate * time_step
-          amount_to_remove = fraction_to_remove * len(m['instances'])
-          num_to_remove = int(amount_to_remove)
-          if random.random() < (amount_to_remove - num_to_remove):
-            num_to_remove += 1
-          if output_detail > 50: print_and_flush ( "React " + m['mol_name'] + " with rate = " + str(rate) + ", remove " + str(num_to_remove) + " (should be about " + str(100*fraction_to_remove) + "%)" )
-          for i in range(num_to_remove):
-            if len(m['instances']) > 0:
-              m['instances'].pop()
-
-
-for fname in count_files.keys():
-  count_files[fname].close()
-
-if output_detail > 0: print_and_flush ( "Done simulation.\n" );
+    instances[m['mol_name']] = []
+
+  for r in rels:
+    rel_x = convert_to_value(r['location_x'])
+    rel_y = convert_to_value(r['location_y'])
+    rel_z = convert_to_value(r['location_z'])
+    q = int(convert_to_value(r['quantity']))
+    for m in mols:
+      if m['mol_name'] == r['molecule']:
+        for i in range(q):
+          x = rel_x  # +random.gauss(0.0,0.1)
+          y = rel_y  # +random.gauss(0.0,0.1)
+          z = rel_z  # +random.gauss(0.0,0.1)
+          instances[m['mol_name']].append ( [x,y,z] )
+
+  if vectorized:
+    # Store the instances of each species as an (N,3) array
+    for name in instances.keys():
+      instances[name] = numpy.array ( instances[name], dtype=numpy.float64 ).reshape ( (-1,3) )
+
+  # Figure out the number of digits needed for file names
 
+  ndigits = 1 + math.log(iterations+1,10)
+  file_name_template = "Scene.cellbin.%%0%dd.dat" % ndigits
+
+  # Create the count files for each molecule species (doesn't currently use the count specifications)
+
+  count_files = {}
+
+  for m in mols:
+    react_file_name = "%s/%s/%s.World.dat" % ( react_dir, seed_dir, m['mol_name'] )
+    count_files[m['mol_name']] = open(react_file_name,"w")
+
+
+  # Begin the simulation
+
+  print_every = math.pow(10,math.floor(math.log10((iterations/10))));
+  if print_every < 1: print_every = 1;
+  for i in range(iterations+1):
+    # Write the viz data (every iteration for now)
+    viz_file_name = file_name_template % i
+    viz_file_name = os.path.join(viz_seed_dir,viz_file_name)
+    if (i % print_every) == 0:
+      #if output_detail > 0: print_and_flush ( "File = " + viz_file_name )
+      if output_detail > 0: print_and_flush ( iteration_prefix + "Iteration %d of %d" % (i, iterations) )
+    f = open(viz_file_name,"wb")
+    int_array = array.array("I")   # Marker indicating a binary file
+    int_array.fromlist([1])
+    int_array.tofile(f)
+    index_species = []
+    for m in mols:
+      name = m['mol_name']
+      if vectorized:
+        dc = convert_to_value(m['diffusion_constant'])
+        ds = math.sqrt(4.0 * 1.0e8 * dc * time_step)
+        mol_pos = instances[name]
+        if write_viz_index:
+          bbox = None
+          if len(mol_pos) > 0:
+            bbox = [ mol_pos.min(axis=0).tolist(), mol_pos.max(axis=0).tolist() ]
+          index_species.append ( { 'name':name, 'offset':f.tell(), 'mol_type':0, 'count':len(mol_pos), 'bbox':bbox } )
+        # Write the name, type, number of values and positions of the species with a single write
+        name_bytes = name.encode('latin1')
+        header = bytearray([len(name_bytes)]) + name_bytes + bytearray([0]) + numpy.array([3*len(mol_pos)],dtype=numpy.uint32).tobytes()
+        f.write ( header + mol_pos.astype(numpy.float32).tobytes() )
+        # Move all of the molecules at once
+        mol_pos += rng.normal ( 0.0, ds, mol_pos.shape ) * 0.70710678118654752440
+        continue
+      if write_viz_index:
+        # Record the block location and bounds in the format of mol_viz_io's ".cbidx" files
+        bbox = None
+        if len(instances[name]) > 0:
+          bbox = [ [ min([mi[c] for mi in instances[name]]) for c in range(3) ],
+                   [ max([mi[c] for mi in instances[name]]) for c in range(3) ] ]
+        index_species.append ( { 'name':name, 'offset':f.tell(), 'mol_type':0, 'count':len(instances[name]), 'bbox':bbox } )
+      f.write(bytearray([len(name)]))       # Number of bytes in the name
+      for ni in range(len(name)):
+        f.write(bytearray([ord(name[ni])]))  # Each byte of the name
+      f.write(bytearray([0]))                # Molecule Type, 1=Surface, 0=Volume?
+
+      # Write out the total number of values for this molecule species
+      int_array = array.array("I")
+      int_array.fromlist([3*len(instances[name])])
+      int_array.tofile(f)
+
+      dc = convert_to_value(m['diffusion_constant'])
+      ds = math.sqrt(4.0 * 1.0e8 * dc * time_step)
+      for mi in instances[name]:
+        x = mi[0]
+        y = mi[1]
+        z = mi[2]
+        mol_pos = array.array("f")
+        mol_pos.fromlist ( [ x, y, z ] )
+        mol_pos.tofile(f)
+        mi[0] += random.gauss(0.0,ds) * 0.70710678118654752440
+        mi[1] += random.gauss(0.0,ds) * 0.70710678118654752440
+        mi[2] += random.gauss(0.0,ds) * 0.70710678118654752440
+    file_size = f.tell()
+    f.close()
+    if write_viz_index:
+      f = open(viz_file_name+".cbidx","w")
+      json.dump ( { 'cbidx_version':1, 'viz_version':1, 'file_size':file_size, 'species':index_species }, f, separators=(',',':') )
+      f.close()
+    # Write the count data (every iteration for now)
+    for m in mols:
+      name = m['mol_name']
+      count = len(instances[name])
+      count_files[name].write ( "%.15g" % (i*time_step) + " " + str(count) + "\n" )
+
+    # Perform approximate decay reactions for now  (TODO: Make this realistic)
+    for m in mols:
+      name = m['mol_name']
+      if len(instances[name]) > 0:
+        # There are some molecules left to react
+        for r in rxns:
+          if r['reactants'] == name:
+            # The reaction applies to this molecule
+            rate = convert_to_value(r['fwd_rate'])
+            fraction_to_remove = decay_rate_factor * rate * time_step
+            amount_to_remove = fraction_to_remove * len(instances[name])
+            if vectorized:
+              # Each molecule decays independently with the fraction as its probability
+              num_to_remove = int ( rng.binomial ( len(instances[name]), min(max(fraction_to_remove,0.0),1.0) ) )
+            else:
+              num_to_remove = int(amount_to_remove)
+              if random.random() < (amount_to_remove - num_to_remove):
+                num_to_remove += 1
+            if output_detail > 50: print_and_flush ( "React " + name + " with rate = " + str(rate) + ", remove " + str(num_to_remove) + " (should be about " + str(100*fraction_to_remove) + "%)" )
+            if vectorized:
+              instances[name] = instances[name][0:max(len(instances[name])-num_to_remove,0)]
+            else:
+              for n in range(num_to_remove):
+                if len(instances[name]) > 0:
+                  instances[name].pop()
+
+
+  for fname in count_files.keys():
+    count_files[fname].close()
+
+  return run_seed
+
+
+if __name__ == "__main__":
+
+  parse_args ( sys.argv )
+
+  if output_detail > 0:
+    print_and_flush ( "**********************************************" )
+    print_and_flush ( "*  Limited Pure Python Prototype Simulation  *" )
+    print_and_flush ( "*          Updated: July 19th, 2017          *" )
+    print_and_flush ( "**********************************************" )
+    print_and_flush ( "" )
+    print_and_flush ( "Running with Python:" )
+    print_and_flush ( sys.version )
+    print_and_flush ( "" )
+
+  if output_detail > 10: print_and_flush ( "Arguments: " + str(sys.argv) )
+
+  if len(data_model_file_name) > 0:
+    data_model_full_path = os.path.join ( proj_path, data_model_file_name )
+
+  print_and_flush ( "Project path = \"%s\", data_model_file_name = \"%s\"" % (proj_path, data_model_full_path) )
+
+  ##### Read in the data model itself
+
+  dm = None
+  if len(data_model_full_path) > 0:
+    if output_detail > 0: print_and_flush ( "Loading data model from file: " + data_model_full_path + " ..." )
+    f = open ( data_model_full_path, 'r' )
+    pickle_string = f.read()
+    f.close()
+    dm = pickle.loads ( pickle_string.encode('latin1') )
+
+  if output_detail > 0: print_and_flush ( "Done loading CellBlender model." )
+
+  if dm is None:
+    print_and_flush ( "ERROR: Unable to use data model" )
+    sys.exit(1)
+
+  #print_and_flush ( str(dm) )
+
+  setup_model ( dm )
+  print_model ( )
+
+  if seed_list is None:
+    simulate ( run_seed )
+  else:
+    # Batch mode: the data model is only read once for all of the seeds
+    num_done = 0
+    if (num_processes <= 1) or (len(seed_list) <= 1):
+      for seed in seed_list:
+        simulate ( seed, "Seed %d: " % seed )
+        num_done += 1
+        print_and_flush ( "Completed %d of %d seeds" % (num_done, len(seed_list)) )
+    else:
+      pool = multiprocessing.Pool ( processes=min(num_processes,len(seed_list)), initializer=init_batch_worker, initargs=(dm, sys.argv) )
+      for seed in pool.imap_unordered ( simulate, seed_list ):
+        num_done += 1
+        print_and_flush ( "Completed %d of %d seeds (seed %d)" % (num_done, len(seed_list), seed) )
+      pool.close()
+      pool.join()
+
+  if output_detail > 0: print_and_flush ( "Done simulation.\n" );
@@ -20,15 +20,55 @@
 
 from . import mdlmesh_parser
 from . import import_shared
+from . import mdlobj
+from ...mdl import geometry_sidecar
+
+
+def load_sidecars(filepath):
+    """ Return mdlObjects read from the binary geometry sidecars named in an MDL file """
+
+    mdlobjs = []
+    for name, sidecar_path in geometry_sidecar.find_sidecars(filepath):
+        try:
+            sc = geometry_sidecar.read_sidecar(sidecar_path)
+        except (OSError, ValueError) as e:
+            print("Unable to read binary geometry for %s (%s)" % (name, str(e)))
+            continue
+        obj = mdlobj.mdlObject(sc['name'])
+        obj.set_vertices(geometry_sidecar.group_rows(sc['vertices']))
+        obj.set_faces(geometry_sidecar.group_rows(sc['faces']))
+        regions = {}
+        for reg_name, reg_faces in sc['regions']:
+            reg = mdlobj.objRegion(reg_name)
+            reg.set_faces(reg_faces.tolist())
+            regions[reg_name] = reg
+        obj.set_regions(regions)
+        mdlobjs.append(obj)
+    return mdlobjs
+
+
+def count_polygon_lists(filepath):
+    with open(filepath, 'r') as f:
+        return sum([1 for line in f if 'POLYGON_LIST' in line])
 
 
 def load(operator, context, filepath="", add_to_model_objects=True):
 
+    obj_mat, reg_mat = import_shared.create_materials()
+
+    # Objects with binary geometry sidecars don't need their MDL text parsed
+    sidecar_objs = load_sidecars(filepath)
+    for sidecar_obj in sidecar_objs:
+        import_shared.import_obj(sidecar_obj, obj_mat, reg_mat, add_to_model_objects)
+    imported = set([sidecar_obj.name for sidecar_obj in sidecar_objs])
+    if (len(imported) > 0) and (count_polygon_lists(filepath) <= len(imported)):
+        print("Imported %d objects from binary geometry in \'%s\'" % (len(imported), filepath))
+        return {'FINISHED'}
+
     print("Calling mdlmesh_parser.mdl_parser(\'%s\')..." % (filepath))
     root_mdlobj = mdlmesh_parser.mdl_parser(filepath)
     print("Done calling mdlmesh_parser.mdl_parser(\'%s\')" % (filepath))
 
-    obj_mat, reg_mat = import_shared.create_materials()
     mdlobj = root_mdlobj
     while not mdlobj is None:
         if mdlobj.object_type == 0:
@@ -37,7 +77,8 @@ def load(operator, context, filepath="", add_to_model_objects=True):
             mdlobj = mdlobj.first_child
         else:
             # POLY_OBJ
-            import_shared.import_obj(mdlobj, obj_mat, reg_mat, add_to_model_objects)
+            if not (mdlobj.name in imported):
+                import_shared.import_obj(mdlobj, obj_mat, reg_mat, add_to_model_objects)
 
             mdlobj = mdlobj.next
             if mdlobj is None:
@@ -2,206 +2,546 @@
 
 import sys
 import os
-if sys.version_info.major == 3:
-  from queue import Queue, Empty
-else:
-  from Queue import Queue, Empty
 import threading
-import subprocess as sp
 import time
+import asyncio
+import asyncio.subprocess as asp
+import collections
+import itertools
+import tempfile
+import shutil
+import array
+import json
+try:
+  # Used to sample the memory of tasks where /proc isn't available
+  import psutil
+except ImportError:
+  psutil = None
 
 '''
 #################################
 
-First useful attempt at a Set of classes for managing processes via a Queue and ThreadWorkers
-The goal is to manage some number of  tasks to be run concurrently by N threadworkers
-and capture the stdout and stderr of each task.
+Set of classes for managing processes and capturing the stdout and stderr of each task.
+The goal is to run some number of tasks concurrently within budgets of cores and memory.
 
 Two main classes are defined:
 
-1) The OutputQueue class allows the management of the stdout and stderr streams of individual tasks wrapped by run_wrapper.py
-   a) NB: run_wrapper.py is a python script that waits for the command string and argument string to be sent on stdin.
+1) The TaskLog class holds the output of a task in a ring buffer of recent lines (spilling to disk when it overflows)
 
-2) The SimQueue class manages all the tasks and threadworkers that process the tasks.
+2) The SimQueue class manages all the tasks with a single supervisor thread running an asyncio event loop.
    a) each task is a dictionary containing:
-      i) a Popen object for a run_wrapper.py process which waits in idle for the command and args to be sent to its stdin
-     ii) all the other task attributes
+      i) the process of the task (None until the task is started, which only happens when it fits into the budgets)
+     ii) the TaskLog of the task
+    iii) all the other task attributes
+   b) each task's command is started directly (make_cmd_list parses its command and argument strings)
+   c) the stdout and stderr pipes of all running tasks are multiplexed on the one event loop,
+      so no threads or interpreters are needed per task
 
 #################################
 '''
 
+# Maximum number of lines of output kept in memory (and in the Blender text) for each task
+DEFAULT_MAX_OUTPUT_LINES = 10000
+
+# Spilled log files record the byte offset of every LOG_INDEX_STRIDE'th line for paging
+LOG_INDEX_STRIDE = 256
+
+# Number of the most recent lines of each task's standard error kept to show its errors
+ERROR_TAIL_LINES = 20
+
+# Seconds between updates of the Blender texts mirroring task logs
+TEXT_UPDATE_INTERVAL = 0.5
+
+# Longest line read from a task as a single line (longer lines are split)
+MAX_LINE_BYTES = 1024*1024
+
+# Fraction of physical memory that running tasks may use when no memory limit is given
+DEFAULT_MEMORY_FRACTION = 0.9
+
+# Memory estimates learned from earlier runs are padded by this factor when admitting tasks
+MEMORY_ESTIMATE_MARGIN = 1.2
+
+# Seconds between samples of the peak memory of running tasks
+MEMORY_SAMPLE_INTERVAL = 1.0
+
+# Seconds a task must have run before its peak memory is used as an estimate for other runs
+MEMORY_PROBE_TIME = 10.0
+
+# File in the output_data directory of a model holding the peak memory of its latest run
+MEMORY_ESTIMATE_FILE = 'task_memory.json'
+
+# Seconds to wait for terminated tasks to exit when shutting down
+SHUTDOWN_TIMEOUT = 5.0
+
+
+def is_windows ():
+
+    if os.name.startswith('posix'):
+      return False
+    if os.name.startswith('nt'):
+      return True
+
+    if sys.platform.startswith('win'):
+      return True
+    if sys.platform.startswith('cygwin'):
+      return True
+    if sys.platform.startswith('linux'):
+      return False
+    if sys.platform.startswith('darwin'):
+      return False
+    if sys.platform.startswith('freebsd'):
+      return False
+    if sys.platform.startswith('sunos'):
+      return False
+
+
+def parse_quoted_args_posix ( s ):
+    # Turn a string of quoted arguments into a list of arguments
+    # This code handles escaped quotes (\") and escaped backslashes (\\)
+    args = []
+    next = ""
+    inquote = False
+    escaped = False
+    i = 0
+    while i < len(s):
+        if s[i] == '"':
+            if escaped:
+                next += '"'
+                escaped = False
+            else:
+                if inquote:
+                    args.append ( next )
+                    next = ""
+                inquote = not inquote
+        elif s[i] == '\\':
+            if escaped:
+                next += '\\'
+                escaped = False
+            else:
+                escaped = True
+        else:
+            if inquote:
+                next += s[i]
+        i += 1
+    if len(next) > 0:
+        args.append ( next )
+    return args
+
+
+def parse_quoted_args_windows ( s ):
+    # Turn a string of quoted arguments into a list of arguments
+    args = []
+    next = ""
+    inquote = False
+    i = 0
+    while i < len(s):
+        if s[i] == '"':
+            if inquote:
+                args.append ( next )
+                next = ""
+            inquote = not inquote
+        else:
+            if inquote:
+                next += s[i]
+        i += 1
+    if len(next) > 0:
+        args.append ( next )
+    return args
+
+
+def convert_for_windows ( cmds ):
+    wcmds = []
+    for cmd in cmds:
+        if cmd.upper().startswith ( "C:" ):
+            wcmds.append ( "c:\\" + cmd[2:] )
+        else:
+            wcmds.append ( cmd )
+    return ( wcmds )
 
-# class for managing stdout and stderr streams of a running task wrapped by run_wrapper.py
-class OutputQueue:
-  def __init__(self):
-    self.out_q = Queue(maxsize=0)
-    self.err_q = Queue(maxsize=0)
-
-  # Process stdout or stderr pipes of running process (e.g. typically capture the output and copy onto a queue or append to list)
-  def read_output(self, pipe, funcs):
-    for line in iter(pipe.readline, b''):
-      line = line.decode('utf-8')
-      for func in funcs:
-        func(line)  # execute the func: possible values: 1) the Queue.put function; 2) the list.append function
-    pipe.close()
 
-  # Get strings found in the out_q or err_q and write to sys.stdout or sys.stderr, also copy to a bl_text if not None)
-  def write_output(self, get, pipe, output_list=None, bl_text=None, e_bl_text_quit=None):
-    if bl_text != None:
-      import bpy
-    for line in iter(get, None):
-      pipe.write(line)
-      pipe.flush()
-      if output_list != None:
-        output_list.append ( line )
-      if bl_text != None:
-        bl_text_quit = False
-        if e_bl_text_quit != None:
-          bl_text_quit = e_bl_text_quit.isSet()
-        if not bl_text_quit:
-          try:
-            bl_text.write(line)
-            bl_text.current_line_index=len(bl_text.lines)-1
-          except:
+def flatten_list ( l, f ):
+    # Recursive function to flatten a list of lists into a single list
+    for i in l:
+        if type(i) == type([]):
+            flatten_list(i, f)
+        else:
+            f.append ( i )
+
+
+def physical_memory ():
+    """ Return the physical memory of this machine in bytes (None if it can't be found) """
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def peak_memory ( pid ):
+    """ Return the peak (or current) resident memory of a process in bytes (None where this isn't available)
+
+    Linux reports the peak in /proc. Elsewhere psutil (if installed) gives the peak
+    working set on Windows and the current resident size on other systems (the
+    caller keeps the largest sample).
+    """
+    try:
+        with open ( '/proc/%d/status' % pid ) as f:
+            for line in f:
+                if line.startswith ( 'VmHWM:' ):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    if psutil is not None:
+        try:
+            info = psutil.Process(pid).memory_info()
+            return getattr ( info, 'peak_wset', info.rss )
+        except (psutil.Error, OSError):
             pass
+    return None
 
-  # Recursive function to flatten a list of lists into a single list
-  def flatten_list ( self, l, f ):
-      for i in l:
-          if type(i) == type([]):
-              self.flatten_list(i, f)
-          else:
-              print ( " item: " + str(i) )
-              f.append ( i )
-      print ( "flattened so far: " + str(f) )
 
+memory_sampling = None
 
-  # In passthrough mode, set up threadworkers and queues to manage stdout and stderr of task and send command string and args to run_wrapper.py process
-  # Otherwise just do proc.communicate() and capture stdout and stderr upon command completion (possibly broken functionality?)
-  def run_proc(self, proc, arg_in=None, passthrough=True, output_list=None, bl_text=None, e_bl_text_quit=None):
+def can_sample_memory ():
+    """ Return True if the memory of processes can be sampled on this system """
+    global memory_sampling
+    if memory_sampling is None:
+        memory_sampling = peak_memory(os.getpid()) is not None
+    return memory_sampling
 
-    if bl_text != None:
-      import bpy
 
-    if passthrough:
-
-      outs, errs = [], []
-
-      stdout_reader_thread = threading.Thread(
-          target=self.read_output, args=(proc.stdout, [self.out_q.put, outs.append])
-          )
-
-      stderr_reader_thread = threading.Thread(
-          target=self.read_output, args=(proc.stderr, [self.err_q.put, errs.append])
-          )
-
-      stdout_writer_thread = threading.Thread(
-          target=self.write_output, args=(self.out_q.get, sys.stdout, output_list, bl_text, e_bl_text_quit)
-          )
-
-      stderr_writer_thread = threading.Thread(
-          target=self.write_output, args=(self.err_q.get, sys.stderr, output_list, bl_text, e_bl_text_quit)
-          )
-
-      for t in (stdout_reader_thread, stderr_reader_thread, stdout_writer_thread, stderr_writer_thread):
-        t.daemon = True
-        t.start()
-
-      if arg_in:
-        sys.stdout.write('run_proc in sim_runner_queue.py with arg_in = ' + str(arg_in) + '\n')
-        sys.stdout.write('run_proc in sim_runner_queue.py with args:\n')
-        for arg in arg_in:
-          char_stream = ""
-          if type(arg) == type([]):
-            # Convert the list to quoted argument format
-            flat_arg = []
-            self.flatten_list ( arg, flat_arg );
-            for a in flat_arg:
-              char_stream += '"' + a + '" '
-            if len(char_stream) > 0:
-              char_stream = char_stream[0:-1]
-            # Convert the list to a string (for now) by joining
-            # char_stream = ' '.join ( arg )
-          else:
-            # Use previous string format
-            char_stream = arg
-          sys.stdout.write('  arg: ' + str(char_stream) + '\n')
-#          sys.stdout.write('run_proc sending: {0}\n'.format(arg).encode().decode())
-          proc.stdin.write('{0}\n'.format(char_stream).encode())
-          proc.stdin.flush()
-      proc.wait()
-
-      for t in (stdout_reader_thread, stderr_reader_thread):
-        t.join()
-
-      self.out_q.put(None)
-      self.err_q.put(None)
-
-      for t in (stdout_writer_thread, stderr_writer_thread):
-        t.join()
-
-      outs = ' '.join(outs)
-      errs = ' '.join(errs)
+def make_cmd_list ( cmd, args ):
+    """ Build the argument list for a command and arguments given as strings or (nested) lists
 
+    A string that's entirely quoted is a list of quoted arguments, otherwise a command
+    string is the command itself and an argument string is split on white space.
+    """
+    if is_windows():
+        parse_quoted_args = parse_quoted_args_windows
     else:
-
-      outs, errs = proc.communicate()
-      outs = '' if outs == None else outs.decode('utf-8')
-      errs = '' if errs == None else errs.decode('utf-8')
-
-    rc = proc.returncode
-
-    return (rc, (outs, errs))
+        parse_quoted_args = parse_quoted_args_posix
+    cmd_list = []
+    for part, split in ( (cmd, False), (args, True) ):
+        if type(part) == type([]):
+            flatten_list ( part, cmd_list )
+        elif (len(part.strip()) > 0) and (part.strip()[0] == '"') and (part.strip()[-1] == '"'):
+            cmd_list.extend ( parse_quoted_args(part.strip()) )
+        elif split:
+            cmd_list.extend ( part.split() )
+        else:
+            cmd_list.append ( part )
+    if is_windows():
+        cmd_list = convert_for_windows ( cmd_list )
+    return cmd_list
+
+
+class TaskLog:
+  """ The output lines of a task, numbered from 0 in the order they were written
+
+  The most recent max_lines lines are kept in a ring buffer. If a spill_path is given,
+  the log is copied to that file the first time the ring buffer overflows, and all later
+  lines are appended to it, so older lines can still be paged through with get_lines and tail.
+  All methods may be called from any thread.
+  """
+
+  def __init__(self, max_lines=DEFAULT_MAX_OUTPUT_LINES, spill_path=None):
+    self.max_lines = max_lines
+    self.spill_path = spill_path
+    self.ring = collections.deque(maxlen=max_lines)
+    self.num_lines = 0
+    self.spill_file = None
+    self.spilled = False
+    self.spill_bytes = 0
+    self.spill_index = array.array('q')   # Byte offset of every LOG_INDEX_STRIDE'th line in the spill file
+    self.lock = threading.Lock()
+
+  def __len__(self):
+    return self.num_lines
+
+  def append(self, line):
+    with self.lock:
+      if (not self.spilled) and (self.spill_path is not None) and (len(self.ring) == self.max_lines):
+        # The oldest line is about to be dropped, so start keeping the whole log on disk
+        self.spill_file = open(self.spill_path, 'wb')
+        self.spilled = True
+        for line_num, old_line in enumerate(self.ring):
+          self.write_spill(line_num, old_line)
+      if self.spill_file is not None:
+        self.write_spill(self.num_lines, line)
+      self.ring.append(line)
+      self.num_lines += 1
+
+  def write_spill(self, line_num, line):
+    if (line_num % LOG_INDEX_STRIDE) == 0:
+      self.spill_index.append(self.spill_bytes)
+    if not line.endswith('\n'):
+      line += '\n'
+    data = line.encode('utf-8')
+    self.spill_file.write(data)
+    self.spill_bytes += len(data)
+
+  def first_line(self):
+    """ Return the number of the oldest line that's still available """
+    if self.spilled:
+      return 0
+    return self.num_lines - len(self.ring)
+
+  def get_lines(self, start, stop=None):
+    """ Return the available lines numbered from start up to (not including) stop """
+    with self.lock:
+      if (stop is None) or (stop > self.num_lines):
+        stop = self.num_lines
+      start = max(start, self.first_line())
+      ring_start = self.num_lines - len(self.ring)
+      lines = []
+      if start < min(stop, ring_start):
+        lines = self.read_spill(start, min(stop, ring_start))
+      if stop > ring_start:
+        lines.extend(itertools.islice(self.ring, max(start, ring_start) - ring_start, stop - ring_start))
+      return lines
+
+  def read_spill(self, start, stop):
+    # The lock must be held by the caller
+    if self.spill_file is not None:
+      self.spill_file.flush()
+    lines = []
+    with open(self.spill_path, 'rb') as f:
+      block = start // LOG_INDEX_STRIDE
+      f.seek(self.spill_index[block])
+      for line_num in range(block * LOG_INDEX_STRIDE, stop):
+        line = f.readline()
+        if line_num >= start:
+          lines.append(line.decode('utf-8', errors='replace'))
+    return lines
+
+  def tail(self, count=None, skip=0):
+    """ Return the last count lines (all lines in memory if count is None) before the last skip lines """
+    stop = self.num_lines - skip
+    if count is None:
+      start = self.num_lines - len(self.ring)
+    else:
+      start = stop - count
+    return self.get_lines(max(start, 0), stop)
+
+  def find_last(self, prefix):
+    """ Return the most recent line in memory that starts with prefix (or None) """
+    with self.lock:
+      for line in reversed(self.ring):
+        if line.startswith(prefix):
+          return line
+    return None
+
+  def text(self):
+    """ Return the lines in memory as a single string """
+    with self.lock:
+      return ''.join(self.ring)
+
+  def finish(self):
+    """ Close the spill file for writing (no more lines will be added) """
+    with self.lock:
+      if self.spill_file is not None:
+        self.spill_file.close()
+        self.spill_file = None
+
+  def close(self):
+    """ Finish the log and remove its spill file """
+    self.finish()
+    with self.lock:
+      if self.spilled and os.path.exists(self.spill_path):
+        os.remove(self.spill_path)
+      self.spilled = False
+      self.ring.clear()
 
 
 class SimQueue:
-  def __init__(self, python_path):
-    self.work_q = Queue(maxsize=0)
-    self.workers = []
+  """ Run queued tasks within core and memory budgets, supervised by a single event loop thread.
+
+  Tasks are only launched when they fit, so queued tasks hold no process at all. Each task
+  uses a number of cores (at most n_threads are in use at once) and an estimate of its memory
+  (the total is kept below max_memory). Memory estimates are the peak memory of earlier runs
+  of the same model (tasks added with the same model_dir), which is saved in the model's
+  output_data directory (so it's kept between sessions), or of the runs of the model that
+  are in progress. Until there is an estimate, only one task
+  of a model is run (for MEMORY_PROBE_TIME seconds). Where memory can't be sampled, tasks
+  are only limited by cores. Tasks with a higher priority start first, and tasks of equal priority
+  are shared fairly between groups (such as the runs of each sweep).
+  The stdout and stderr pipes of every running task are read by coroutines on the same
+  asyncio event loop into a TaskLog for each task. Logs keep max_output_lines lines in
+  memory and spill to files in log_dir (a temporary directory by default) beyond that.
+  Blender texts for tasks are updated from the logs by a timer on Blender's main thread.
+  """
+
+  def __init__(self, python_path, max_output_lines=DEFAULT_MAX_OUTPUT_LINES):
     self.task_dict = {}
-    self.n_threads = 0
+    self.pending = []                    # task ids waiting to fit into the budgets
+    self.running = {}                    # task id -> task for tasks that have been started
+    self.n_threads = 0                   # Number of cores that tasks may use at once
+    self.max_memory = None               # Bytes of memory that tasks may use at once (None for most of physical memory)
+    self.cores_in_use = 0
+    self.group_running = collections.Counter()
+    self.memory_estimates = {}           # model_dir -> peak memory of its runs in bytes (None if unknown)
+    self.next_task_id = 1
+    self.max_output_lines = max_output_lines
+    self.log_dir = None
+    self.own_log_dir = False
+    self.text_timer_running = False
+    self.lock = threading.Lock()
+    self.loop = None
+    self.loop_thread = None
     self.evnt_bl_text_quit = threading.Event()
     self.python_exec = python_path
-    module_dir_path = os.path.dirname(os.path.realpath(__file__))
-    module_file_path = os.path.join(module_dir_path, 'run_wrapper.py')
-    self.run_wrapper = module_file_path
     self.notify = False
 
-  def start(self,n_threads):
-    if n_threads > self.n_threads:
-      for i in range(n_threads - self.n_threads):
-        worker = threading.Thread(target=self.run_q_item, name=str(i))
-        worker.daemon = True
-        self.workers.append(worker)
-        worker.start()
-    elif n_threads < self.n_threads:
-      for i in range(self.n_threads - n_threads):
-        self.work_q.put(None) # This is a signal for the thread to exit
-    self.n_threads = n_threads
-
-  def run_q_item(self):
-    while True:
-      task = self.work_q.get()
-      if task == None:
-        self.work_q.task_done()
+  def start(self,n_threads,max_memory=None):
+    if self.loop is None:
+      self.loop = asyncio.new_event_loop()
+      self.loop_thread = threading.Thread(target=self.run_loop, name='sim_queue_loop')
+      self.loop_thread.daemon = True
+      self.loop_thread.start()
+    with self.lock:
+      self.n_threads = n_threads
+      self.max_memory = max_memory
+    self.loop.call_soon_threadsafe(self.launch_pending)
+
+  def run_loop(self):
+    asyncio.set_event_loop(self.loop)
+    self.loop.run_forever()
+    self.loop.close()
+
+  def launch_pending(self):
+    # Runs on the event loop thread: start queued tasks while they fit into the budgets
+    with self.lock:
+      self.pending = [ pid for pid in self.pending if self.task_dict.get(pid, {}).get('status') == 'queued' ]
+      to_run = []
+      task = self.next_task()
+      while task is not None:
+        self.pending.remove(task['pid'])
+        task['status'] = 'running'
+        task['start_time'] = time.time()
+        self.running[task['pid']] = task
+        self.cores_in_use += task['cores']
+        self.group_running[task['group']] += 1
+        to_run.append(task)
+        task = self.next_task()
+    for task in to_run:
+      self.loop.create_task(self.run_task(task))
+
+  def next_task(self):
+    # The lock must be held by the caller
+    # Lower priority tasks may not start while a higher priority task is waiting for resources
+    blocked_priority = None
+    order = lambda pid: ( -self.task_dict[pid]['priority'], self.group_running[self.task_dict[pid]['group']], pid )
+    for pid in sorted(self.pending, key=order):
+      task = self.task_dict[pid]
+      if (blocked_priority is not None) and (task['priority'] < blocked_priority):
         break
-
-      process = task['process']
-      pid = process.pid
-      cmd = task['cmd']
-      args = task['args']
-      bl_t = task['bl_text']
-      if self.notify:
-        sys.stdout.write('Starting PID {0} {1}\n'.format(pid, cmd))
-      out_q = OutputQueue()
-#      sys.stdout.write('sending:  {0}\n'.format(cmd).encode().decode())
-      task['status'] = 'running'
-      self.task_dict[pid]['output'] = []
-      rc, res = out_q.run_proc(process, arg_in=[cmd, args], passthrough=self.notify, output_list=self.task_dict[pid]['output'], bl_text=bl_t, e_bl_text_quit=self.evnt_bl_text_quit)
-      self.task_dict[pid]['stdout'] = res[0]
-      self.task_dict[pid]['stderr'] = res[1]
-#      self.task_dict[pid]['text'].write(res[0])
-#      self.task_dict[pid]['text'].write(res[1])
+      if self.task_fits(task):
+        return task
+      if blocked_priority is None:
+        blocked_priority = task['priority']
+    return None
+
+  def task_fits(self, task):
+    # The lock must be held by the caller
+    if len(self.running) == 0:
+      # Always run something, even if it's larger than the budgets
+      return True
+    if self.cores_in_use + task['cores'] > self.n_threads:
+      return False
+    estimate = self.memory_estimate(task['model_dir'])
+    if estimate is None:
+      if not can_sample_memory():
+        # There will never be an estimate, so only the cores limit the tasks
+        return True
+      # Only run one task of a model at a time until its memory use is known
+      return len([ t for t in self.running.values() if (t['model_dir'] == task['model_dir']) ]) == 0
+    max_memory = self.max_memory
+    if max_memory is None:
+      max_memory = physical_memory()
+      if max_memory is None:
+        return True
+      max_memory *= DEFAULT_MEMORY_FRACTION
+    memory_in_use = 0
+    for t in self.running.values():
+      t_estimate = self.memory_estimate(t['model_dir'])
+      memory_in_use += max ( t['peak_memory'], 0 if t_estimate is None else t_estimate )
+    return memory_in_use + estimate <= max_memory
+
+  def memory_estimate(self, model_dir):
+    # The lock must be held by the caller
+    # Returns the padded memory estimate for a run of a model (0 for tasks without a model)
+    if model_dir is None:
+      return 0
+    peak = self.memory_estimates.get(model_dir)
+    probe_start = time.time() - MEMORY_PROBE_TIME
+    for t in self.running.values():
+      if (t['model_dir'] == model_dir) and (t['peak_memory'] > 0) and (t['start_time'] < probe_start):
+        peak = max ( t['peak_memory'], 0 if peak is None else peak )
+    if peak is None:
+      return None
+    return int(peak * MEMORY_ESTIMATE_MARGIN)
+
+  def memory_estimate_file(self, model_dir):
+    return os.path.join(model_dir, 'output_data', MEMORY_ESTIMATE_FILE)
+
+  def load_memory_estimate(self, model_dir):
+    peak = None
+    try:
+      with open(self.memory_estimate_file(model_dir)) as f:
+        peak = int(json.load(f)['peak_memory'])
+    except (OSError, ValueError, KeyError, TypeError):
+      pass
+    with self.lock:
+      self.memory_estimates.setdefault(model_dir, peak)
+
+  def save_memory_estimate(self, model_dir, peak):
+    # The latest run replaces the estimate, so one unusually large run doesn't throttle the model for good
+    with self.lock:
+      self.memory_estimates[model_dir] = peak
+    file_name = self.memory_estimate_file(model_dir)
+    try:
+      os.makedirs(os.path.dirname(file_name), exist_ok=True)
+      with open(file_name + '.tmp', 'w') as f:
+        json.dump({'peak_memory': peak}, f)
+      os.replace(file_name + '.tmp', file_name)
+    except OSError as e:
+      sys.stdout.write('Unable to save the memory estimate for {0}: {1}\n'.format(model_dir, str(e)))
+
+  async def sample_memory(self, task, process):
+    probing = task['model_dir'] is not None
+    while process.returncode is None:
+      peak = peak_memory(process.pid)
+      if peak is not None:
+        task['peak_memory'] = max(task['peak_memory'], peak)
+        if probing and (time.time() - task['start_time'] > MEMORY_PROBE_TIME):
+          # Other runs of this model may be able to start now that there's an estimate
+          probing = False
+          self.launch_pending()
+      await asyncio.sleep(MEMORY_SAMPLE_INTERVAL)
+
+  async def run_task(self, task):
+    pid = task['pid']
+    cmd_list = make_cmd_list(task['cmd'], task['args'])
+    self.append_output(task, 'Running task {0}: {1}\n  wd: {2}\n\n'.format(pid, str(cmd_list), task['wd']), sys.stdout)
+    if self.notify:
+      sys.stdout.write('Starting task {0} {1}\n'.format(pid, task['cmd']))
+    rc = None
+    try:
+      process = await asyncio.create_subprocess_exec(*cmd_list, cwd=task['wd'], env=task['env'],
+          stdin=asp.DEVNULL, stdout=asp.PIPE, stderr=asp.PIPE, limit=MAX_LINE_BYTES)
+    except (OSError, ValueError) as e:
+      self.append_output(task, 'Unable to start task {0}: {1}\n'.format(pid, str(e)), sys.stderr)
+      task['status'] = 'died'
+    else:
+      task['process'] = process
+      self.append_output(task, 'Task {0} is process {1}\n'.format(pid, process.pid), sys.stdout)
+      if task['status'] == 'died':
+        # The task was killed while its process was being started
+        process.terminate()
+      sampler = self.loop.create_task(self.sample_memory(task, process))
+      await asyncio.gather(self.read_stream(task, process.stdout, sys.stdout),
+                           self.read_stream(task, process.stderr, sys.stderr))
+      rc = await process.wait()
+      sampler.cancel()
       if task['status'] != 'died':
         if rc == 0:
           task['status'] = 'completed'
@@ -209,51 +549,167 @@ class SimQueue:
           task['status'] = 'mcell_error'
         else:
           task['status'] = 'died'
-      if self.notify:
-        sys.stdout.write('Task PID {0}  status: {1}  return code: {2}\n'.format(pid, task['status'], rc))
-      self.work_q.task_done()
-    sys.stdout.write('Worker thread %s exiting\n' % (threading.currentThread().getName()))
+    task['log'].finish()
+    if self.notify:
+      sys.stdout.write('Task {0}  status: {1}  return code: {2}\n'.format(pid, task['status'], rc))
+    if (task['on_completed'] is not None) and (task['status'] == 'completed'):
+      try:
+        task['on_completed']()
+      except Exception as e:
+        sys.stdout.write('Completion function of task {0} failed: {1}\n'.format(pid, str(e)))
+    if (task['model_dir'] is not None) and (task['status'] == 'completed') and (task['peak_memory'] > 0):
+      self.save_memory_estimate(task['model_dir'], task['peak_memory'])
+    with self.lock:
+      self.running.pop(pid)
+      self.cores_in_use -= task['cores']
+      self.group_running[task['group']] -= 1
+    self.launch_pending()
+
+  async def read_stream(self, task, stream, pipe):
+    while True:
+      try:
+        line = await stream.readline()
+      except ValueError:
+        # The line is longer than the stream limit, so take what has been buffered
+        line = await stream.read(MAX_LINE_BYTES)
+      if not line:
+        break
+      line = line.decode('utf-8', errors='replace')
+      self.append_output(task, line, pipe)
 
-  def clear_queue(self):
-    with self.work_q.mutex:
-      self.work_q.queue.clear()
+  def append_output(self, task, text, pipe):
+    if self.notify:
+      pipe.write(text)
+      pipe.flush()
+    for line in text.splitlines(True):
+      task['log'].append(line)
+      if pipe is sys.stderr:
+        task['errors'].append(line)
+
+  def get_log_dir(self):
+    if self.log_dir is None:
+      self.log_dir = tempfile.mkdtemp(prefix='cellblender_task_logs_')
+      self.own_log_dir = True
+    return self.log_dir
+
+  def update_texts(self):
+    """ Copy new log lines into the Blender texts of tasks (a bpy.app.timers function) """
+    if self.evnt_bl_text_quit.is_set():
+      self.text_timer_running = False
+      return None
+    active = False
+    for task in list(self.task_dict.values()):
+      if task['bl_text'] is None:
+        continue
+      try:
+        self.update_text(task)
+      except ReferenceError:
+        # The text was removed by the user
+        task['bl_text'] = None
+        continue
+      if task['status'] in ('queued', 'running'):
+        active = True
+    if not active:
+      # Everything has been copied, so stop until the next task with a text is added
+      self.text_timer_running = False
+      return None
+    return TEXT_UPDATE_INTERVAL
+
+  def update_text(self, task):
+    bl_text = task['bl_text']
+    log = task['log']
+    num_lines = len(log)
+    new_lines = num_lines - task['text_end']
+    if new_lines <= 0:
+      return
+    if task['text_lines'] + new_lines > self.max_output_lines:
+      # Start over with the most recent half of the limit so the text stays bounded
+      lines = log.tail(self.max_output_lines // 2, skip=len(log) - num_lines)
+      bl_text.clear()
+      first = num_lines - len(lines)
+      if first > 0:
+        bl_text.write('[{0} earlier lines not shown]\n'.format(first))
+      task['text_lines'] = len(lines)
+    else:
+      lines = log.get_lines(task['text_end'], num_lines)
+      task['text_lines'] += len(lines)
+    bl_text.write(''.join(lines))
+    bl_text.current_line_index=len(bl_text.lines)-1
+    task['text_end'] = num_lines
 
-  def add_task(self,cmd,args,wd,make_texts=True,env=None):
-    import bpy
-    process = sp.Popen([self.python_exec, self.run_wrapper, wd], env=env, bufsize=1, shell=False, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.PIPE)
-    pid = process.pid
-    self.task_dict[pid] = {}
-    self.task_dict[pid]['process'] = process
-    self.task_dict[pid]['cmd'] = cmd
-    self.task_dict[pid]['args'] = args
-    self.task_dict[pid]['status'] = 'queued'
-    self.task_dict[pid]['stdout'] = b''
-    self.task_dict[pid]['stderr'] = b''
-    self.task_dict[pid]['output'] = []
+  def clear_queue(self):
+    with self.lock:
+      for pid in self.pending:
+        task = self.task_dict.get(pid)
+        if (task is not None) and (task['status'] == 'queued'):
+          task['status'] = 'died'
+      self.pending.clear()
+
+  def add_task(self,cmd,args,wd,make_texts=True,env=None,priority=0,group=None,model_dir=None,cores=1,on_completed=None):
+    """ Queue a task and return its task id (the key of the task in task_dict)
+
+    If on_completed is given, it's called (from the supervisor thread) when the task completes successfully.
+    """
+    if (model_dir is not None) and not (model_dir in self.memory_estimates):
+      self.load_memory_estimate(model_dir)
+    with self.lock:
+      pid = self.next_task_id
+      self.next_task_id += 1
+    task = {}
+    task['pid'] = pid
+    task['process'] = None
+    task['cmd'] = cmd
+    task['args'] = args
+    task['wd'] = wd
+    task['env'] = env
+    task['priority'] = priority
+    task['group'] = group
+    task['model_dir'] = model_dir
+    task['cores'] = cores
+    task['on_completed'] = on_completed
+    task['peak_memory'] = 0
+    task['start_time'] = None
+    task['status'] = 'queued'
+    task['log'] = TaskLog(self.max_output_lines, os.path.join(self.get_log_dir(), 'task_%d.log' % pid))
+    task['errors'] = TaskLog(ERROR_TAIL_LINES)
+    task['text_end'] = 0     # Number of log lines copied into the Blender text
+    task['text_lines'] = 0   # Number of log lines currently in the Blender text
     if make_texts:
+      import bpy
       task_name = 'task_%d_output' % pid
       bl_t = bpy.data.texts.new ( task_name )
       bl_t.name = task_name   # This may be redundant now, but it was done in the previous version
-      self.task_dict[pid]['bl_text'] = bl_t
+      task['bl_text'] = bl_t
+      if not self.text_timer_running:
+        self.text_timer_running = True
+        bpy.app.timers.register(self.update_texts, first_interval=TEXT_UPDATE_INTERVAL, persistent=True)
     else:
-      self.task_dict[pid]['bl_text'] = None
-    self.work_q.put(self.task_dict[pid])
-    return process
+      task['bl_text'] = None
+    with self.lock:
+      self.task_dict[pid] = task
+      self.pending.append(pid)
+    if self.loop is not None:
+      self.loop.call_soon_threadsafe(self.launch_pending)
+    return pid
 
   def kill_task(self,pid):
-    if self.task_dict.get(pid):
-      task = self.task_dict[pid]
-      if task['status'] == 'running':
-        proc = task['process']
-        proc.terminate()
-        task['status'] = 'died'
-      elif task['status'] == 'queued':
-        with self.work_q.mutex:
-          self.work_q.queue.remove(task)
-        proc = task['process']
-        proc.terminate()
-        task['status'] = 'died'
-        self.work_q.task_done()
+    task = self.task_dict.get(pid)
+    if task:
+      with self.lock:
+        status = task['status']
+        if status in ('queued', 'running'):
+          task['status'] = 'died'
+      if status == 'running':
+        # A queued task has no process, and run_task terminates processes that are still starting
+        self.loop.call_soon_threadsafe(self.terminate_process, task)
+
+  def terminate_process(self, task):
+    process = task['process']
+    if (process is not None) and (process.returncode is None):
+      try:
+        process.terminate()
+      except ProcessLookupError:
+        pass
 
   def clear_task(self,pid):
     import bpy
@@ -263,46 +719,42 @@ class SimQueue:
         if self.task_dict[pid]['bl_text'].name:
           if self.task_dict[pid]['bl_text'].name in bpy.data.texts:
             bpy.data.texts.remove(self.task_dict[pid]['bl_text'], do_unlink=True)
+      self.task_dict[pid]['log'].close()
       self.task_dict.pop(pid)
 
+  def wait(self):
+    """ Block until no tasks are queued or running """
+    while True:
+      with self.lock:
+        queued = [ pid for pid in self.pending if self.task_dict.get(pid, {}).get('status') == 'queued' ]
+        if (len(self.running) == 0) and (len(queued) == 0):
+          return
+      time.sleep(0.1)
+
   def shutdown(self):
     self.evnt_bl_text_quit.set()
 
     sys.stdout.write("Shutting down simulation queue...\n")
 
-    # Send stop signal to worker threads
-    for i in range(self.n_threads):
-      sys.stdout.write('Stopping thread %s\n' % (self.workers[i].getName()))
-      self.work_q.put(None)
-
-    pids = list(self.task_dict.keys())
-
-    # Dequeue waiting tasks
-    for pid in pids:
-      task = self.task_dict[pid]
-      if task['status'] == 'queued':
-        with self.work_q.mutex:
-          self.work_q.queue.remove(task)
-        proc = task['process']
-        proc.terminate()
-        task['status'] = 'died'
-        self.work_q.task_done()
-
-    # Terminate running tasks
-    for pid in pids:
-      task = self.task_dict[pid]
-      if task['status'] == 'running':
-        proc = task['process']
-        proc.terminate()
-        task['status'] = 'died'
-
-    # Now wait for workers to finish and exit
-    sys.stdout.write('Waiting for simulation threads to exit...\n')
-    for worker in self.workers:
-      worker.join()
-
-    sys.stdout.write('Waiting for simulation queue to exit...\n')
-    self.work_q.join()
+    # Dequeue waiting tasks and terminate running tasks
+    self.clear_queue()
+    for pid in list(self.task_dict.keys()):
+      self.kill_task(pid)
+
+    if self.loop is not None:
+      sys.stdout.write('Waiting for simulation tasks to exit...\n')
+      deadline = time.time() + SHUTDOWN_TIMEOUT
+      while (len(self.running) > 0) and (time.time() < deadline):
+        time.sleep(0.05)
+      self.loop.call_soon_threadsafe(self.loop.stop)
+      self.loop_thread.join()
+      self.loop = None
+
+    for task in self.task_dict.values():
+      task['log'].close()
+    if self.own_log_dir:
+      shutil.rmtree(self.log_dir, ignore_errors=True)
+      self.log_dir = None
 
     sys.stdout.write("Done shutting down simulation queue.\n")
     sys.stdout.flush()
@@ -331,19 +783,19 @@ if (__name__ == '__main__'):
   begin = time.time()
 
   wd = './sim_runner_test_files/mcell'
-  my_q.add_task('mcell3.2.1 -iterations 5000 -seed 1 Scene.main.mdl',wd)
-  my_q.add_task('mcell3.2.1 -iterations 5000 -seed 2 Scene.main.mdl',wd)
-  my_q.add_task('mcell3.2.1 -iterations 5000 -seed 3 Scene.main.mdl',wd)
-  my_q.add_task('mcell3.2.1 -iterations 5000 -seed 4 Scene.main.mdl',wd)
+  my_q.add_task('mcell3.2.1', '-iterations 5000 -seed 1 Scene.main.mdl', wd, make_texts=False)
+  my_q.add_task('mcell3.2.1', '-iterations 5000 -seed 2 Scene.main.mdl', wd, make_texts=False)
+  my_q.add_task('mcell3.2.1', '-iterations 5000 -seed 3 Scene.main.mdl', wd, make_texts=False)
+  my_q.add_task('mcell3.2.1', '-iterations 5000 -seed 4 Scene.main.mdl', wd, make_texts=False)
 
   time.sleep(5.)
 
   pids = list(my_q.task_dict.keys())
   pids.sort()
   a_pid = pids[2]
-  my_q.task_dict[a_pid]['process'].terminate()
+  my_q.kill_task(a_pid)
 
-  my_q.work_q.join()
+  my_q.wait()
 
 #  time.sleep(0.5)
 
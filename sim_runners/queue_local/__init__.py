@@ -65,6 +65,9 @@ from cellblender.cellblender_utils import mcell_files_path
 from multiprocessing import cpu_count
 
 
+# Most recent lines of a task's output passed to the engine's progress parser and drawn in the overlay
+PROGRESS_TAIL_LINES = 500
+
 handler_list = []
 screen_display_lines = {}
 scroll_offset = 0
@@ -298,7 +301,7 @@ def run_commands ( commands ):
             error_file_option = mcell.run_simulation.error_file
             log_file_option = mcell.run_simulation.log_file
             cellblender.simulation_queue.python_exec = python_path
-            cellblender.simulation_queue.start(num_mcell_processes)
+            cellblender.simulation_queue.start(num_mcell_processes, cellblender_simulation.get_max_memory(mcell.run_simulation))
             cellblender.simulation_queue.notify = True
 
             # The following line will create the "data_layout.json" file describing the directory structure
@@ -340,18 +343,18 @@ def run_commands ( commands ):
               #mcell_args = '-seed %d %s' % (seed, mdl_filename)
               make_texts = mcell.run_simulation.save_text_logs
 
-              proc = None
+              task_id = None
               if type(cmd) == type('str'):
-                  proc = cellblender.simulation_queue.add_task(cmd, "", os.path.join(project_dir, "output_data"), make_texts)
+                  task_id = cellblender.simulation_queue.add_task(cmd, "", os.path.join(project_dir, "output_data"), make_texts, model_dir=project_dir)
               elif type(cmd) == type({'a':1}):
-                  proc = cellblender.simulation_queue.add_task(cmd['cmd'], ' '.join(cmd['args']), cmd['wd'], make_texts)
-              # Save the module in the engine_module_dict by PID
-              cellblender_simulation.engine_module_dict[proc.pid] = cellblender_simulation.active_engine_module
+                  task_id = cellblender.simulation_queue.add_task(cmd['cmd'], ' '.join(cmd['args']), cmd['wd'], make_texts, model_dir=project_dir)
+              # Save the module in the engine_module_dict by task id
+              cellblender_simulation.engine_module_dict[task_id] = cellblender_simulation.active_engine_module
 
               # self.report({'INFO'}, "Simulation Running")
 
               if not simulation_process.name:
-                  simulation_process.name = ("PID: %d, Index: %d" % (proc.pid, run_index))
+                  simulation_process.name = ("Task: %d, Index: %d" % (task_id, run_index))
               bpy.ops.mcell.percentage_done_timer()
 
     else:
@@ -398,16 +401,16 @@ class MCELL_QL_percentage_done_timer(bpy.types.Operator):
                         #else:
                         #    stdout_txt = q_item['bl_text'].as_string()
                         #    (progress_message, task_complete) = em.get_progress_message_and_status ( stdout_txt )
-                        stdout_txt = q_item['bl_text'].as_string()
+                        stdout_txt = ''.join ( q_item['log'].tail(PROGRESS_TAIL_LINES) )
                         (progress_message, task_complete) = em.get_progress_message_and_status ( stdout_txt )
                     else:
                         # Engine doesn't support progress, so just show its own name as progress
                         progress_message = em.plug_name
-                    if stdout_txt == None:
-                        # It didn't get filled above, so fill it now
-                        stdout_txt = q_item['bl_text'].as_string()
                     global accumulate_text
                     if accumulate_text:
+                        if stdout_txt == None:
+                            # It didn't get filled above, so fill it now
+                            stdout_txt = ''.join ( q_item['log'].tail(PROGRESS_TAIL_LINES) )
                         global screen_display_lines
                         screen_display_lines[str(pid)] = stdout_txt.split("\n")  # Just copy each run for now ... only the last will be stable
                         screen_display_lines[str(pid)].reverse() # Reverse since they'll be drawn from the bottom up
@@ -415,7 +418,7 @@ class MCELL_QL_percentage_done_timer(bpy.types.Operator):
                 if progress_message == None:
                     progress_message = ""
 
-                simulation_process.name = "PID: %d" % (pid)
+                simulation_process.name = "Task: %d" % (pid)
                 if progress_message != None:
                     if len(progress_message) > 0:
                         simulation_process.name = simulation_process.name + ", " + progress_message